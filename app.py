@@ -1,25 +1,116 @@
 import os
+import time
 import logging
 import tempfile
 import shutil
 import uuid
 import zipfile
-from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, send_file, flash, redirect, url_for, stream_with_context
 from werkzeug.middleware.proxy_fix import ProxyFix
 from utils.downloader import M3U8Downloader, BatchDownloader, VideoStreamExtractor
+from utils.segment_cache import get_segment_cache
+from utils.result_cache import OutputCache, DEFAULT_OUTPUT_TTL, DEFAULT_OUTPUT_BYTES
+from utils.jobs import JobManager, JobQueueFull
+from utils.events import DEFAULT_MAX_STREAM_SECONDS, progress_broker
+from utils.http_pool import get_connection_pools
+from utils.scheduler import get_scheduler
+from utils.transfer import get_buffer_pool
+from utils.janitor import Janitor, DEFAULT_INTERVAL, DEFAULT_RECORD_TTL
+from utils.page_cache import DEFAULT_PAGE_TTL
+from utils.metrics import metrics
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; DEBUG logs every segment request and progress step, which costs time on big jobs
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-# Initialize downloaders and extractor
-downloader = M3U8Downloader()
+# Initialize downloaders and extractor; background jobs checkpoint their segments so they survive restarts
+CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', os.path.join(tempfile.gettempdir(), 'm3u8_checkpoints'))
+downloader = M3U8Downloader(checkpoint_dir=CHECKPOINT_DIR)
 batch_downloader = BatchDownloader()
-stream_extractor = VideoStreamExtractor()
+stream_extractor = VideoStreamExtractor(
+    page_ttl=int(os.environ.get('PAGE_CACHE_TTL', DEFAULT_PAGE_TTL)),
+    extract_deadline=float(os.environ.get('EXTRACT_DEADLINE', 15))
+)
+
+# Finished outputs shared by identical /download requests
+output_cache = OutputCache(
+    ttl=int(os.environ.get('OUTPUT_CACHE_TTL', DEFAULT_OUTPUT_TTL)),
+    max_bytes=int(os.environ.get('OUTPUT_CACHE_MAX_BYTES', DEFAULT_OUTPUT_BYTES))
+)
+
+# Background executor for asynchronous single downloads
+job_manager = JobManager(downloader, max_workers=int(os.environ.get('DOWNLOAD_JOB_WORKERS', 4)))
+
+# Jobs running in another worker are followed through the job store at this interval (seconds)
+REMOTE_POLL_INTERVAL = 1.0
+
+# Each open progress stream occupies a (sync) server worker, so streams end after this long and the browser reconnects
+SSE_MAX_SECONDS = float(os.environ.get('SSE_MAX_SECONDS', DEFAULT_MAX_STREAM_SECONDS))
+
+# Expire finished jobs, batches, outputs and idle cached segments, and keep workspaces within the disk budget
+disk_budget = os.environ.get('DISK_BUDGET_BYTES')
+segment_cache = get_segment_cache()
+janitor = Janitor(
+    [downloader, job_manager, batch_downloader, output_cache, segment_cache],
+    [downloader.temp_dir, batch_downloader.temp_dir, output_cache.cache_dir, CHECKPOINT_DIR, segment_cache.cache_dir],
+    ttl=int(os.environ.get('JOB_RECORD_TTL', DEFAULT_RECORD_TTL)),
+    max_bytes=int(disk_budget) if disk_budget else None,
+    interval=int(os.environ.get('JANITOR_INTERVAL', DEFAULT_INTERVAL))
+)
+janitor.start()
+
+# Point-in-time values for /metrics, read when it is scraped
+metrics.gauge('m3u8_jobs', 'Background jobs held by this process, by status', ['status'],
+              callback=lambda: {(status,): count for status, count in job_manager.counts().items()})
+metrics.gauge('m3u8_batches_active', 'Batches still processing in this process',
+              callback=lambda: sum(1 for batch in list(batch_downloader.batch_data.values())
+                                   if batch['status'] == 'processing'))
+metrics.gauge('m3u8_scheduler_slots', 'Scheduler fetch and merge slots, by pool and state', ['pool', 'state'],
+              callback=lambda: {
+                  (pool, state): stats[state]
+                  for pool, stats in get_scheduler().stats().items() if isinstance(stats, dict)
+                  for state in ('limit', 'active', 'waiting')
+              })
+metrics.gauge('m3u8_transfer_buffers_in_use', 'Transfer buffers currently borrowed',
+              callback=lambda: get_buffer_pool().stats()['in_use'])
+
+
+def download_job(url, live=False, max_duration=None):
+    """Job function for JobManager.submit: extract the stream if url is a webpage, then download or record it"""
+    def run(task_id):
+        m3u8_url = url
+        
+        # Extraction also runs in the background, it can take as long as the download
+        if not url.endswith('.m3u8'):
+            downloader.update_progress(task_id, 5, 'Extracting video streams from webpage...')
+            with downloader.stage(task_id, 'extract'):
+                m3u8_links = stream_extractor.extract_m3u8_from_webpage(url)
+            if not m3u8_links:
+                raise Exception('No video streams found on this webpage. Please check the URL or try a direct M3U8 link.')
+            m3u8_url = m3u8_links[0]
+            logging.info(f"Using extracted M3U8 URL: {m3u8_url}")
+        
+        if live:
+            # Every recording captures a different stretch of the stream, so it bypasses the output cache
+            return downloader.record_live(m3u8_url, task_id=task_id, max_duration=max_duration)
+        
+        # A job coalesced onto an identical in-flight download reports that download's progress
+        return output_cache.get_or_create(
+            m3u8_url, lambda: downloader.download_and_merge(m3u8_url, task_id=task_id, resumable=True),
+            owner=task_id, follow=lambda leader_id: downloader.follow_progress(leader_id, task_id)
+        )
+    
+    return run
+
+
+# Downloads cut short by a crash or deploy continue from their checkpoints under their old task IDs
+for interrupted_id, interrupted_url in downloader.claim_interrupted():
+    logging.info(f"Resuming interrupted download {interrupted_id}")
+    job_manager.submit(download_job(interrupted_url), interrupted_url, task_id=interrupted_id)
 
 @app.route('/')
 def index():
@@ -65,6 +156,8 @@ def download_video():
         data = request.get_json()
         url = data.get('url', '').strip()
         mode = data.get('mode', 'direct').strip()  # 'direct', 'extract', 'auto'
+        stream = bool(data.get('stream', False))
+        container = data.get('container', 'mp4').strip()  # 'mp4' (fragmented) or 'ts', stream mode only
         
         if not url:
             return jsonify({'error': 'Please provide a valid URL'}), 400
@@ -98,9 +191,28 @@ def download_video():
                     'error': f'Failed to extract video from webpage: {str(e)}'
                 }), 500
         
+        if stream:
+            if container not in ('mp4', 'ts'):
+                return jsonify({'error': 'Container must be mp4 or ts'}), 400
+            
+            # Send the video while segments are still arriving instead of waiting for the merge
+            logging.info(f"Starting streaming download for URL: {m3u8_url}")
+            chunks = downloader.stream_and_merge(m3u8_url, container=container)
+            filename = f"video_{int(time.time())}.{container}"
+            
+            return Response(
+                stream_with_context(chunks),
+                mimetype='video/mp4' if container == 'mp4' else 'video/mp2t',
+                headers={'Content-Disposition': f'attachment; filename={filename}'}
+            )
+        
         # Download and process the video
         logging.info(f"Starting download for URL: {m3u8_url}")
-        output_file = downloader.download_and_merge(m3u8_url)
+        # Concurrent requests for the same playlist share one job; finished outputs are reused
+        task_id = downloader.new_task_id()
+        output_file = output_cache.get_or_create(
+            m3u8_url, lambda: downloader.download_and_merge(m3u8_url, task_id=task_id), owner=task_id
+        )
         
         if output_file and os.path.exists(output_file):
             # Generate a clean filename
@@ -120,6 +232,102 @@ def download_video():
         logging.error(f"Download error: {str(e)}")
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a single download and return its task ID immediately"""
+    try:
+        data = request.get_json()
+        url = data.get('url', '').strip()
+        mode = data.get('mode', 'direct').strip()  # 'direct', 'auto'
+        # Live streams are recorded until they end, max_duration seconds, or /jobs/<task_id>/cancel
+        live = bool(data.get('live', False))
+        max_duration = data.get('max_duration')
+        
+        if not url:
+            return jsonify({'error': 'Please provide a valid URL'}), 400
+        
+        # Validate URL format
+        if not url.startswith(('http://', 'https://')):
+            return jsonify({'error': 'URL must start with http:// or https://'}), 400
+        
+        if not url.endswith('.m3u8') and mode == 'direct':
+            return jsonify({'error': 'URL must be a valid M3U8 playlist file'}), 400
+        
+        if max_duration is not None:
+            try:
+                max_duration = float(max_duration)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'max_duration must be a number of seconds'}), 400
+        
+        task_id = job_manager.submit(download_job(url, live, max_duration), url, kind='recording' if live else 'download')
+        
+        return jsonify({'task_id': task_id, 'status': 'queued'}), 202
+        
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logging.error(f"Job submission error: {str(e)}")
+        return jsonify({'error': f'Failed to start download: {str(e)}'}), 500
+
+@app.route('/jobs/<task_id>')
+def get_job_status(task_id):
+    """Get status and progress of an asynchronous download"""
+    job = job_manager.get_job(task_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify(job)
+
+@app.route('/jobs/<task_id>/cancel', methods=['POST'])
+def cancel_job(task_id):
+    """Stop a live recording; what was recorded so far becomes the job's result"""
+    job = job_manager.get_job(task_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job.get('kind') != 'recording' or job['status'] in ('completed', 'failed') or not downloader.cancel(task_id):
+        return jsonify({'error': 'Job is not recording', 'status': job['status']}), 409
+    
+    return jsonify({'task_id': task_id, 'status': 'stopping'}), 202
+
+@app.route('/jobs/<task_id>/retry', methods=['POST'])
+def retry_job(task_id):
+    """Run a failed download again under its task ID, refetching only segments its checkpoint lacks"""
+    job = job_manager.get_job(task_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job.get('kind', 'download') != 'download' or job['status'] != 'failed':
+        return jsonify({'error': 'Only failed downloads can be retried', 'status': job['status']}), 409
+    
+    try:
+        job_manager.submit(download_job(job['url']), job['url'], task_id=task_id)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    
+    return jsonify({'task_id': task_id, 'status': 'queued'}), 202
+
+@app.route('/jobs/<task_id>/result')
+def download_job_result(task_id):
+    """Download the output of a completed asynchronous download"""
+    job = job_manager.get_job(task_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    output_file = job_manager.get_output_file(task_id)
+    if not output_file:
+        return jsonify({'error': 'Job is not ready for download', 'status': job['status']}), 409
+    
+    if not os.path.exists(output_file):
+        return jsonify({'error': 'Output file is no longer available'}), 410
+    
+    return send_file(
+        output_file,
+        as_attachment=True,
+        download_name=f"video_{int(job['finished_at'])}.mp4",
+        mimetype='video/mp4'
+    )
+
 @app.route('/progress/<task_id>')
 def get_progress(task_id):
     """Get download progress for a specific task"""
@@ -178,6 +386,52 @@ def get_batch_status(batch_id):
         logging.error(f"Batch status error: {str(e)}")
         return jsonify({'error': f'Failed to get batch status: {str(e)}'}), 500
 
+@app.route('/events/batch/<batch_id>')
+def stream_batch_events(batch_id):
+    """Server-Sent Events stream of batch progress deltas"""
+    if not batch_downloader.get_batch_status(batch_id):
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    def snapshot():
+        batch = batch_downloader.get_batch_status(batch_id)
+        downloads = {
+            download_id: {key: value for key, value in download.items() if key != 'output_file'}
+            for download_id, download in batch['downloads'].items()
+        }
+        summary = {key: batch[key] for key in ('status', 'completed_count', 'failed_count', 'total_count')}
+        return {'batch': summary, **downloads}
+    
+    def is_finished():
+        return batch_downloader.get_batch_status(batch_id)['status'] != 'processing'
+    
+    return Response(
+        stream_with_context(progress_broker.stream(
+            f'batch:{batch_id}', snapshot, is_finished,
+            poll_interval=None if batch_downloader.is_local(batch_id) else REMOTE_POLL_INTERVAL,
+            max_seconds=SSE_MAX_SECONDS
+        )),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/events/jobs/<task_id>')
+def stream_job_events(task_id):
+    """Server-Sent Events stream of single download progress deltas"""
+    if not job_manager.get_job(task_id):
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return Response(
+        stream_with_context(progress_broker.stream(
+            f'task:{task_id}',
+            lambda: {'job': job_manager.get_job(task_id)},
+            lambda: job_manager.is_finished(task_id),
+            poll_interval=None if job_manager.is_local(task_id) else REMOTE_POLL_INTERVAL,
+            max_seconds=SSE_MAX_SECONDS
+        )),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/batch-download/<batch_id>')
 def download_batch_zip(batch_id):
     """Download all videos in a batch as a ZIP file"""
@@ -192,25 +446,59 @@ def download_batch_zip(batch_id):
         if batch_status['completed_count'] == 0:
             return jsonify({'error': 'No videos were successfully downloaded'}), 400
         
-        # Create ZIP file
-        zip_path = batch_downloader.create_batch_zip(batch_id)
-        if not zip_path or not os.path.exists(zip_path):
-            return jsonify({'error': 'Failed to create batch ZIP file'}), 500
-        
         # Generate filename
         filename = f"m3u8_batch_{batch_id[:8]}_{batch_status['completed_count']}_videos.zip"
         
-        return send_file(
-            zip_path,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/zip'
+        # Stream the archive as it is built; no temporary ZIP on disk
+        return Response(
+            stream_with_context(batch_downloader.iter_batch_zip(batch_id)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
         )
         
     except Exception as e:
         logging.error(f"Batch download error: {str(e)}")
         return jsonify({'error': f'Batch download failed: {str(e)}'}), 500
 
+@app.route('/cache-stats')
+def get_cache_stats():
+    """Get segment, output and extraction cache usage and hit/miss counters"""
+    return jsonify({
+        'segment_cache': segment_cache.stats(),
+        'output_cache': output_cache.stats(),
+        'extraction_cache': stream_extractor.cache_stats()
+    })
+
+@app.route('/connection-stats')
+def get_connection_stats():
+    """Get the adaptive concurrency limit and latency per origin"""
+    return jsonify(get_connection_pools().stats())
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus text-format metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/scheduler-stats')
+def get_scheduler_stats():
+    """Get global fetch and merge slot usage, bandwidth throttling and transfer buffer memory"""
+    stats = get_scheduler().stats()
+    stats['transfer_memory'] = get_buffer_pool().stats()
+    return jsonify(stats)
+
+@app.route('/usage')
+def get_usage():
+    """Get disk usage of workspaces and outputs and the number of records held in memory"""
+    return jsonify({
+        'disk': janitor.usage(),
+        'records': {
+            'progress': len(downloader.progress_data),
+            'jobs': len(job_manager.jobs),
+            'batches': len(batch_downloader.batch_data)
+        },
+        'job_store': downloader.job_store.stats() if downloader.job_store else None
+    })
+
 # PWA Routes
 @app.route('/manifest.json')
 def serve_manifest():
@@ -0,0 +1,346 @@
+"""Synthetic HLS origin for benchmarks
+
+Serves generated playlists and segments from a local HTTP server so downloads can be
+measured without depending on a real CDN. Latency, jitter, bandwidth and error rate
+are applied per request. URLs (relative to the origin's base URL):
+
+    vod/<count>.m3u8          media playlist with count segments and EXT-X-ENDLIST
+    byterange/<count>.m3u8    count EXT-X-BYTERANGE segments of one resource
+    master/<count>.m3u8       three variants, each a vod/<count>.m3u8 playlist
+    live/<window>.m3u8        sliding window that gains one segment per segment duration
+    page/<iframes>.html       webpage with a <video> link and iframes that embed more links
+
+Any query string on a playlist is carried over to its segment URIs, so runs can use
+unique URLs and never hit the segment cache.
+"""
+import os
+import random
+import re
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+TS_PACKET_SIZE = 188
+# MPEG-TS null packet header (PID 0x1FFF); decoders skip these, so they make valid padding
+TS_NULL_HEADER = b'\x47\x1f\xff\x10'
+
+DEFAULT_SEGMENT_BYTES = 512 * 1024
+DEFAULT_SEGMENT_DURATION = 2.0
+
+
+def generate_media(segment_format='ts', duration=DEFAULT_SEGMENT_DURATION):
+    """Encode one segment of test video with ffmpeg
+
+    Returns (init_bytes, segment_bytes); init_bytes is None for TS. Without a working
+    ffmpeg, TS falls back to null packets, which download fine but cannot be remuxed.
+    """
+    with tempfile.TemporaryDirectory(prefix='m3u8_bench_media_') as work_dir:
+        path = os.path.join(work_dir, 'media.' + segment_format)
+        source = ['-f', 'lavfi', '-i', f'testsrc2=duration={duration}:size=640x360:rate=25']
+        if segment_format == 'ts':
+            output = ['-c:v', 'mpeg2video', '-f', 'mpegts', path]
+        else:
+            output = ['-c:v', 'mpeg4', '-g', '1000', '-f', 'mp4',
+                      '-movflags', 'frag_keyframe+empty_moov+default_base_moof', path]
+        try:
+            subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', *source, *output],
+                           check=True, capture_output=True, timeout=60)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (OSError, subprocess.SubprocessError):
+            if segment_format != 'ts':
+                raise
+            return None, TS_NULL_HEADER + bytes(TS_PACKET_SIZE - len(TS_NULL_HEADER))
+
+    if segment_format == 'ts':
+        return None, data
+    # Split the fragmented MP4 into its init segment (ftyp+moov) and first fragment (moof+mdat)
+    boxes = []
+    position = 0
+    while position + 8 <= len(data):
+        size, box_type = struct.unpack('>I4s', data[position:position + 8])
+        boxes.append((box_type, data[position:position + size]))
+        position += size
+    init = b''.join(box for box_type, box in boxes if box_type in (b'ftyp', b'moov'))
+    moof = next(index for index, (box_type, _) in enumerate(boxes) if box_type == b'moof')
+    return init, boxes[moof][1] + boxes[moof + 1][1]
+
+
+class OriginStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.segment_requests = 0
+        self.bytes_sent = 0
+        self.errors_injected = 0
+        self.first_segment_at = None  # wall clock, comparable across processes on one host
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'segment_requests': self.segment_requests,
+                'bytes_sent': self.bytes_sent,
+                'errors_injected': self.errors_injected,
+                'first_segment_at': self.first_segment_at
+            }
+
+    def reset(self):
+        with self.lock:
+            self.requests = self.segment_requests = self.bytes_sent = self.errors_injected = 0
+            self.first_segment_at = None
+
+
+class SyntheticOrigin:
+    """Local HLS origin with configurable latency, jitter, bandwidth and error rate
+
+    latency and jitter are seconds added before every response (jitter is uniform in
+    +/- jitter), bandwidth caps each response in bytes per second, and error_rate is the
+    fraction of segment requests answered with a 503.
+    """
+
+    def __init__(self, segment_format='ts', segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 segment_duration=DEFAULT_SEGMENT_DURATION, latency=0.0, jitter=0.0, bandwidth=None,
+                 error_rate=0.0, seed=0, host='127.0.0.1', port=0):
+        if segment_format not in ('ts', 'fmp4'):
+            raise ValueError(f"Unknown segment format: {segment_format}")
+        self.segment_format = segment_format
+        self.segment_duration = segment_duration
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.stats = OriginStats()
+        self.started_at = time.time()
+
+        self.init_segment, media = generate_media(segment_format, segment_duration)
+        # Padding comes in whole TS packets or as one 'free' box of at least 8 bytes
+        padding = max(0, segment_bytes - len(media))
+        if segment_format == 'ts':
+            padding -= padding % TS_PACKET_SIZE
+        elif padding < 8:
+            padding = 0
+        self.segment_bytes = len(media) + padding
+        self.media = media
+
+        handler = type('Handler', (_OriginHandler,), {'origin': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def url(self, path):
+        return self.base_url + path.lstrip('/')
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='synthetic-origin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def segment(self, index):
+        """Body of segment index: the encoded media padded to segment_bytes with index-specific filler"""
+        padding = self.segment_bytes - len(self.media)
+        if not padding:
+            return self.media
+        if self.segment_format == 'ts':
+            packets = padding // TS_PACKET_SIZE
+            payload = struct.pack('>I', index) * ((TS_PACKET_SIZE - len(TS_NULL_HEADER)) // 4)
+            filler = (TS_NULL_HEADER + payload) * packets
+            return self.media + filler
+        # An ISO BMFF 'free' box is ignored by demuxers
+        payload = struct.pack('>I', index) * ((padding - 8) // 4)
+        payload += bytes(padding - 8 - len(payload))
+        return self.media + struct.pack('>I4s', padding, b'free') + payload
+
+    def delay(self):
+        with self.random_lock:
+            jitter = self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(0.0, self.latency + jitter)
+
+    def inject_error(self):
+        if not self.error_rate:
+            return False
+        with self.random_lock:
+            return self.random.random() < self.error_rate
+
+    # Playlists
+
+    def _extension(self):
+        return 'ts' if self.segment_format == 'ts' else 'm4s'
+
+    def _header(self, media_sequence=0):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:7',
+            f'#EXT-X-TARGETDURATION:{int(self.segment_duration + 0.999)}',
+            f'#EXT-X-MEDIA-SEQUENCE:{media_sequence}'
+        ]
+        if self.init_segment is not None:
+            lines.append('#EXT-X-MAP:URI="/init.mp4"')
+        return lines
+
+    def vod_playlist(self, count, query):
+        lines = self._header()
+        for index in range(count):
+            lines += [f'#EXTINF:{self.segment_duration:.3f},', f'/seg/{index}.{self._extension()}{query}']
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def byterange_playlist(self, count, query):
+        lines = self._header()
+        for index in range(count):
+            lines += [
+                f'#EXTINF:{self.segment_duration:.3f},',
+                f'#EXT-X-BYTERANGE:{self.segment_bytes}@{index * self.segment_bytes}',
+                f'/media.{self._extension()}{query}'
+            ]
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def master_playlist(self, count, query):
+        lines = ['#EXTM3U']
+        for bandwidth, height in ((800000, 360), (2500000, 720), (5000000, 1080)):
+            lines += [
+                f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={height * 16 // 9}x{height}',
+                f'/vod/{count}.m3u8{query}'
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def live_playlist(self, window, query):
+        # One new segment per segment duration since the origin started
+        newest = window + int((time.time() - self.started_at) / self.segment_duration)
+        first = newest - window
+        lines = self._header(media_sequence=first)
+        for index in range(first, newest):
+            lines += [f'#EXTINF:{self.segment_duration:.3f},', f'/seg/{index}.{self._extension()}{query}']
+        return '\n'.join(lines) + '\n'
+
+    def page(self, iframes, query):
+        # Links are written the ways real players embed them: tags, JS config and JSON-LD
+        parts = [
+            '<html><head><title>Benchmark page</title>',
+            '<script type="application/ld+json">{"@type": "VideoObject", '
+            f'"contentUrl": "/vod/10.m3u8{query}&ld=1"}}</script></head><body>',
+            f'<video src="/vod/10.m3u8{query}"></video>',
+            f'<script>var player = {{"file": "\\/vod\\/10.m3u8{query}&js=1"}};</script>'
+        ]
+        parts += [f'<iframe src="/frame/{index}.html{query}"></iframe>' for index in range(iframes)]
+        parts.append('</body></html>')
+        return ''.join(parts)
+
+    def frame(self, index, query):
+        return (f'<html><body><source src="/vod/10.m3u8{query}&frame={index}" '
+                f'type="application/x-mpegURL"><iframe src="/frame/{index}.html{query}"></iframe></body></html>')
+
+
+class _OriginHandler(BaseHTTPRequestHandler):
+    origin = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _handle(self, send_body):
+        origin = self.origin
+        parts = urlsplit(self.path)
+        path = parts.path
+        query = '?' + parts.query if parts.query else '?run=0'
+        with origin.stats.lock:
+            origin.stats.requests += 1
+
+        time.sleep(origin.delay())
+
+        match = re.fullmatch(r'/(vod|byterange|master|live)/(\d+)\.m3u8', path)
+        if match:
+            kind, number = match.group(1), int(match.group(2))
+            body = getattr(origin, f'{kind}_playlist')(number, query).encode()
+            return self._send(200, body, 'application/vnd.apple.mpegurl', send_body)
+
+        match = re.fullmatch(r'/page/(\d+)\.html', path)
+        if match:
+            return self._send(200, origin.page(int(match.group(1)), query).encode(), 'text/html', send_body)
+        match = re.fullmatch(r'/frame/(\d+)\.html', path)
+        if match:
+            return self._send(200, origin.frame(int(match.group(1)), query).encode(), 'text/html', send_body)
+
+        if path == '/init.mp4' and origin.init_segment is not None:
+            return self._send(200, origin.init_segment, 'video/mp4', send_body)
+
+        match = re.fullmatch(r'/seg/(\d+)\.(ts|m4s)', path)
+        if match:
+            return self._send_segment(origin.segment(int(match.group(1))), send_body)
+
+        if re.fullmatch(r'/media\.(ts|m4s)', path):
+            return self._send_byterange(send_body)
+
+        self._send(404, b'Not found', 'text/plain', send_body)
+
+    def _send_segment(self, body, send_body, status=200, headers=()):
+        origin = self.origin
+        with origin.stats.lock:
+            origin.stats.segment_requests += 1
+            if origin.stats.first_segment_at is None:
+                origin.stats.first_segment_at = time.time()
+        if origin.inject_error():
+            with origin.stats.lock:
+                origin.stats.errors_injected += 1
+            return self._send(503, b'Injected error', 'text/plain', send_body)
+        content_type = 'video/mp2t' if origin.segment_format == 'ts' else 'video/iso.segment'
+        self._send(status, body, content_type, send_body, headers)
+
+    def _send_byterange(self, send_body):
+        # The resource is segment 0, 1, 2, ... laid end to end; serve the requested window of it
+        origin = self.origin
+        match = re.fullmatch(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if not match:
+            return self._send(416, b'Range required', 'text/plain', send_body)
+        start, end = int(match.group(1)), int(match.group(2))
+        size = origin.segment_bytes
+        chunks = []
+        for index in range(start // size, end // size + 1):
+            segment = origin.segment(index)
+            chunks.append(segment[max(0, start - index * size):end - index * size + 1])
+        headers = [('Content-Range', f'bytes {start}-{end}/*')]
+        self._send_segment(b''.join(chunks), send_body, status=206, headers=headers)
+
+    def _send(self, status, body, content_type, send_body, headers=()):
+        origin = self.origin
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if not send_body:
+            return
+
+        chunk_size = 64 * 1024
+        for position in range(0, len(body), chunk_size):
+            chunk = body[position:position + chunk_size]
+            started = time.monotonic()
+            self.wfile.write(chunk)
+            if origin.bandwidth:
+                # Pace each chunk so the response never exceeds the configured byte rate
+                time.sleep(max(0.0, len(chunk) / origin.bandwidth - (time.monotonic() - started)))
+        with origin.stats.lock:
+            origin.stats.bytes_sent += len(body)
@@ -0,0 +1,241 @@
+"""End-to-end benchmarks against the synthetic origin
+
+    python -m benchmarks.run --workloads single,batch,extract --repeat 3 --output results.json
+
+The origin runs in this process; every workload run happens in a fresh child process
+so its peak RSS is its own. Results are written as JSON (one record per run plus the
+median of every metric per workload) for comparison between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+WORKLOADS = ('single', 'byterange', 'master', 'stream', 'batch', 'extract', 'live')
+
+
+def peak_rss_bytes():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_workload(workload, base_url, token, args):
+    """Run one workload in this process and return its metrics"""
+    from utils.downloader import BatchDownloader, M3U8Downloader, VideoStreamExtractor
+
+    query = f'?run={token}'
+    metrics = {'started_at': time.time()}
+    started = time.monotonic()
+
+    if workload in ('single', 'byterange', 'master', 'stream', 'live'):
+        path = {
+            'single': f'vod/{args.segments}.m3u8',
+            'byterange': f'byterange/{args.segments}.m3u8',
+            'master': f'master/{args.segments}.m3u8',
+            'stream': f'vod/{args.segments}.m3u8',
+            'live': f'live/{args.live_window}.m3u8'
+        }[workload]
+        downloader = M3U8Downloader(max_workers=args.workers, segment_cache=False, job_store=False)
+        try:
+            if workload == 'stream':
+                output_bytes = 0
+                for chunk in downloader.stream_and_merge(base_url + path + query, container='ts'):
+                    if not output_bytes:
+                        metrics['ttfb_s'] = time.monotonic() - started
+                    output_bytes += len(chunk)
+                segments = args.segments
+            elif workload == 'live':
+                output_file = downloader.record_live(base_url + path + query, max_duration=args.live_duration)
+                output_bytes = os.path.getsize(output_file)
+                segments = None  # taken from the origin's segment count
+            else:
+                output_file = downloader.download_and_merge(base_url + path + query)
+                output_bytes = os.path.getsize(output_file)
+                segments = args.segments
+        finally:
+            downloader.cleanup()
+
+    elif workload == 'batch':
+        batch = BatchDownloader(max_concurrent=args.batch_size, segment_workers=args.workers, job_store=False)
+        urls = [f'{base_url}vod/{args.segments}.m3u8{query}-{index}' for index in range(args.batch_size)]
+        batch_id = batch.start_batch_download(urls)
+        while batch.get_batch_status(batch_id)['status'] == 'processing':
+            time.sleep(0.02)
+        status = batch.get_batch_status(batch_id)
+        if status['completed_count'] != len(urls):
+            raise Exception(f"{status['failed_count']} of {len(urls)} batch items failed")
+        downloaded = time.monotonic()
+        output_bytes = sum(len(chunk) for chunk in batch.iter_batch_zip(batch_id))
+        metrics['zip_s'] = time.monotonic() - downloaded
+        segments = args.segments * args.batch_size
+
+    elif workload == 'extract':
+        extractor = VideoStreamExtractor()
+        links = extractor.extract_m3u8_from_webpage(f'{base_url}page/{args.iframes}.html{query}')
+        metrics['links'] = len(links)
+        output_bytes = 0
+        segments = 0
+
+    else:
+        raise ValueError(f"Unknown workload: {workload}")
+
+    metrics['elapsed_s'] = time.monotonic() - started
+    metrics['segments'] = segments
+    metrics['output_bytes'] = output_bytes
+    metrics['peak_rss_bytes'] = peak_rss_bytes()
+    return metrics
+
+
+def run_child(workload, base_url, args):
+    """Run a workload in a fresh interpreter and return its metrics (or the error)"""
+    token = uuid.uuid4().hex[:12]
+    cmd = [
+        sys.executable, '-m', 'benchmarks.run', '--child', workload, '--base-url', base_url, '--token', token,
+        '--segments', str(args.segments), '--workers', str(args.workers), '--batch-size', str(args.batch_size),
+        '--iframes', str(args.iframes), '--live-window', str(args.live_window),
+        '--live-duration', str(args.live_duration)
+    ]
+    # Job state stays in memory, so runs neither share nor leave records behind
+    env = dict(os.environ, JOB_STORE_URL='memory')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(cmd, cwd=root, env=env, capture_output=True, text=True, timeout=args.timeout)
+    lines = result.stdout.strip().splitlines()
+    if not lines:
+        return {'error': (result.stderr.strip().splitlines() or ['no output'])[-1]}
+    return json.loads(lines[-1])
+
+
+def summarize(records):
+    """Median of every numeric metric per workload, over the runs that succeeded"""
+    summary = {}
+    for workload in dict.fromkeys(record['workload'] for record in records):
+        runs = [record for record in records if record['workload'] == workload and 'error' not in record]
+        keys = [key for key, value in (runs[0].items() if runs else ()) if isinstance(value, (int, float))
+                and not isinstance(value, bool) and key not in ('run', 'started_at')]
+        summary[workload] = {'runs': len(runs), 'failed': sum(1 for r in records if r['workload'] == workload) - len(runs)}
+        for key in keys:
+            values = [run[key] for run in runs if run.get(key) is not None]
+            if values:
+                summary[workload][key] = statistics.median(values)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workloads', default='single,byterange,master,stream,batch,extract',
+                        help=f"comma-separated, from: {', '.join(WORKLOADS)}")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--segments', type=int, default=50)
+    parser.add_argument('--segment-bytes', type=int, default=512 * 1024)
+    parser.add_argument('--segment-duration', type=float, default=2.0)
+    parser.add_argument('--format', choices=('ts', 'fmp4'), default='ts')
+    parser.add_argument('--workers', type=int, default=8, help='segment workers per download')
+    parser.add_argument('--batch-size', type=int, default=3)
+    parser.add_argument('--iframes', type=int, default=5)
+    parser.add_argument('--live-window', type=int, default=6)
+    parser.add_argument('--live-duration', type=float, default=10.0)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- seconds of random latency')
+    parser.add_argument('--bandwidth', type=float, help='bytes per second per response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of segment requests failing with 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600, help='seconds per run')
+    # Internal: run one workload in this process against an existing origin
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--token', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        import logging
+        logging.basicConfig(level=logging.WARNING)
+        try:
+            print(json.dumps(run_workload(args.child, args.base_url, args.token, args)))
+        except Exception as e:
+            # The whole message: ffmpeg errors put the cause after a long banner
+            print(json.dumps({'error': f'{type(e).__name__}: {e}'}))
+        return 0
+
+    workloads = [name.strip() for name in args.workloads.split(',') if name.strip()]
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    from benchmarks.origin import SyntheticOrigin
+    origin = SyntheticOrigin(
+        segment_format=args.format, segment_bytes=args.segment_bytes, segment_duration=args.segment_duration,
+        latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth, error_rate=args.error_rate,
+        seed=args.seed
+    ).start()
+
+    records = []
+    try:
+        for workload in workloads:
+            for run in range(args.repeat):
+                origin.stats.reset()
+                record = {'workload': workload, 'run': run}
+                record.update(run_child(workload, origin.base_url, args))
+                served = origin.stats.snapshot()
+                record['origin_requests'] = served['requests']
+                record['origin_errors'] = served['errors_injected']
+                record['bytes_downloaded'] = served['bytes_sent']
+
+                if 'error' not in record:
+                    elapsed = record['elapsed_s']
+                    if record['segments'] is None:
+                        record['segments'] = served['segment_requests'] - served['errors_injected']
+                    record['segments_per_s'] = record['segments'] / elapsed if elapsed else None
+                    record['mb_per_s'] = served['bytes_sent'] / elapsed / 1e6 if elapsed else None
+                    if 'ttfb_s' not in record and served['first_segment_at'] is not None:
+                        # Until the origin sent the first segment, for workloads that do not stream to a client
+                        record['ttfb_s'] = served['first_segment_at'] - record['started_at']
+                    print(f"{workload} #{run}: {elapsed:.2f}s, {record['segments_per_s'] or 0:.1f} segments/s, "
+                          f"{record['mb_per_s'] or 0:.1f} MB/s, peak RSS {record['peak_rss_bytes'] / 1e6:.0f} MB",
+                          file=sys.stderr)
+                else:
+                    print(f"{workload} #{run}: failed: {record['error']}", file=sys.stderr)
+                records.append(record)
+    finally:
+        origin.stop()
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'segment_bytes': origin.segment_bytes,
+            'config': {key: value for key, value in vars(args).items()
+                       if key not in ('child', 'base_url', 'token', 'output')}
+        },
+        'results': records,
+        'summary': summarize(records)
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if any('error' in record for record in records) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -33,6 +33,7 @@ class M3U8Downloader {
         
         this.currentBatchId = null;
         this.batchStatusInterval = null;
+        this.batchEventSource = null;
         this.selectedVideoLinks = [];
         this.extractedLinks = [];
         
@@ -127,7 +128,8 @@ class M3U8Downloader {
             this.setLoadingState(true);
             this.showProgress(0, 'Initializing download...');
             
-            const response = await fetch('/download', {
+            // Queue the job; the server returns a task ID right away
+            const response = await fetch('/jobs', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -135,24 +137,21 @@ class M3U8Downloader {
                 body: JSON.stringify({ url: url, mode: mode })
             });
             
+            const jobData = await response.json();
             if (!response.ok) {
-                const errorData = await response.json();
-                throw new Error(errorData.error || `HTTP ${response.status}: ${response.statusText}`);
+                throw new Error(jobData.error || `HTTP ${response.status}: ${response.statusText}`);
             }
             
-            // Simulate progress updates during download
-            this.simulateProgress();
+            // Follow real progress until the job finishes
+            await this.waitForJob(jobData.task_id);
             
-            // Handle file download
-            const blob = await response.blob();
-            const downloadUrl = window.URL.createObjectURL(blob);
+            // Let the browser download the result directly instead of buffering it as a blob
             const a = document.createElement('a');
-            a.href = downloadUrl;
+            a.href = `/jobs/${jobData.task_id}/result`;
             a.download = this.generateFilename();
             document.body.appendChild(a);
             a.click();
             document.body.removeChild(a);
-            window.URL.revokeObjectURL(downloadUrl);
             
             this.showSuccess();
             
@@ -164,6 +163,84 @@ class M3U8Downloader {
         }
     }
     
+    async waitForJob(taskId) {
+        let job = null;
+        
+        if (window.EventSource) {
+            try {
+                job = await this.watchJobEvents(taskId);
+            } catch (error) {
+                console.warn('Progress stream unavailable, falling back to polling:', error);
+            }
+        }
+        
+        if (!job) {
+            job = await this.pollJob(taskId);
+        }
+        
+        if (job.status !== 'completed') {
+            throw new Error(job.error || 'Download failed');
+        }
+        
+        return job;
+    }
+    
+    watchJobEvents(taskId) {
+        // The server pushes compact progress deltas and a final snapshot when the job ends
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`/events/jobs/${taskId}`);
+            let job = {};
+            
+            const apply = (data) => {
+                job = { ...job, ...(data.job || {}) };
+                this.updateProgress(job.percent, job.message);
+            };
+            
+            source.addEventListener('snapshot', (e) => apply(JSON.parse(e.data)));
+            source.addEventListener('progress', (e) => apply(JSON.parse(e.data)));
+            source.addEventListener('done', (e) => {
+                source.close();
+                apply(JSON.parse(e.data));
+                resolve(job);
+            });
+            source.addEventListener('reconnect', () => {
+                // The server ends long streams to free its worker; a new one starts with a snapshot
+                source.close();
+                this.watchJobEvents(taskId).then(resolve, reject);
+            });
+            source.onerror = () => {
+                source.close();
+                reject(new Error('Progress stream interrupted'));
+            };
+        });
+    }
+    
+    pollJob(taskId) {
+        return new Promise((resolve, reject) => {
+            const poll = async () => {
+                try {
+                    const response = await fetch(`/jobs/${taskId}`);
+                    const job = await response.json();
+                    
+                    if (!response.ok) {
+                        throw new Error(job.error || `HTTP ${response.status}: ${response.statusText}`);
+                    }
+                    
+                    this.updateProgress(job.percent, job.message);
+                    
+                    if (job.status === 'completed' || job.status === 'failed') {
+                        resolve(job);
+                    } else {
+                        setTimeout(poll, 1000);
+                    }
+                } catch (error) {
+                    reject(error);
+                }
+            };
+            poll();
+        });
+    }
+    
     async extractVideoLinks(url) {
         try {
             this.hideAllSections();
@@ -373,28 +450,6 @@ class M3U8Downloader {
         this.extractedLinks = [];
     }
     
-    simulateProgress() {
-        const steps = [
-            { percent: 10, status: 'Fetching M3U8 playlist...' },
-            { percent: 25, status: 'Parsing video segments...' },
-            { percent: 40, status: 'Downloading video segments...' },
-            { percent: 70, status: 'Merging segments with ffmpeg...' },
-            { percent: 90, status: 'Finalizing video file...' },
-            { percent: 100, status: 'Download complete!' }
-        ];
-        
-        let currentStep = 0;
-        const interval = setInterval(() => {
-            if (currentStep < steps.length) {
-                const step = steps[currentStep];
-                this.updateProgress(step.percent, step.status);
-                currentStep++;
-            } else {
-                clearInterval(interval);
-            }
-        }, 800);
-    }
-    
     generateFilename() {
         const timestamp = new Date().toISOString().replace(/[:.]/g, '-');
         return `video_${timestamp}.mp4`;
@@ -593,20 +648,76 @@ class M3U8Downloader {
     }
     
     startBatchStatusTracking() {
-        if (this.batchStatusInterval) {
-            clearInterval(this.batchStatusInterval);
+        this.stopBatchStatusTracking();
+        
+        if (window.EventSource) {
+            this.startBatchEventStream();
+            return;
         }
         
+        this.startBatchPolling();
+    }
+    
+    startBatchPolling() {
         this.batchStatusInterval = setInterval(async () => {
             await this.updateBatchStatus();
         }, 1000);
     }
     
+    startBatchEventStream() {
+        // Server pushes compact per-download deltas; merge them into the last known state
+        const source = new EventSource(`/events/batch/${this.currentBatchId}`);
+        this.batchEventSource = source;
+        let batchData = null;
+        
+        const apply = (delta) => {
+            batchData = batchData || { downloads: {} };
+            Object.entries(delta).forEach(([key, fields]) => {
+                if (key === 'batch') {
+                    Object.assign(batchData, fields);
+                } else {
+                    batchData.downloads[key] = { ...(batchData.downloads[key] || {}), ...fields };
+                }
+            });
+            this.updateBatchUI(batchData);
+        };
+        
+        source.addEventListener('snapshot', (e) => apply(JSON.parse(e.data)));
+        source.addEventListener('progress', (e) => apply(JSON.parse(e.data)));
+        source.addEventListener('done', (e) => {
+            apply(JSON.parse(e.data));
+            this.handleBatchFinished(batchData);
+        });
+        source.addEventListener('reconnect', () => {
+            // The server ends long streams to free its worker; a new one starts with a snapshot
+            this.stopBatchStatusTracking();
+            this.startBatchEventStream();
+        });
+        source.onerror = () => {
+            // Fall back to polling if the stream cannot be kept open
+            this.stopBatchStatusTracking();
+            this.startBatchPolling();
+        };
+    }
+    
     stopBatchStatusTracking() {
         if (this.batchStatusInterval) {
             clearInterval(this.batchStatusInterval);
             this.batchStatusInterval = null;
         }
+        if (this.batchEventSource) {
+            this.batchEventSource.close();
+            this.batchEventSource = null;
+        }
+    }
+    
+    handleBatchFinished(batchData) {
+        this.stopBatchStatusTracking();
+        this.setBatchLoadingState(false);
+        
+        if (batchData.completed_count > 0) {
+            this.showBatchComplete();
+        }
     }
     
     async updateBatchStatus() {
@@ -624,12 +735,7 @@ class M3U8Downloader {
             
             // Stop tracking if batch is complete
             if (['completed', 'completed_with_errors', 'failed'].includes(batchData.status)) {
-                this.stopBatchStatusTracking();
-                this.setBatchLoadingState(false);
-                
-                if (batchData.completed_count > 0) {
-                    this.showBatchComplete();
-                }
+                this.handleBatchFinished(batchData);
             }
             
         } catch (error) {
@@ -678,23 +784,13 @@ class M3U8Downloader {
         if (!this.currentBatchId) return;
         
         try {
-            const response = await fetch(`/batch-download/${this.currentBatchId}`);
-            
-            if (!response.ok) {
-                const errorData = await response.json();
-                throw new Error(errorData.error);
-            }
-            
-            // Create download link
-            const blob = await response.blob();
-            const url = window.URL.createObjectURL(blob);
+            // Let the browser stream the archive to disk instead of buffering it in a blob
             const a = document.createElement('a');
-            a.href = url;
+            a.href = `/batch-download/${this.currentBatchId}`;
             a.download = `m3u8_batch_${this.currentBatchId.substring(0, 8)}.zip`;
             document.body.appendChild(a);
             a.click();
             document.body.removeChild(a);
-            window.URL.revokeObjectURL(url);
             
         } catch (error) {
             console.error('Batch ZIP download error:', error);
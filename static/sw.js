@@ -1,4 +1,4 @@
-const CACHE_NAME = 'm3u8-downloader-v1';
+const CACHE_NAME = 'm3u8-downloader-v4';
 const STATIC_CACHE_URLS = [
   '/',
   '/static/css/style.css',
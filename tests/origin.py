@@ -0,0 +1,115 @@
+"""Minimal in-memory HLS origin for tests
+
+Serves a fixed set of resources from a local HTTP server. Every request is counted
+per path, and a test can install a behaviour for a path that decides, per attempt,
+whether the body is sent normally, delayed, cut short or refused.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Behaviours returned by a path's handler for one attempt
+SEND = 'send'
+MISSING = 'missing'
+CUT = 'cut'  # half the body, then the connection is dropped
+STALL = 'stall'  # half the body, a long pause, then the rest
+
+
+def segment_body(index, size=64 * 1024):
+    """Distinct, recognisable bytes for segment index"""
+    pattern = f'segment-{index:05d};'.encode()
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+class LocalOrigin:
+    def __init__(self, resources, stall_seconds=3.0):
+        self.resources = dict(resources)  # path -> bytes
+        self.behaviours = {}  # path -> callable(attempt) returning SEND, MISSING, CUT or STALL
+        self.stall_seconds = stall_seconds
+        self.requests = {}  # path -> attempts so far
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                origin._serve(self)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def url(self, path):
+        return f'{self.base_url}/{path}'
+
+    def attempts(self, path):
+        with self._lock:
+            return self.requests.get(path, 0)
+
+    def _serve(self, handler):
+        path = handler.path.lstrip('/').split('?', 1)[0]
+        with self._lock:
+            attempt = self.requests[path] = self.requests.get(path, 0) + 1
+        body = self.resources.get(path)
+        behaviour = self.behaviours.get(path, lambda attempt: SEND)(attempt) if body is not None else MISSING
+        if behaviour == MISSING:
+            handler.send_response(404)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+
+        status, start, end = 200, 0, len(body)
+        byte_range = handler.headers.get('Range')
+        if byte_range:
+            first, _, last = byte_range.split('=', 1)[1].partition('-')
+            start, end = int(first), min(int(last) + 1, len(body)) if last else len(body)
+            status = 206
+        data = body[start:end]
+
+        handler.send_response(status)
+        handler.send_header('Content-Length', str(len(data)))
+        if status == 206:
+            handler.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(body)}')
+        handler.end_headers()
+        if behaviour == CUT:
+            handler.wfile.write(data[:len(data) // 2])
+            handler.wfile.flush()
+            handler.connection.shutdown(2)
+            return
+        if behaviour == STALL:
+            handler.wfile.write(data[:len(data) // 2])
+            handler.wfile.flush()
+            time.sleep(self.stall_seconds)
+            data = data[len(data) // 2:]
+        try:
+            handler.wfile.write(data)
+        except OSError:
+            pass  # the client gave up on this attempt
+
+
+def media_playlist(count, init=None):
+    """Media playlist text for segments s0.ts .. s<count-1>.ts (.m4s with an init segment)"""
+    extension = 'm4s' if init else 'ts'
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-TARGETDURATION:2']
+    if init:
+        lines.append(f'#EXT-X-MAP:URI="{init}"')
+    for index in range(count):
+        lines += ['#EXTINF:2.0,', f's{index}.{extension}']
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
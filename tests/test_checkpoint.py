@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.origin import MISSING, SEND, LocalOrigin, media_playlist, segment_body
+from utils.checkpoint import STATE_FAILED, DownloadCheckpoint, claim_interrupted, file_digest
+from utils.downloader import M3U8Downloader
+
+
+def checkpoint_log(directory):
+    return os.path.join(directory, 'segments.log')
+
+
+class DownloadCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='checkpoint_test_')
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.directory = os.path.join(self.root, 'task')
+
+    def fetched_file(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def record(self, bodies):
+        """A closed checkpoint holding one entry per body, as a killed download leaves it"""
+        checkpoint = DownloadCheckpoint(self.directory)
+        self.assertTrue(checkpoint.claim())
+        checkpoint.start('http://example.com/a.m3u8', 'http://example.com/a.m3u8', '#EXTM3U\n', len(bodies))
+        for key, data in bodies.items():
+            path = self.fetched_file(key, data)
+            checkpoint.add(key, path, *file_digest(path))
+        checkpoint.close()
+
+    def test_resume_keeps_intact_files(self):
+        self.record({'s0': b'zero' * 100, 's1': b'one' * 100})
+
+        checkpoint = DownloadCheckpoint(self.directory)
+        self.assertTrue(checkpoint.claim())
+        self.assertEqual(checkpoint.load()['url'], 'http://example.com/a.m3u8')
+        self.assertEqual(checkpoint.verify(), 2)
+        dest = os.path.join(self.root, 'restored')
+        self.assertEqual(checkpoint.link_to('s1', dest), (300, file_digest(dest)[0]))
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), b'one' * 100)
+        self.assertIsNone(checkpoint.link_to('s2', dest + '2'))
+        checkpoint.close()
+
+    def test_verify_drops_corrupt_files_and_torn_lines(self):
+        self.record({'s0': b'zero' * 100, 's1': b'one' * 100, 's2': b'two' * 100})
+        with open(checkpoint_log(self.directory)) as f:
+            entries = [json.loads(line) for line in f]
+        corrupt = next(entry for entry in entries if entry[0] == 's1')
+        with open(os.path.join(self.directory, corrupt[1]), 'r+b') as f:
+            f.write(b'XXX')
+        with open(checkpoint_log(self.directory), 'a') as f:
+            f.write('["s3", "torn')
+
+        checkpoint = DownloadCheckpoint(self.directory)
+        self.assertTrue(checkpoint.claim())
+        self.assertEqual(checkpoint.verify(), 2)
+        self.assertIsNone(checkpoint.link_to('s1', os.path.join(self.root, 'restored')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, corrupt[1])))
+        checkpoint.close()
+
+        # The rewritten log only lists what survived
+        checkpoint = DownloadCheckpoint(self.directory)
+        self.assertTrue(checkpoint.claim())
+        self.assertEqual(checkpoint.verify(), 2)
+        checkpoint.close()
+
+    def test_claim_interrupted_skips_held_and_failed_checkpoints(self):
+        self.record({'s0': b'zero'})
+        failed = DownloadCheckpoint(os.path.join(self.root, 'failed'))
+        failed.claim()
+        failed.start('http://example.com/b.m3u8', 'http://example.com/b.m3u8', '#EXTM3U\n', 1)
+        failed.set_state(STATE_FAILED)
+        failed.close()
+        empty = DownloadCheckpoint(os.path.join(self.root, 'empty'))
+        empty.claim()
+        empty.close()
+
+        running = DownloadCheckpoint(self.directory)
+        self.assertTrue(running.claim())
+        self.assertEqual(claim_interrupted(self.root), {})
+        running.close()
+
+        claimed = claim_interrupted(self.root)
+        self.assertEqual(sorted(claimed), ['task'])
+        claimed['task'].close()
+        # Never got past the playlist: nothing to resume
+        self.assertFalse(os.path.exists(empty.directory))
+        self.assertTrue(os.path.exists(failed.directory))
+
+
+class ResumeDownloadTest(unittest.TestCase):
+    SEGMENTS = 12
+
+    def setUp(self):
+        resources = {'index.m3u8': media_playlist(self.SEGMENTS, init='init.mp4').encode(), 'init.mp4': b'ftyp-init' * 50}
+        resources.update((f's{i}.m4s', segment_body(i)) for i in range(self.SEGMENTS))
+        self.origin = LocalOrigin(resources).start()
+        self.addCleanup(self.origin.stop)
+        self.checkpoint_dir = tempfile.mkdtemp(prefix='checkpoint_test_')
+        self.addCleanup(shutil.rmtree, self.checkpoint_dir, ignore_errors=True)
+
+    def downloader(self):
+        downloader = M3U8Downloader(max_workers=1, segment_cache=False, job_store=False, strict=True,
+                                    checkpoint_dir=self.checkpoint_dir, max_retries=0)
+        self.addCleanup(downloader.cleanup)
+        return downloader
+
+    def test_retry_refetches_only_missing_and_corrupt_segments(self):
+        url = self.origin.url('index.m3u8')
+        self.origin.behaviours['s8.m4s'] = lambda attempt: MISSING if attempt == 1 else SEND
+
+        with self.assertRaises(Exception):
+            self.downloader().download_and_merge(url, task_id='job', resumable=True)
+        directory = os.path.join(self.checkpoint_dir, 'job')
+        self.assertEqual(DownloadCheckpoint(directory).load()['state'], STATE_FAILED)
+
+        with open(checkpoint_log(directory)) as f:
+            entries = {json.loads(line)[0]: json.loads(line)[1] for line in f}
+        corrupt_key = next(key for key in entries if key.endswith('/s2.m4s'))
+        with open(os.path.join(directory, entries[corrupt_key]), 'r+b') as f:
+            f.write(b'XXX')
+        before = {path: self.origin.attempts(path) for path in self.origin.resources}
+
+        output = self.downloader().download_and_merge(url, task_id='job', resumable=True)
+
+        with open(output, 'rb') as f:
+            expected = self.origin.resources['init.mp4'] + b''.join(segment_body(i) for i in range(self.SEGMENTS))
+            self.assertEqual(f.read(), expected)
+        refetched = sorted(path for path, count in before.items()
+                           if self.origin.attempts(path) > count and path.endswith('.m4s'))
+        kept = {key.rsplit('/', 1)[1] for key in entries} - {'s2.m4s'}
+        self.assertTrue(kept)
+        self.assertIn('s2.m4s', refetched)
+        self.assertIn('s8.m4s', refetched)
+        self.assertFalse(kept & set(refetched))
+        self.assertEqual(self.origin.attempts('index.m3u8'), 1)  # the playlist snapshot is reused
+        self.assertFalse(os.path.exists(directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import time
+import unittest
+
+from tests.origin import CUT, SEND, STALL, LocalOrigin, media_playlist, segment_body
+from utils.downloader import M3U8Downloader
+
+SEGMENTS = 16
+
+
+class RetryAndHedgeTest(unittest.TestCase):
+    """Segment requests that stall or break mid-body still produce every byte exactly once"""
+
+    def setUp(self):
+        resources = {'index.m3u8': media_playlist(SEGMENTS).encode()}
+        resources.update((f's{i}.ts', segment_body(i, 256 * 1024)) for i in range(SEGMENTS))
+        self.origin = LocalOrigin(resources, stall_seconds=5.0).start()
+        self.addCleanup(self.origin.stop)
+        self.expected = b''.join(resources[f's{i}.ts'] for i in range(SEGMENTS))
+
+        self.downloader = M3U8Downloader(max_workers=4, segment_cache=False, job_store=False)
+        self.downloader.backoff_base = 0.05
+        self.addCleanup(self.downloader.cleanup)
+
+    def stream(self):
+        return b''.join(self.downloader.stream_and_merge(self.origin.url('index.m3u8'), container='ts'))
+
+    def test_requests_cut_mid_body_are_retried(self):
+        for i in range(0, SEGMENTS, 3):
+            self.origin.behaviours[f's{i}.ts'] = lambda attempt: CUT if attempt == 1 else SEND
+
+        self.assertEqual(self.stream(), self.expected)
+        self.assertEqual(self.origin.attempts('s3.ts'), 2)
+        self.assertEqual(self.leftover_parts(), [])
+
+    def test_stalled_requests_are_hedged(self):
+        self.downloader.hedge_min_delay = 0.3
+        for _ in range(50):
+            self.downloader.latency.record(self.origin.base_url, 0.05)
+        for i in (1, 6, 11):
+            self.origin.behaviours[f's{i}.ts'] = lambda attempt: STALL if attempt == 1 else SEND
+
+        started = time.monotonic()
+        self.assertEqual(self.stream(), self.expected)
+        # A duplicate request won each race instead of waiting out the stall
+        self.assertLess(time.monotonic() - started, self.origin.stall_seconds)
+        self.assertGreaterEqual(self.downloader.hedged_requests, 3)
+        self.assertEqual(self.origin.attempts('s6.ts'), 2)
+        self.assertEqual(self.leftover_parts(), [])
+
+    def leftover_parts(self):
+        return [name for _, _, names in os.walk(self.downloader.temp_dir) for name in names if name.endswith('.part')]
+
+
+if __name__ == '__main__':
+    unittest.main()
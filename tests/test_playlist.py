@@ -0,0 +1,72 @@
+import unittest
+
+from utils.playlist import FetchGroup, SegmentTable, parse_media_playlist
+
+
+def byte_range_table(ranges, uri='media.ts'):
+    table = SegmentTable()
+    for offset, length in ranges:
+        table.append(uri, 2.0, offset, length)
+    return table
+
+
+class FetchGroupsTest(unittest.TestCase):
+    def test_adjacent_ranges_coalesce_into_one_request(self):
+        table = byte_range_table([(0, 100), (100, 200), (300, 50)])
+        self.assertEqual(table.fetch_groups(), [FetchGroup('media.ts', 0, 350, 0, 2)])
+
+    def test_request_size_cap_splits_groups(self):
+        table = byte_range_table([(0, 100), (100, 100), (200, 100), (300, 100), (400, 100)])
+        self.assertEqual(table.fetch_groups(max_request_bytes=250), [
+            FetchGroup('media.ts', 0, 200, 0, 1),
+            FetchGroup('media.ts', 200, 200, 2, 3),
+            FetchGroup('media.ts', 400, 100, 4, 4)
+        ])
+
+    def test_range_larger_than_cap_is_requested_alone(self):
+        table = byte_range_table([(0, 500), (500, 10)])
+        self.assertEqual(table.fetch_groups(max_request_bytes=100), [
+            FetchGroup('media.ts', 0, 500, 0, 0),
+            FetchGroup('media.ts', 500, 10, 1, 1)
+        ])
+
+    def test_gaps_and_resource_changes_end_a_group(self):
+        table = SegmentTable()
+        table.append('a.ts', 2.0, 0, 100)
+        table.append('a.ts', 2.0, 150, 100)  # gap
+        table.append('b.ts', 2.0, 250, 100)  # other resource, even though the offset follows on
+        table.append('b.ts', 2.0, 350, 100)
+        self.assertEqual(table.fetch_groups(), [
+            FetchGroup('a.ts', 0, 100, 0, 0),
+            FetchGroup('a.ts', 150, 100, 1, 1),
+            FetchGroup('b.ts', 250, 200, 2, 3)
+        ])
+
+    def test_whole_resources_get_one_request_each(self):
+        table = SegmentTable()
+        table.append('s0.ts', 2.0)
+        table.append('s1.ts', 2.0)
+        table.append('media.ts', 2.0, 0, 100)
+        table.append('media.ts', 2.0, 100, 100)
+        self.assertEqual(table.fetch_groups(), [
+            FetchGroup('s0.ts', None, None, 0, 0),
+            FetchGroup('s1.ts', None, None, 1, 1),
+            FetchGroup('media.ts', 0, 200, 2, 3)
+        ])
+
+    def test_parsed_byte_ranges_without_offset_continue_the_previous_range(self):
+        playlist = parse_media_playlist(
+            '#EXTM3U\n#EXT-X-TARGETDURATION:2\n'
+            '#EXTINF:2.0,\n#EXT-X-BYTERANGE:1000@0\nmedia.ts\n'
+            '#EXTINF:2.0,\n#EXT-X-BYTERANGE:1000\nmedia.ts\n'
+            '#EXTINF:2.0,\n#EXT-X-BYTERANGE:500\nmedia.ts\n'
+            '#EXT-X-ENDLIST\n',
+            'http://example.com/vod/index.m3u8'
+        )
+        self.assertEqual(playlist.segments.fetch_groups(), [
+            FetchGroup('http://example.com/vod/media.ts', 0, 2500, 0, 2)
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
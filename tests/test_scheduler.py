@@ -0,0 +1,105 @@
+import threading
+import time
+import unittest
+
+from utils.scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, FairScheduler, SlotPool
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.005)
+
+
+class SlotPoolTest(unittest.TestCase):
+    def queue_waiters(self, pool, waiters):
+        """Queue (name, flow, priority) waiters one at a time; each records its name once served"""
+        served = []
+        threads = []
+
+        def waiter(name, flow, priority):
+            pool.acquire(flow, priority)
+            served.append(name)
+            pool.release()
+
+        for queued, (name, flow, priority) in enumerate(waiters, 1):
+            thread = threading.Thread(target=waiter, args=(name, flow, priority))
+            thread.start()
+            threads.append(thread)
+            wait_until(lambda: pool.stats()['waiting'] == queued)
+        return served, threads
+
+    def test_flows_take_turns_within_a_priority(self):
+        pool = SlotPool(1)
+        pool.acquire('holder')
+        served, threads = self.queue_waiters(pool, [
+            ('a1', 'a', PRIORITY_INTERACTIVE),
+            ('a2', 'a', PRIORITY_INTERACTIVE),
+            ('a3', 'a', PRIORITY_INTERACTIVE),
+            ('b1', 'b', PRIORITY_INTERACTIVE),
+            ('b2', 'b', PRIORITY_INTERACTIVE)
+        ])
+        pool.release()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(served, ['a1', 'b1', 'a2', 'b2', 'a3'])
+
+    def test_interactive_waiters_go_before_batch(self):
+        pool = SlotPool(1)
+        pool.acquire('holder')
+        served, threads = self.queue_waiters(pool, [
+            ('batch1', 'batch', PRIORITY_BATCH),
+            ('batch2', 'batch', PRIORITY_BATCH),
+            ('job1', 'job', PRIORITY_INTERACTIVE)
+        ])
+        pool.release()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(served, ['job1', 'batch1', 'batch2'])
+
+    def test_try_acquire_does_not_jump_the_queue(self):
+        pool = SlotPool(1)
+        pool.acquire('holder')
+        served, threads = self.queue_waiters(pool, [('job1', 'job', PRIORITY_INTERACTIVE)])
+        self.assertFalse(pool.try_acquire(PRIORITY_INTERACTIVE))
+        pool.release()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(served, ['job1'])
+        self.assertTrue(pool.try_acquire(PRIORITY_BATCH))
+        pool.release()
+        self.assertEqual(pool.stats()['active'], 0)
+
+
+class FairSchedulerTest(unittest.TestCase):
+    def test_fetch_slots_are_shared_fairly_between_flows(self):
+        scheduler = FairScheduler(max_fetches=2, max_merges=1)
+        served = []
+        lock = threading.Lock()
+        start = threading.Event()
+
+        def fetch(flow):
+            start.wait()
+            with scheduler.slot('fetch', flow, PRIORITY_INTERACTIVE):
+                with lock:
+                    served.append(flow)
+                time.sleep(0.01)
+
+        # One flow queues far more requests than the other
+        threads = [threading.Thread(target=fetch, args=('big',)) for _ in range(12)]
+        threads += [threading.Thread(target=fetch, args=('small',)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(len(served), 15)
+        # The small flow is done long before the big one, instead of waiting behind it
+        self.assertLess(max(i for i, flow in enumerate(served) if flow == 'small'), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
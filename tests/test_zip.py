@@ -0,0 +1,47 @@
+import io
+import os
+import shutil
+import unittest
+import zipfile
+
+from utils.downloader import BatchDownloader
+
+
+class BatchZipTest(unittest.TestCase):
+    def setUp(self):
+        self.batch = BatchDownloader(job_store=False)
+        self.addCleanup(shutil.rmtree, self.batch.temp_dir, ignore_errors=True)
+
+    def output(self, name, data):
+        path = os.path.join(self.batch.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_streamed_archive_holds_every_output(self):
+        first = os.urandom(300 * 1024)
+        third = b'third video' * 1000
+        self.batch.batch_data['batch'] = {'output_files': [
+            self.output('a.mp4', first),
+            os.path.join(self.batch.temp_dir, 'failed.mp4'),  # never written, skipped
+            self.output('c.mp4', third)
+        ]}
+
+        chunks = list(self.batch.iter_batch_zip('batch', chunk_size=64 * 1024))
+
+        self.assertGreater(len(chunks), 1)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['video_001.mp4', 'video_003.mp4'])
+            self.assertEqual(archive.read('video_001.mp4'), first)
+            self.assertEqual(archive.read('video_003.mp4'), third)
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+
+    def test_no_outputs_yields_nothing(self):
+        self.batch.batch_data['batch'] = {'output_files': []}
+        self.assertEqual(list(self.batch.iter_batch_zip('batch')), [])
+        self.assertEqual(list(self.batch.iter_batch_zip('unknown')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
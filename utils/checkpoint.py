@@ -0,0 +1,231 @@
+import os
+import json
+import hashlib
+import logging
+import shutil
+import threading
+import time
+from utils.transfer import link_or_copy
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, every checkpoint counts as unclaimed
+    fcntl = None
+
+MANIFEST_VERSION = 1
+
+# Manifest states: a running download whose process dies is resumed on startup, a failed one only on retry
+STATE_RUNNING = 'running'
+STATE_FAILED = 'failed'
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest and size of a file"""
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+
+class DownloadCheckpoint:
+    """On-disk record of a download's progress, so a restarted or retried job refetches only what is missing
+
+    The directory holds manifest.json (the playlist snapshot the segment table is
+    parsed from, written atomically once per download), segments.log (one JSON line
+    per fetched request, appended as requests complete) and a hard link to every
+    fetched file. A torn last log line or a file that no longer matches its recorded
+    size and SHA-256 is dropped by verify(), so those requests are simply fetched again.
+
+    The process working on a download holds an exclusive lock on the directory; the
+    kernel drops it when that process dies, which is how interrupted downloads are told
+    apart from ones still running in another worker. A download that fails on its own
+    is marked failed in the manifest so startup leaves it for an explicit retry.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.log_path = os.path.join(directory, 'segments.log')
+        self._entries = {}  # request key -> (file name, size, sha256)
+        self._log = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+
+    def claim(self):
+        """Take the directory's lock without blocking; False if another process holds it"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, 'lock'), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._lock_file = lock_file
+        return True
+
+    def close(self):
+        """Stop recording and release the lock, keeping everything on disk for a later resume"""
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def discard(self):
+        """Close and delete the checkpoint, once the output exists"""
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def load(self):
+        """The manifest, or None when there is no complete one"""
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+    def start(self, url, playlist_url, playlist_content, segments):
+        """Begin a fresh checkpoint for a playlist snapshot, forgetting any earlier progress"""
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith('.seg'):
+                    os.remove(os.path.join(self.directory, name))
+            self._entries = {}
+            self._write_manifest({
+                'version': MANIFEST_VERSION,
+                'url': url,
+                'playlist_url': playlist_url,
+                'playlist': playlist_content,
+                'segments': segments,
+                'state': STATE_RUNNING,
+                'created_at': time.time()
+            })
+            self._open_log('w')
+
+    def set_state(self, state):
+        """Record STATE_RUNNING or STATE_FAILED in the manifest, if there is one"""
+        manifest = self.load()
+        if manifest is None or manifest.get('state', STATE_RUNNING) == state:
+            return
+        manifest['state'] = state
+        self._write_manifest(manifest)
+
+    def _write_manifest(self, manifest):
+        partial_path = self.manifest_path + '.part'
+        with open(partial_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial_path, self.manifest_path)
+
+    def verify(self):
+        """Load the request log, keeping entries whose files are intact; returns how many were kept"""
+        entries = {}
+        try:
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        key, name, size, digest = json.loads(line)
+                    except ValueError:
+                        continue  # torn write from a crash
+                    entries[key] = (name, size, digest)
+        except OSError:
+            pass
+
+        intact = {}
+        for key, (name, size, digest) in entries.items():
+            path = os.path.join(self.directory, name)
+            try:
+                if file_digest(path) == (digest, size):
+                    intact[key] = (name, size, digest)
+                    continue
+            except OSError:
+                continue
+            logging.warning(f"Checkpointed file {path} is corrupt, it will be fetched again")
+            os.remove(path)
+
+        with self._lock:
+            self._entries = intact
+            # Rewrite the log without the dropped entries, then keep appending to it
+            self._open_log('w')
+            for key, entry in intact.items():
+                self._log.write(json.dumps([key, *entry]) + '\n')
+            self._log.flush()
+        return len(intact)
+
+    def _open_log(self, mode):
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self.log_path, mode)
+
+    def link_to(self, key, dest_path):
+        """Place the checkpointed file for key at dest_path
+
+        Returns (size, digest) of the file, or None if it was not fetched yet.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        name, size, digest = entry
+        try:
+            link_or_copy(os.path.join(self.directory, name), dest_path)
+        except OSError:
+            return None
+        return size, digest
+
+    def add(self, key, path, digest, size):
+        """Record a fetched file for key, hard-linking it into the checkpoint
+
+        digest and size are the SHA-256 and length computed while the file was written,
+        so the segment is not read back here; verify() re-checks them on resume.
+        """
+        name = f'{hashlib.sha1(key.encode()).hexdigest()}.seg'
+        target = os.path.join(self.directory, name)
+        partial_path = f'{target}.{threading.get_ident()}.part'
+        link_or_copy(path, partial_path)
+        os.replace(partial_path, target)
+        with self._lock:
+            if self._log is None:
+                return
+            self._entries[key] = (name, size, digest)
+            # Flushed to the OS per request: a killed process loses nothing, a power cut is caught by verify()
+            self._log.write(json.dumps([key, name, size, digest]) + '\n')
+            self._log.flush()
+
+
+def claim_interrupted(checkpoint_dir):
+    """Claim the checkpoints under checkpoint_dir that no live process holds
+
+    Returns {task_id: DownloadCheckpoint}, each locked by the caller. Checkpoints
+    without a readable manifest never got past the playlist and are deleted; failed
+    downloads are left unclaimed for a retry.
+    """
+    claimed = {}
+    try:
+        names = os.listdir(checkpoint_dir)
+    except OSError:
+        return claimed
+    for task_id in names:
+        checkpoint = DownloadCheckpoint(os.path.join(checkpoint_dir, task_id))
+        if not os.path.isdir(checkpoint.directory) or not checkpoint.claim():
+            continue
+        manifest = checkpoint.load()
+        if manifest is None:
+            checkpoint.discard()
+            continue
+        if manifest.get('state', STATE_RUNNING) == STATE_FAILED:
+            checkpoint.close()
+            continue
+        claimed[task_id] = checkpoint
+    return claimed
@@ -1,5 +1,7 @@
 import os
 import re
+import hashlib
+import shutil
 import requests
 import subprocess
 import tempfile
@@ -8,49 +10,185 @@ import threading
 import time
 import uuid
 import zipfile
-import trafilatura
-from urllib.parse import urljoin, urlparse
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from utils.events import progress_broker
+from utils.http_pool import ConnectionWatch, get_connection_pools, origin_of, request_aborted, watched_session
+from utils.janitor import dir_size
+from utils.checkpoint import STATE_FAILED, STATE_RUNNING, DownloadCheckpoint, claim_interrupted
+from utils.link_scanner import LinkScanner
+from utils.metrics import (
+    extract_seconds, ffmpeg_cpu_seconds, ffmpeg_seconds, merge_queue_seconds, playlist_fetch_seconds,
+    segment_bytes_total, segment_failures_total, segment_fetch_bytes, segment_fetch_seconds, zip_build_seconds
+)
+from utils.page_cache import (
+    DEFAULT_DEAD_LINK_TTL, DEFAULT_LINK_TTL, DEFAULT_PAGE_ENTRIES, DEFAULT_PAGE_TTL, CachedPage, TTLCache
+)
+from utils.result_cache import SingleFlight
+from utils.job_store import get_job_store
+from utils.scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, get_scheduler
+from utils.transfer import copy_range, get_buffer_pool, iter_body
+from utils.retry import OriginLatencyTracker, backoff_delay, is_retryable
+from utils.segment_cache import SegmentCache, get_segment_cache
+from utils.playlist import (
+    DEFAULT_MAX_REQUEST_BYTES, FetchGroup, is_master_playlist, parse_master_playlist,
+    parse_media_playlist, playlist_duration, select_variant
+)
+
+# A fetch group's bytes in a workspace file, with the size and SHA-256 computed while writing it
+FetchedFile = namedtuple('FetchedFile', ['path', 'size', 'digest'])
+
 
 class M3U8Downloader:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+    def __init__(self, max_workers=8, variant_policy='max_bandwidth', max_height=None, byte_budget=None,
+                 assembly='single_file', pipeline_merge=True, segment_cache=None, max_retries=3, hedge_percentile=95,
+                 strict=False, connection_pools=None, scheduler=None, priority=PRIORITY_INTERACTIVE, flow=None,
+                 buffer_pool=None, temp_dir=None, job_store=None, checkpoint_dir=None):
+        # Per-origin sessions and adaptive concurrency limits, shared across instances by default
+        self.pools = connection_pools or get_connection_pools()
+        # Process-wide budget for fetches and merges; requests queue under flow (default: the task ID)
+        self.scheduler = scheduler or get_scheduler()
+        self.priority = priority
+        self.flow = flow
+        # Reusable chunk buffers; their total size is the process-wide ceiling on in-flight transfer memory
+        self.buffers = buffer_pool or get_buffer_pool()
+        # Number of segments fetched in parallel (1 = sequential)
+        self.max_workers = max(1, int(max_workers))
+        # Variant selection for master playlists (see utils.playlist.select_variant)
+        self.variant_policy = variant_policy
+        self.max_height = max_height
+        self.byte_budget = byte_budget
+        # Largest single ranged GET when coalescing EXT-X-BYTERANGE segments
+        self.max_request_bytes = DEFAULT_MAX_REQUEST_BYTES
+        # 'single_file' writes segments into one file, 'segments' keeps per-segment files + ffmpeg concat
+        if assembly not in ('single_file', 'segments'):
+            raise Exception(f"Unknown assembly mode: {assembly}")
+        self.assembly = assembly
+        # Feed plain TS to ffmpeg as segments arrive instead of remuxing once the download is done
+        self.pipeline_merge = pipeline_merge
+        # ffmpeg is killed after this many seconds without progress, however long the whole run takes
+        self.merge_stall_timeout = 60
+        # Shared across instances by default; pass False to always go to the network
+        self.segment_cache = get_segment_cache() if segment_cache is None else segment_cache
+        # Per-segment retries with exponential backoff and jitter
+        self.max_retries = max_retries
+        self.backoff_base = 0.5
+        self.backoff_cap = 10.0
+        # Send a duplicate request when one runs past this percentile of recent latencies (None = off)
+        self.hedge_percentile = hedge_percentile
+        # Never hedge sooner than this, so ordinary jitter on a fast origin does not double traffic
+        self.hedge_min_delay = 1.0
+        self.latency = OriginLatencyTracker()
+        self._hedge_lock = threading.Lock()
+        self.hedged_requests = 0
+        # Fail the job on any lost segment instead of producing a gapped file
+        self.strict = strict
         self.progress_data = {}
-        self.temp_dir = tempfile.mkdtemp(prefix='m3u8_downloader_')
+        # Progress is also saved here so other processes can report it; False keeps it local
+        self.job_store = get_job_store() if job_store is None else job_store
+        # Tasks currently running (task_id -> nesting count) and when idle ones finished
+        self._task_refs = {}
+        self._finished_at = {}
+        # Tasks coalesced onto another task's download (leader task_id -> follower task_ids)
+        self._followers = {}
+        self._task_lock = threading.Lock()
+        # Stop requests for running live recordings (task_id -> Event)
+        self._cancel_events = {}
+        # Per-task seconds spent in each stage, reported with the task's progress
+        self.timings = {}
+        self._timings_lock = threading.Lock()
+        # Resumable downloads record fetched segments under checkpoint_dir/<task_id> so they survive a restart (None = off)
+        self.checkpoint_dir = checkpoint_dir
+        self._checkpoints = {}  # task_id -> checkpoint of a running download
+        self._claimed = {}  # task_id -> checkpoint of an interrupted download, locked until it resumes
+        # A shared temp_dir belongs to the caller and is left alone by cleanup()
+        self.owns_temp_dir = temp_dir is None
+        self.temp_dir = temp_dir or tempfile.mkdtemp(prefix='m3u8_downloader_')
         logging.info(f"Temporary directory created: {self.temp_dir}")
     
-    def download_and_merge(self, m3u8_url):
-        """Download M3U8 playlist and merge segments into MP4"""
+    def download_and_merge(self, m3u8_url, task_id=None, resumable=False):
+        """Download M3U8 playlist and merge segments into MP4
+        
+        With resumable=True the download is checkpointed under checkpoint_dir, for jobs
+        that outlive the request that started them and can be resumed or retried.
+        """
+        task_id = task_id or self.new_task_id()
+        self.begin_task(task_id)
+        checkpoint = None
         try:
-            task_id = str(int(time.time() * 1000))
             self.progress_data[task_id] = {'percent': 0, 'status': 'Starting download...'}
             
             logging.info(f"Starting download for URL: {m3u8_url}")
             
-            # Step 1: Download and parse M3U8 playlist
-            self.update_progress(task_id, 10, 'Fetching M3U8 playlist...')
-            playlist_content = self.fetch_playlist(m3u8_url)
+            checkpoint = self._open_checkpoint(task_id) if resumable else None
+            manifest = checkpoint.load() if checkpoint is not None else None
+            if manifest is not None and manifest['url'] != m3u8_url:
+                manifest = None
             
-            # Step 2: Parse segment URLs
+            # Step 1: Download and parse M3U8 playlist (a resumed download reuses its snapshot)
+            source_url = m3u8_url
+            if manifest is not None:
+                playlist_content, m3u8_url = manifest['playlist'], manifest['playlist_url']
+            else:
+                self.update_progress(task_id, 10, 'Fetching M3U8 playlist...')
+                with self.stage(task_id, 'playlist'):
+                    playlist_content = self.fetch_playlist(m3u8_url)
+                    playlist_content, m3u8_url = self.resolve_media_playlist(playlist_content, m3u8_url)
+            
+            # Step 2: Parse segment table
             self.update_progress(task_id, 20, 'Parsing video segments...')
-            segment_urls = self.parse_segments(playlist_content, m3u8_url)
+            with self.stage(task_id, 'parse'):
+                playlist = self.parse_segments(playlist_content, m3u8_url)
             
-            if not segment_urls:
+            if not len(playlist):
                 raise Exception("No video segments found in playlist")
             
-            logging.info(f"Found {len(segment_urls)} segments to download")
+            logging.info(f"Found {len(playlist)} segments to download")
+            
+            if manifest is not None:
+                # A retried download is running again and should resume if this process dies
+                checkpoint.set_state(STATE_RUNNING)
+                resumed = checkpoint.verify()
+                logging.info(f"Resuming download {task_id}: {resumed} requests already fetched")
+                self.update_progress(task_id, 25, f'Resuming with {resumed} segment requests already downloaded...')
+            elif checkpoint is not None:
+                checkpoint.start(source_url, m3u8_url, playlist_content, len(playlist))
+            if checkpoint is not None:
+                self._checkpoints[task_id] = checkpoint
             
             # Step 3: Download segments
-            self.update_progress(task_id, 30, f'Downloading {len(segment_urls)} segments...')
-            segment_files = self.download_segments(segment_urls, task_id)
+            self.update_progress(task_id, 30, f'Downloading {len(playlist)} segments...')
+            output_file = None
+            if self.assembly == 'single_file' and self.pipeline_merge and not playlist.init_segment:
+                # Steps 3 and 4 overlap: ffmpeg remuxes each segment as soon as it is in order
+                output_file = self.pipe_segments(playlist, task_id)
             
-            # Step 4: Merge segments using ffmpeg
-            self.update_progress(task_id, 80, 'Merging segments with ffmpeg...')
-            output_file = self.merge_segments(segment_files, task_id)
+            if output_file is not None:
+                pass
+            elif self.assembly == 'single_file':
+                with self.stage(task_id, 'download'):
+                    output_file = self.assemble_segments(playlist, task_id)
+                
+                # Step 4: fMP4 is already a playable MP4, plain TS needs one remux pass
+                if not playlist.init_segment:
+                    self.update_progress(task_id, 80, 'Remuxing video with ffmpeg...')
+                    with self.stage(task_id, 'merge'):
+                        output_file = self.remux_file(output_file, task_id)
+            else:
+                with self.stage(task_id, 'download'):
+                    segment_files = self.download_segments(playlist, task_id)
+                    init_file = self.download_init_segment(playlist, task_id)
+                
+                # Step 4: Merge segments using ffmpeg
+                self.update_progress(task_id, 80, 'Merging segments with ffmpeg...')
+                with self.stage(task_id, 'merge'):
+                    output_file = self.merge_segments(segment_files, task_id, init_file=init_file)
+            
+            if checkpoint is not None:
+                # The output exists, the fetched segments are no longer needed to rebuild it
+                checkpoint.discard()
             
             self.update_progress(task_id, 100, 'Download complete!')
             logging.info(f"Video successfully processed: {output_file}")
@@ -59,60 +197,342 @@ class M3U8Downloader:
             
         except Exception as e:
             logging.error(f"Download failed: {str(e)}")
+            if checkpoint is not None:
+                # Not a crash: restarting would fail the same way, so only an explicit retry resumes it
+                checkpoint.set_state(STATE_FAILED)
+            raise
+        finally:
+            self._checkpoints.pop(task_id, None)
+            if checkpoint is not None:
+                # After a failure the checkpoint stays on disk, unlocked, for a retry to resume from
+                checkpoint.close()
+            self.end_task(task_id)
+    
+    def record_live(self, m3u8_url, task_id=None, max_duration=None, from_start=False):
+        """Record a live playlist until it ends, max_duration seconds are recorded, or cancel() is called
+        
+        The media playlist is reloaded every target duration (half of it when nothing
+        was added) and only segments whose media sequence number is past the last one
+        recorded are fetched and appended to the output, so a reload costs the same
+        however long the recording has run. Recording starts three segments from the
+        live edge unless from_start is set; a playlist that has already ended is recorded
+        in full. Plain TS gets one remux pass at the end.
+        """
+        task_id = task_id or self.new_task_id()
+        self.begin_task(task_id)
+        cancelled = self._cancel_events.setdefault(task_id, threading.Event())
+        try:
+            logging.info(f"Starting live recording for URL: {m3u8_url}")
+            self.update_progress(task_id, 5, 'Fetching live playlist...')
+            with self.stage(task_id, 'playlist'):
+                playlist_content = self.fetch_playlist(m3u8_url)
+                playlist_content, m3u8_url = self.resolve_media_playlist(playlist_content, m3u8_url)
+                playlist = self.parse_segments(playlist_content, m3u8_url)
+            recording_started = time.monotonic()
+            
+            init = playlist.init_segment
+            output_file = os.path.join(self.workspace(task_id), 'output.mp4' if init else 'assembled.ts')
+            # The first segment to record; only a playlist still being appended to starts near the edge
+            if from_start or playlist.endlist:
+                next_sequence = playlist.media_sequence
+            else:
+                next_sequence = max(playlist.media_sequence, playlist.media_sequence + len(playlist) - 3)
+            last_sequence = None  # newest sequence number seen in a playlist
+            recorded = 0.0
+            segment_count = 0
+            failures = 0
+            
+            with open(output_file, 'wb') as f, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                fd = f.fileno()
+                written = 0
+                if init is not None:
+                    init_path = self._fetch_group_file(FetchGroup(init.uri, init.offset, init.length, -1, -1), task_id).path
+                    written += self._append_fetched(init_path, fd, written)
+                
+                while True:
+                    polled_at = time.monotonic()
+                    if last_sequence is not None and playlist.media_sequence > last_sequence + 1:
+                        logging.warning(f"Live playlist dropped {playlist.media_sequence - last_sequence - 1} "
+                                        f"segments before they could be recorded")
+                    new_segments = playlist.segments.tail(max(0, next_sequence - playlist.media_sequence))
+                    if len(playlist):
+                        last_sequence = max(next_sequence - 1, playlist.media_sequence + len(playlist) - 1)
+                        next_sequence = last_sequence + 1
+                    
+                    # Fetch the new segments concurrently and append them in order
+                    groups = new_segments.fetch_groups(self.max_request_bytes)
+                    futures = [executor.submit(self._fetch_group_file, group, task_id) for group in groups]
+                    for position, (group, future) in enumerate(zip(groups, futures)):
+                        if max_duration and recorded >= max_duration:
+                            for unused in futures[position:]:
+                                unused.cancel()
+                                unused.add_done_callback(self._discard_fetched)
+                            break
+                        try:
+                            path = future.result().path
+                        except Exception as e:
+                            self._segment_failed(group, e)
+                            continue
+                        written += self._append_fetched(path, fd, written)
+                        recorded += sum(new_segments.durations[group.first:group.last + 1])
+                        segment_count += group.last - group.first + 1
+                    
+                    if max_duration:
+                        progress = 10 + int(min(recorded / max_duration, 1) * 70)  # 10% to 80%
+                    else:
+                        progress = 50
+                    self.update_progress(task_id, progress, f'Recording live stream: {segment_count} segments, {int(recorded)}s')
+                    
+                    if playlist.endlist or (max_duration and recorded >= max_duration):
+                        break
+                    
+                    # Reload after one target duration, or half of it when the playlist had not changed
+                    interval = playlist.target_duration or 6
+                    if not len(new_segments):
+                        interval /= 2
+                    if cancelled.wait(max(0, polled_at + interval - time.monotonic())) or self._cancel_requested(task_id):
+                        logging.info(f"Live recording {task_id} cancelled")
+                        break
+                    
+                    try:
+                        playlist = self.parse_segments(self.fetch_playlist(m3u8_url), m3u8_url)
+                        failures = 0
+                    except Exception as e:
+                        failures += 1
+                        logging.warning(f"Live playlist reload failed ({failures}/{self.max_retries}): {str(e)}")
+                        if failures >= self.max_retries:
+                            # Keep what was recorded rather than failing an hours-long recording
+                            logging.error(f"Giving up on live playlist {m3u8_url}")
+                            break
+                        # The previous playlist is processed again, which finds nothing new
+            
+            self.add_timing(task_id, 'record', time.monotonic() - recording_started)
+            if not segment_count:
+                raise Exception("No live segments were recorded")
+            logging.info(f"Recorded {segment_count} live segments ({recorded:.1f}s) into {output_file}")
+            
+            if not init:
+                self.update_progress(task_id, 80, 'Remuxing video with ffmpeg...')
+                with self.stage(task_id, 'merge'):
+                    output_file = self.remux_file(output_file, task_id)
+            
+            self.update_progress(task_id, 100, 'Recording complete!')
+            return output_file
+            
+        except Exception as e:
+            logging.error(f"Live recording failed: {str(e)}")
             raise
+        finally:
+            self._cancel_events.pop(task_id, None)
+            self.end_task(task_id)
+    
+    def _append_fetched(self, path, fd, offset):
+        """Copy a fetched file to fd at offset, remove it, and return the bytes copied"""
+        try:
+            with open(path, 'rb') as src:
+                return copy_range(src.fileno(), fd, os.fstat(src.fileno()).st_size, 0, offset, self.buffers)
+        finally:
+            os.remove(path)
+    
+    def expect_cancel(self, task_id):
+        """Accept cancel() for a recording from when it is queued rather than when it starts"""
+        self._cancel_events.setdefault(task_id, threading.Event())
+    
+    def cancel(self, task_id):
+        """Ask a live recording to stop and keep what it has recorded
+        
+        Recordings running in another process pick the request up from the job store
+        at their next reload. Returns False for tasks that are not known.
+        """
+        event = self._cancel_events.get(task_id)
+        if event is not None:
+            event.set()
+            return True
+        if self.job_store and self.job_store.load('progress', task_id) is not None:
+            self.job_store.save('cancel', task_id, {'requested_at': time.time()}, flush=True)
+            return True
+        return False
+    
+    def _cancel_requested(self, task_id):
+        return bool(self.job_store) and self.job_store.load('cancel', task_id) is not None
+    
+    def _open_checkpoint(self, task_id):
+        """Locked checkpoint for a download, or None when checkpointing is off"""
+        if not self.checkpoint_dir:
+            return None
+        checkpoint = self._claimed.pop(task_id, None)
+        if checkpoint is None:
+            checkpoint = DownloadCheckpoint(os.path.join(self.checkpoint_dir, task_id))
+            if not checkpoint.claim():
+                raise Exception(f"Download {task_id} is already running in another process")
+        return checkpoint
+    
+    def claim_interrupted(self):
+        """Lock the checkpoints of downloads whose process died and return [(task_id, url)] to resume
+        
+        Each claimed download should be restarted with download_and_merge(url, task_id, resumable=True);
+        it then refetches only the requests its checkpoint does not hold intact.
+        """
+        if not self.checkpoint_dir:
+            return []
+        claimed = claim_interrupted(self.checkpoint_dir)
+        self._claimed.update(claimed)
+        return [(task_id, checkpoint.load()['url']) for task_id, checkpoint in claimed.items()]
+    
+    @contextmanager
+    def stage(self, task_id, name):
+        """Add the wall-clock duration of the block to the task's timing for stage name"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_timing(task_id, name, time.monotonic() - started)
+    
+    def add_timing(self, task_id, name, seconds):
+        """Accumulate seconds under name; per-request totals can exceed wall time when requests overlap"""
+        with self._timings_lock:
+            timings = self.timings.setdefault(task_id, {})
+            timings[name] = timings.get(name, 0.0) + seconds
+    
+    def get_timings(self, task_id):
+        """Seconds per stage for a task, rounded for display"""
+        with self._timings_lock:
+            return {name: round(seconds, 3) for name, seconds in self.timings.get(task_id, {}).items()}
+    
+    def new_task_id(self):
+        """Generate a unique task ID"""
+        return uuid.uuid4().hex
+    
+    def begin_task(self, task_id):
+        """Mark a task as running so the janitor leaves its progress and files alone"""
+        with self._task_lock:
+            self._task_refs[task_id] = self._task_refs.get(task_id, 0) + 1
+            self._finished_at.pop(task_id, None)
+    
+    def end_task(self, task_id):
+        with self._task_lock:
+            self._task_refs[task_id] -= 1
+            if not self._task_refs[task_id]:
+                del self._task_refs[task_id]
+                self._finished_at[task_id] = time.time()
+    
+    def reclaimable(self):
+        """(finished_at, task_id, workspace bytes) for every finished task, for the janitor"""
+        with self._task_lock:
+            finished = list(self._finished_at.items())
+        for task_id, finished_at in finished:
+            yield finished_at, task_id, dir_size(os.path.join(self.temp_dir, task_id))
+    
+    def release(self, task_id):
+        """Forget a finished task and delete its workspace"""
+        with self._task_lock:
+            if task_id in self._task_refs:
+                return
+            self._finished_at.pop(task_id, None)
+        self.progress_data.pop(task_id, None)
+        with self._timings_lock:
+            self.timings.pop(task_id, None)
+        if self.job_store:
+            self.job_store.delete('progress', task_id)
+            self.job_store.delete('cancel', task_id)
+        shutil.rmtree(os.path.join(self.temp_dir, task_id), ignore_errors=True)
+        if self.checkpoint_dir and task_id not in self._claimed:
+            # A failed download that nobody retried in time
+            shutil.rmtree(os.path.join(self.checkpoint_dir, task_id), ignore_errors=True)
+    
+    def workspace(self, task_id):
+        """Per-task working directory, so concurrent jobs on one instance never share files"""
+        path = os.path.join(self.temp_dir, task_id)
+        os.makedirs(path, exist_ok=True)
+        return path
     
     def fetch_playlist(self, url):
         """Fetch M3U8 playlist content"""
         try:
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            return response.text
+            with playlist_fetch_seconds.time():
+                response = self.pools.get(url, timeout=30)
+                response.raise_for_status()
+                return response.text
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to fetch playlist: {str(e)}")
     
-    def parse_segments(self, playlist_content, base_url):
-        """Parse segment URLs from M3U8 playlist"""
-        segment_urls = []
-        base_path = '/'.join(base_url.split('/')[:-1]) + '/'
-        
-        for line in playlist_content.strip().split('\n'):
-            line = line.strip()
-            if line and not line.startswith('#'):
-                # Handle relative URLs
-                if line.startswith('http'):
-                    segment_urls.append(line)
-                else:
-                    segment_urls.append(urljoin(base_path, line))
+    def resolve_media_playlist(self, playlist_content, playlist_url):
+        """Follow a master playlist to the media playlist of the selected variant
+        
+        Returns (playlist_content, playlist_url); media playlists are returned unchanged.
+        """
+        if not is_master_playlist(playlist_content):
+            return playlist_content, playlist_url
+        
+        variants = parse_master_playlist(playlist_content, playlist_url)
+        logging.info(f"Master playlist with {len(variants)} variants, policy: {self.variant_policy}")
         
-        return segment_urls
+        duration = None
+        probed = {}
+        if self.variant_policy == 'byte_budget':
+            # Every variant shares the timeline, so the cheapest media playlist gives the duration
+            lowest = min(variants, key=lambda v: v.bandwidth) if variants else None
+            if lowest:
+                probed[lowest.uri] = self.fetch_playlist(lowest.uri)
+                duration = playlist_duration(probed[lowest.uri])
+        
+        variant = select_variant(
+            variants,
+            policy=self.variant_policy,
+            max_height=self.max_height,
+            byte_budget=self.byte_budget,
+            duration=duration
+        )
+        logging.info(f"Selected {variant}")
+        
+        media_content = probed.get(variant.uri) or self.fetch_playlist(variant.uri)
+        if is_master_playlist(media_content):
+            raise Exception("Variant playlist is itself a master playlist")
+        
+        return media_content, variant.uri
+    
+    def parse_segments(self, playlist_content, base_url):
+        """Parse an M3U8 media playlist into a MediaPlaylist with a compact segment table"""
+        return parse_media_playlist(playlist_content, base_url)
     
-    def download_segments(self, segment_urls, task_id):
-        """Download all video segments"""
-        segment_files = []
-        total_segments = len(segment_urls)
+    def download_segments(self, playlist, task_id):
+        """Download all video segments concurrently, keeping playlist order
         
-        for i, url in enumerate(segment_urls):
-            try:
-                # Update progress
-                progress = 30 + int((i / total_segments) * 45)  # 30% to 75%
-                self.update_progress(task_id, progress, f'Downloading segment {i+1}/{total_segments}...')
-                
-                # Download segment
-                response = self.session.get(url, timeout=30)
-                response.raise_for_status()
-                
-                # Save segment to temp file
-                segment_file = os.path.join(self.temp_dir, f'segment_{i:06d}.ts')
-                with open(segment_file, 'wb') as f:
-                    f.write(response.content)
-                
-                segment_files.append(segment_file)
-                logging.debug(f"Downloaded segment {i+1}/{total_segments}: {url}")
+        Adjacent EXT-X-BYTERANGE segments of the same file are fetched with one ranged GET.
+        """
+        segments = playlist.segments
+        total_segments = len(segments)
+        groups = segments.fetch_groups(self.max_request_bytes)
+        results = [None] * total_segments
+        completed = 0
+        work_dir = self.workspace(task_id)
+        
+        if len(groups) < total_segments:
+            logging.info(f"Coalesced {total_segments} byte-range segments into {len(groups)} requests")
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups))) as executor:
+            future_to_group = {
+                executor.submit(self._download_group, segments, group, work_dir, task_id): group
+                for group in groups
+            }
+            
+            # Progress is reported from this thread only, so callbacks never run concurrently
+            for future in as_completed(future_to_group):
+                group = future_to_group[future]
+                completed += group.last - group.first + 1
+                try:
+                    for index, segment_file in future.result():
+                        results[index] = segment_file
+                    logging.debug("Downloaded segments %d-%d/%d: %s", group.first + 1, group.last + 1, total_segments, group.uri)
+                except Exception as e:
+                    self._segment_failed(group, e, future_to_group)
+                    # Continue with other segments
                 
-            except Exception as e:
-                logging.error(f"Failed to download segment {url}: {str(e)}")
-                # Continue with other segments
-                continue
+                progress = 30 + int((completed / total_segments) * 45)  # 30% to 75%
+                self.update_progress(task_id, progress, f'Downloading segment {completed}/{total_segments}...')
+        
+        # Keep playlist order for merge_segments
+        segment_files = [segment_file for segment_file in results if segment_file]
         
         if not segment_files:
             raise Exception("Failed to download any video segments")
@@ -120,79 +540,834 @@ class M3U8Downloader:
         logging.info(f"Successfully downloaded {len(segment_files)} segments")
         return segment_files
     
-    def merge_segments(self, segment_files, task_id):
-        """Merge video segments using ffmpeg"""
+    def assemble_segments(self, playlist, task_id):
+        """Download segments straight into a single output file
+        
+        When every segment size is known (EXT-X-BYTERANGE) the file is preallocated and
+        requests write at their final offsets as they complete; otherwise segments are
+        appended in playlist order from a bounded look-ahead window. For fMP4 the init
+        segment is written first, making the result a playable fragmented MP4.
+        """
+        segments = playlist.segments
+        init = playlist.init_segment
+        output_file = os.path.join(self.workspace(task_id), 'output.mp4' if init else 'assembled.ts')
+        
+        failed = []
+        with open(output_file, 'wb') as f:
+            if init is not None:
+                init_path = self._fetch_group_file(FetchGroup(init.uri, init.offset, init.length, -1, -1), task_id).path
+                with open(init_path, 'rb') as src:
+                    shutil.copyfileobj(src, f)
+                os.remove(init_path)
+            
+            if min(segments.offsets, default=-1) >= 0:
+                failed = self._assemble_at_offsets(playlist, f, task_id)
+            else:
+                written = self.write_segment_data(playlist, task_id, f.write, include_init=False, progress_end=75)
+                if not written:
+                    raise Exception("Failed to download any video segments")
+        
+        if failed:
+            # Skip failed segments like the per-file path does instead of leaving zero-filled holes
+            self._remove_ranges(output_file, sorted(failed))
+        
+        logging.info(f"Assembled {len(segments)} segments into {output_file}")
+        return output_file
+    
+    def _assemble_at_offsets(self, playlist, f, task_id):
+        """Write byte-range segments concurrently into a preallocated file
+        
+        Returns the (start, end) output ranges of segments that could not be downloaded.
+        """
+        segments = playlist.segments
+        total_segments = len(segments)
+        groups = segments.fetch_groups(self.max_request_bytes)
+        
+        # Output offset of every segment is the running sum of the lengths before it
+        positions = [f.tell()] * (total_segments + 1)
+        for index in range(total_segments):
+            positions[index + 1] = positions[index] + segments.lengths[index]
+        
+        failed = []
+        completed = 0
+        f.flush()
+        f.truncate(positions[-1])
+        fd = f.fileno()
+        
+        def write_group(group):
+            # Segments of a group are contiguous, so the whole group lands with one copy
+            path = self._fetch_group_file(group, task_id).path
+            try:
+                with open(path, 'rb') as src:
+                    copy_range(src.fileno(), fd, group.length, 0, positions[group.first], self.buffers)
+            finally:
+                os.remove(path)
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups))) as executor:
+            future_to_group = {executor.submit(write_group, group): group for group in groups}
+            for future in as_completed(future_to_group):
+                group = future_to_group[future]
+                completed += group.last - group.first + 1
+                try:
+                    future.result()
+                except Exception as e:
+                    self._segment_failed(group, e, future_to_group)
+                    failed.append((positions[group.first], positions[group.last + 1]))
+                
+                progress = 30 + int((completed / total_segments) * 45)  # 30% to 75%
+                self.update_progress(task_id, progress, f'Downloading segment {completed}/{total_segments}...')
+        
+        if len(failed) == len(groups):
+            raise Exception("Failed to download any video segments")
+        return failed
+    
+    def _remove_ranges(self, path, ranges):
+        """Rewrite a file without the given sorted (start, end) byte ranges"""
+        compacted_path = path + '.compact'
+        with open(path, 'rb') as src, open(compacted_path, 'wb') as dst:
+            position = 0
+            written = 0
+            for start, end in ranges + [(os.path.getsize(path), None)]:
+                written += copy_range(src.fileno(), dst.fileno(), start - position, position, written, self.buffers)
+                position = end
+        os.replace(compacted_path, path)
+    
+    def download_init_segment(self, playlist, task_id):
+        """Download the EXT-X-MAP initialization segment, if the playlist has one"""
+        init = playlist.init_segment
+        if init is None:
+            return None
+        
+        init_file = os.path.join(self.workspace(task_id), 'init.mp4')
+        os.replace(self._fetch_group_file(FetchGroup(init.uri, init.offset, init.length, -1, -1), task_id).path, init_file)
+        return init_file
+    
+    def _download_group(self, segments, group, work_dir, task_id):
+        """Download one fetch group and write each of its segments to a numbered temp file"""
+        path = self._fetch_group_file(group, task_id).path
+        if group.first == group.last:
+            segment_file = os.path.join(work_dir, f'segment_{group.first:06d}.ts')
+            os.replace(path, segment_file)
+            return [(group.first, segment_file)]
+        
+        written = []
+        try:
+            with open(path, 'rb') as src:
+                for index in range(group.first, group.last + 1):
+                    segment_file = os.path.join(work_dir, f'segment_{index:06d}.ts')
+                    with open(segment_file, 'wb') as dst:
+                        copy_range(src.fileno(), dst.fileno(), segments.lengths[index],
+                                   segments.offsets[index] - group.offset, 0, self.buffers)
+                    written.append((index, segment_file))
+        finally:
+            os.remove(path)
+        return written
+    
+    def _segment_failed(self, group, error, futures=()):
+        """Log a segment that failed after all retries; in strict mode abort the whole job"""
+        logging.error(f"Failed to download segment {group.uri}: {str(error)}")
+        if self.strict:
+            for future in futures:
+                future.cancel()
+            raise Exception(f"Segment {group.first + 1} could not be downloaded: {str(error)}")
+    
+    def _fetch_group_file(self, group, task_id, tap=None):
+        """Fetch a fetch group into a new file in the task workspace and return a FetchedFile
+        
+        The bytes come from the download's checkpoint or the segment cache when possible,
+        otherwise from the network with retries and hedging; fetched files are added to
+        the checkpoint. The caller owns (and removes) the returned file. With a tap from
+        an _OrderedWriter, network bodies are also streamed to its output once the group
+        is at the write position.
+        """
+        checkpoint = self._checkpoints.get(task_id)
+        if checkpoint is None:
+            return self._fetch_group(group, task_id, tap)
+        
+        key = SegmentCache.make_key(group.uri, group.offset, group.length)
+        path = self._spool_path(task_id)
+        entry = checkpoint.link_to(key, path)
+        if entry is not None:
+            return FetchedFile(path, *entry)
+        fetched = self._fetch_group(group, task_id, tap)
+        checkpoint.add(key, fetched.path, fetched.digest, fetched.size)
+        return fetched
+    
+    def _fetch_group(self, group, task_id, tap=None):
+        cache = self.segment_cache
+        if cache and not cache.revalidate:
+            path = self._spool_path(task_id)
+            entry = cache.link_to(SegmentCache.make_key(group.uri, group.offset, group.length), path)
+            if entry is not None:
+                return FetchedFile(path, *entry)
+        
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._fetch_group_hedged(group, task_id, tap)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap, e)
+                logging.warning(f"Retrying {group.uri} in {delay:.2f}s (attempt {attempt + 2}): {str(e)}")
+                time.sleep(delay)
+    
+    def _spool_path(self, task_id):
+        """Unique path in the task workspace for one fetch attempt"""
+        return os.path.join(self.workspace(task_id), f'fetch_{uuid.uuid4().hex}.part')
+    
+    @staticmethod
+    def _discard_fetched(future):
+        """Done-callback removing the file of a fetch whose result nobody will use"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        try:
+            os.remove(future.result().path)
+        except OSError:
+            pass
+    
+    def _fetch_group_hedged(self, group, task_id, tap=None):
+        """Run one fetch attempt; if it outlives the hedge threshold, race a duplicate request
+        
+        The primary request runs in the calling thread. A timer starts the duplicate on
+        the process-wide hedge pool; whichever lands its file first wins and the other
+        is aborted, so the caller never waits for the slower one. Only the primary
+        streams to the tap; the duplicate always writes a complete file.
+        """
+        threshold = self.latency.percentile(origin_of(group.uri), self.hedge_percentile) if self.hedge_percentile else None
+        if threshold is None:
+            return self._timed_request(group, task_id, tap=tap)
+        threshold = max(threshold, self.hedge_min_delay)
+        
+        race = _HedgeRace()
+        timer = threading.Timer(threshold, self._start_hedge, (group, task_id, race, threshold))
+        timer.daemon = True
+        timer.start()
+        try:
+            fetched = self._timed_request(group, task_id, race, tap)
+        except Exception:
+            timer.cancel()
+            hedge = race.settle()
+            if hedge is None:
+                raise
+            # The primary failed, or was aborted because the duplicate already won
+            return hedge.result()
+        
+        timer.cancel()
+        race.settle()
+        if race.claim(fetched):
+            return fetched
+        # The duplicate landed first
+        os.remove(fetched.path)
+        return race.winner
+    
+    def _start_hedge(self, group, task_id, race, threshold):
+        """Timer callback launching the duplicate of a request that is still running"""
+        # A duplicate would only queue behind the origin's or the scheduler's concurrency limit
+        if not self.pools.limiter_for(group.uri).has_capacity() or not self.scheduler.has_capacity('fetch'):
+            return
+        if not race.start(lambda: _get_hedge_executor(self.scheduler).submit(self._run_hedge, group, task_id, race)):
+            return
+        with self._hedge_lock:
+            self.hedged_requests += 1
+        logging.debug("Hedging slow request after %.2fs: %s", threshold, group.uri)
+    
+    def _run_hedge(self, group, task_id, race):
+        if race.decided():
+            raise _HedgeLost("The primary request finished first")
+        fetched = self._timed_request(group, task_id, race)
+        if not race.claim(fetched):
+            os.remove(fetched.path)
+            raise _HedgeLost("The primary request finished first")
+        return fetched
+    
+    def _timed_request(self, group, task_id, race=None, tap=None):
+        """Single request attempt, run in a scheduler fetch slot, that feeds the latency window on success
+        
+        The request queues for its origin's concurrency limit first and only then for
+        the fetch slot, so requests held back by a throttled origin never sit on global
+        slots that requests to other origins could use.
+        """
+        path = self._spool_path(task_id)
+        queued = time.monotonic()
+        granted = []
+        
+        @contextmanager
+        def fetch_slot():
+            with self.scheduler.slot('fetch', self.flow or task_id, self.priority):
+                granted.append(time.monotonic())
+                yield
+        
+        try:
+            with race.connections.watching() if race is not None else nullcontext():
+                size, digest, received = self._request_group_file(group, path, task_id, race, fetch_slot, tap)
+        except Exception as e:
+            if os.path.exists(path):
+                os.remove(path)
+            if race is not None and race.decided():
+                # Cut off by the other copy of the request, not an origin failure
+                raise _HedgeLost("The other copy of this request finished first") from e
+            segment_failures_total.inc()
+            raise
+        finished = time.monotonic()
+        # Revalidated cache entries are linked without a request
+        started = granted[0] if granted else finished
+        elapsed = finished - started
+        if granted:
+            self.latency.record(origin_of(group.uri), elapsed)
+        
+        segment_fetch_seconds.observe(elapsed)
+        segment_fetch_bytes.observe(size)
+        # Only bytes that came over the network; cache hits and 304 revalidations add nothing
+        segment_bytes_total.inc(received)
+        # Slot wait is time queued behind the origin's limit and the scheduler, request time is network plus disk
+        self.add_timing(task_id, 'fetch_slot_wait', started - queued)
+        self.add_timing(task_id, 'segment_requests', elapsed)
+        return FetchedFile(path, size, digest)
+    
+    def _request_group_file(self, group, path, task_id=None, race=None, fetch_slot=None, tap=None):
+        """Stream the bytes of a fetch group to path, using a Range request for byte-range groups
+        
+        The body is written in buffer-sized chunks while its length and SHA-256 are
+        computed, so nothing is held in memory or re-read to store it in the segment cache
+        or the checkpoint. Returns (size, SHA-256 hex digest) of the file and the bytes
+        received in a response body, which is 0 when the file came from the cache.
+        With cache revalidation enabled, cached entries that have an ETag are confirmed
+        with a conditional request.
+        """
+        headers = {}
+        if group.offset is not None:
+            headers['Range'] = f'bytes={group.offset}-{group.offset + group.length - 1}'
+        
+        cache = self.segment_cache
+        cache_key = SegmentCache.make_key(group.uri, group.offset, group.length)
+        if cache and cache.revalidate:
+            etag = cache.etag(cache_key)
+            if etag:
+                headers['If-None-Match'] = etag
+            else:
+                entry = cache.link_to(cache_key, path)
+                if entry is not None:
+                    return (*entry, 0)
+        
+        within = fetch_slot() if fetch_slot is not None else None
+        with self.pools.stream(group.uri, within=within, timeout=30, headers=headers) as response:
+            if response.status_code == 304 and cache:
+                entry = cache.link_to(cache_key, path)
+                if entry is not None:
+                    cache.mark_revalidated(cache_key)
+                    return (*entry, 0)
+                not_modified = True
+            else:
+                not_modified = False
+                response.raise_for_status()
+                written, received, digest = self._write_body(response, group, path, task_id, race, tap)
+                content_length = response.headers.get('Content-Length')
+                encoded = 'Content-Encoding' in response.headers
+                etag = response.headers.get('ETag')
+        
+        if not_modified:
+            # Entry vanished between the lookup and the response, fetch it unconditionally
+            return self._request_group_file(group, path, task_id, race, fetch_slot, tap)
+        
+        if group.offset is not None:
+            if written < group.length:
+                raise Exception(f"Short read: got {written} of {group.length} bytes")
+            complete = True
+        else:
+            complete = content_length is None or encoded or int(content_length) == received
+        if cache and complete:
+            cache.put_file(cache_key, path, written, digest, etag=etag)
+        return written, digest, received
+    
+    def _write_body(self, response, group, path, task_id=None, race=None, tap=None):
+        """Write a streamed response body to path through a pooled buffer
+        
+        Once the tap's group reaches the write position, the part spooled so far is
+        handed over and the rest of the body goes straight to the output; it is only
+        still written to path when the file must be kept (segment cache, checkpoint).
+        Returns (bytes of the body, bytes received, SHA-256 hex digest of the body).
+        Time spent in file writes is added to the task's 'disk_write' timing.
+        """
+        # Origin ignored the Range header and sent the whole resource: keep only our window
+        skip = group.offset if group.offset is not None and response.status_code != 206 else 0
+        limit = group.length if group.offset is not None else None
+        sha = hashlib.sha256()
+        written = received = 0
+        disk_seconds = 0.0
+        direct = False
+        
+        with self.buffers.borrow() as buffer, open(path, 'wb') as f:
+            for chunk in iter_body(response, buffer):
+                if race is not None and race.decided():
+                    raise _HedgeLost("The other copy of this request finished first")
+                start = max(0, skip - received)
+                received += len(chunk)
+                self.scheduler.throttle(len(chunk))
+                if start >= len(chunk):
+                    continue
+                piece = chunk[start:] if limit is None else chunk[start:start + limit - written]
+                if tap is not None and not direct and tap.at_position():
+                    f.flush()
+                    tap.catch_up(path, written)
+                    direct = True
+                if direct:
+                    tap.write(written, piece)
+                if not direct or tap.retain:
+                    write_started = time.monotonic()
+                    f.write(piece)
+                    disk_seconds += time.monotonic() - write_started
+                sha.update(piece)
+                written += len(piece)
+                if limit is not None and written >= limit:
+                    break
+        
+        if task_id is not None:
+            self.add_timing(task_id, 'disk_write', disk_seconds)
+        return written, received, sha.hexdigest()
+    
+    def stream_and_merge(self, m3u8_url, container='mp4'):
+        """Fetch the playlist and return a generator that streams the merged video
+        
+        The playlist is fetched eagerly so errors surface before the first byte is sent.
+        container='mp4' pipes the segments through ffmpeg into a fragmented MP4,
+        container='ts' passes the MPEG-TS segments through unchanged.
+        """
+        task_id = self.new_task_id()
+        self.progress_data[task_id] = {'percent': 0, 'status': 'Starting stream...'}
+        
+        logging.info(f"Starting streaming download for URL: {m3u8_url}")
+        
+        self.update_progress(task_id, 10, 'Fetching M3U8 playlist...')
+        playlist_content = self.fetch_playlist(m3u8_url)
+        playlist_content, m3u8_url = self.resolve_media_playlist(playlist_content, m3u8_url)
+        
+        self.update_progress(task_id, 20, 'Parsing video segments...')
+        playlist = self.parse_segments(playlist_content, m3u8_url)
+        
+        if not len(playlist):
+            raise Exception("No video segments found in playlist")
+        
+        if container == 'ts':
+            return self._stream_passthrough(playlist, task_id)
+        if container == 'mp4':
+            return self._stream_fragmented_mp4(playlist, task_id)
+        raise Exception(f"Unsupported stream container: {container}")
+    
+    def write_segment_data(self, playlist, task_id, write, include_init=True, progress_end=95):
+        """Pass segment bytes to write() in playlist order while later segments are still downloading
+        
+        The request for the fetch group at the write position streams its body straight
+        into write(); only groups that finish ahead of it wait in spool files in the task
+        workspace. The EXT-X-MAP initialization segment, if any, is written first unless
+        include_init is False. Returns the number of fetch groups written; an error raised
+        by write() is re-raised once the requests already running have finished.
+        """
+        segments = playlist.segments
+        total_segments = len(segments)
+        groups = segments.fetch_groups(self.max_request_bytes)
+        # Only keep a bounded window of requests ahead of the write position so disk use stays flat
+        window = self.max_workers * 2
+        
+        def advanced(group):
+            progress = 30 + int(((group.last + 1) / total_segments) * (progress_end - 30))
+            self.update_progress(task_id, progress, f'Downloading segment {group.last + 1}/{total_segments}...')
+        
+        # Fetched files must stay complete when the segment cache or the checkpoint keeps them
+        retain = bool(self.segment_cache) or task_id in self._checkpoints
+        writer = _OrderedWriter(write, groups, retain, self.buffers.chunk_size, advanced)
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups)))
+        
+        self.begin_task(task_id)
+        try:
+            init = playlist.init_segment
+            if include_init and init is not None:
+                init_path = self._fetch_group_file(FetchGroup(init.uri, init.offset, init.length, -1, -1), task_id).path
+                try:
+                    with open(init_path, 'rb') as f:
+                        for chunk in self._read_chunks(f):
+                            write(chunk)
+                finally:
+                    os.remove(init_path)
+            
+            for index, group in enumerate(groups):
+                writer.wait_for(index - window + 1)
+                executor.submit(self._fetch_in_order, writer, index, group, task_id)
+            writer.wait_for(len(groups))
+            return writer.groups_written
+        finally:
+            # Stop fetching if the output went away. Requests already running are waited for,
+            # so they are added to the checkpoint before the caller closes it and a retry does
+            # not fetch them again; their files are dropped
+            writer.close()
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.end_task(task_id)
+    
+    def _fetch_in_order(self, writer, index, group, task_id):
+        """Fetch one group for write_segment_data and hand it to the writer"""
+        try:
+            fetched = self._fetch_group_file(group, task_id, writer.tap(index))
+        except Exception as e:
+            try:
+                self._segment_failed(group, e)
+            except Exception as error:
+                writer.abort(error)
+                return
+            fetched = None
+        try:
+            writer.finish(index, fetched)
+        except Exception as e:
+            writer.abort(e)
+    
+    def _read_chunks(self, f, length=None):
+        """Yield up to length bytes (or the rest of the file) in transfer-buffer-sized chunks"""
+        chunk_size = self.buffers.chunk_size
+        while length is None or length > 0:
+            chunk = f.read(chunk_size if length is None else min(chunk_size, length))
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+    
+    def _stream_passthrough(self, playlist, task_id, chunk_size=64 * 1024):
+        """Stream the segments unchanged
+        
+        A feeder thread writes the segments into a pipe that the response reads, so
+        in-order bodies reach the client without passing through the disk.
+        """
+        read_fd, write_fd = os.pipe()
+        errors = []
+        
+        def feed_segments():
+            try:
+                with open(write_fd, 'wb') as sink:
+                    self.write_segment_data(playlist, task_id, sink.write)
+            except BrokenPipeError:
+                # The client went away and the response closed the pipe
+                pass
+            except Exception as e:
+                errors.append(e)
+        
+        feeder = threading.Thread(target=feed_segments, daemon=True)
+        feeder.start()
         try:
-            self.update_progress(task_id, 85, 'Creating segment list for ffmpeg...')
+            with open(read_fd, 'rb', buffering=0) as source:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            # With the read end closed, a feeder still writing stops at once
+            feeder.join()
+        if errors:
+            raise errors[0]
+        self.update_progress(task_id, 100, 'Stream complete!')
+    
+    def _stream_fragmented_mp4(self, playlist, task_id, chunk_size=64 * 1024):
+        """Remux segments into fragmented MP4 through ffmpeg stdin/stdout"""
+        # fMP4/CMAF segments carry their own container, only plain TS needs the format hint
+        input_format = [] if playlist.init_segment else ['-f', 'mpegts']
+        cmd = [
+            'ffmpeg',
+            *input_format,
+            '-i', 'pipe:0',
+            '-c', 'copy',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4',
+            'pipe:1'
+        ]
+        
+        errors = []
+        
+        def feed_segments(process):
+            try:
+                self.write_segment_data(playlist, task_id, process.stdin.write)
+            except (BrokenPipeError, ValueError):
+                # ffmpeg exited or the stream was closed
+                pass
+            except Exception as e:
+                logging.error(f"Failed to feed segments to ffmpeg: {str(e)}")
+                errors.append(e)
+                # Closing stdin would let ffmpeg finish a valid-looking but truncated MP4
+                process.kill()
+            finally:
+                try:
+                    process.stdin.close()
+                except (BrokenPipeError, OSError):
+                    pass
+        
+        def generate():
+            # ffmpeg starts with the response body and holds a merge slot until it exits
+            with self.scheduler.slot('merge', self.flow or task_id, self.priority) as waited, \
+                    tempfile.TemporaryFile(dir=self.workspace(task_id)) as stderr_file:
+                merge_queue_seconds.observe(waited)
+                self.add_timing(task_id, 'merge_queue_wait', waited)
+                logging.info(f"Running ffmpeg command: {' '.join(cmd)}")
+                process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr_file)
+                feeder = threading.Thread(target=feed_segments, args=(process,), daemon=True)
+                feeder.start()
+                try:
+                    while True:
+                        chunk = os.read(process.stdout.fileno(), chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+                    
+                    returncode = process.wait()
+                    feeder.join()
+                    if errors:
+                        raise errors[0]
+                    if returncode != 0:
+                        stderr_file.seek(0)
+                        error = stderr_file.read().decode(errors='replace')[-2000:]
+                        logging.error(f"FFmpeg error: {error}")
+                        raise Exception(f"FFmpeg failed: {error}")
+                    
+                    self.update_progress(task_id, 100, 'Stream complete!')
+                    logging.info("FFmpeg streaming completed successfully")
+                finally:
+                    if process.poll() is None:
+                        process.kill()
+                        process.wait()
+                    process.stdout.close()
+                    feeder.join(timeout=5)
+        
+        return generate()
+    
+    def pipe_segments(self, playlist, task_id):
+        """Download plain TS segments straight into ffmpeg's stdin and return the remuxed MP4
+        
+        ffmpeg starts before the first segment and receives segments in playlist order
+        as they arrive (from the same bounded look-ahead window as streaming), so the
+        MP4 is finished moments after the last segment lands. Only stalls are timed out:
+        ffmpeg is killed once it has neither accepted input nor grown the output for
+        merge_stall_timeout seconds, however long the video.
+        
+        The ffmpeg process lives as long as the download, so it holds a slot from the
+        scheduler's separate 'pipe' budget rather than a merge slot, and is only started
+        when one is free right away. Otherwise None is returned without downloading
+        anything and the caller assembles first and queues for the remux.
+        """
+        with self.scheduler.slot('pipe', self.flow or task_id, self.priority, block=False) as waited:
+            if waited is None:
+                logging.info("No free pipelined remux slot, remuxing after the download instead")
+                return None
+            return self._pipe_segments(playlist, task_id)
+    
+    def _pipe_segments(self, playlist, task_id):
+        work_dir = self.workspace(task_id)
+        output_file = os.path.join(work_dir, 'output.mp4')
+        cmd = ['ffmpeg', '-f', 'mpegts', '-i', 'pipe:0', '-c', 'copy', '-y', output_file]
+        
+        logging.info(f"Running ffmpeg command: {' '.join(cmd)}")
+        
+        with tempfile.TemporaryFile(dir=work_dir) as stderr_file:
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file)
+            watchdog = _FFmpegWatchdog(process, output_file, self.merge_stall_timeout)
             
-            # Create file list for ffmpeg
-            filelist_path = os.path.join(self.temp_dir, 'filelist.txt')
-            with open(filelist_path, 'w') as f:
-                for segment_file in segment_files:
-                    f.write(f"file '{segment_file}'\n")
+            def write(data):
+                # Time spent waiting on other segments is not ffmpeg's, only blocked writes count
+                with watchdog.busy():
+                    process.stdin.write(data)
             
-            # Output file
-            output_file = os.path.join(self.temp_dir, 'output.mp4')
+            try:
+                with self.stage(task_id, 'download'):
+                    received = None
+                    try:
+                        received = self.write_segment_data(playlist, task_id, write, include_init=False, progress_end=90)
+                    except BrokenPipeError:
+                        # ffmpeg exited early (or was killed as stalled); its status explains why
+                        pass
+                    finally:
+                        try:
+                            process.stdin.close()
+                        except OSError:
+                            pass
+                    if received == 0:
+                        raise Exception("Failed to download any video segments")
+                
+                # Only the tail after the last segment adds to the job's wall-clock time
+                self.update_progress(task_id, 90, 'Finishing MP4...')
+                with self.stage(task_id, 'merge'), ffmpeg_seconds.time():
+                    returncode = watchdog.wait()
+                self._record_cpu(task_id, watchdog.cpu_seconds)
+            finally:
+                watchdog.stop()
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
             
-            self.update_progress(task_id, 90, 'Running ffmpeg to merge segments...')
+            if watchdog.stalled:
+                raise Exception(f"FFmpeg made no progress for {self.merge_stall_timeout}s")
+            if returncode != 0:
+                stderr_file.seek(0)
+                error = stderr_file.read().decode(errors='replace')[-2000:]
+                logging.error(f"FFmpeg error: {error}")
+                raise Exception(f"FFmpeg failed: {error}")
+        
+        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            raise Exception("Output file is empty")
+        
+        logging.info(f"FFmpeg completed successfully. Output: {output_file}")
+        return output_file
+    
+    def merge_segments(self, segment_files, task_id, init_file=None):
+        """Merge video segments using ffmpeg"""
+        try:
+            # Output file
+            work_dir = self.workspace(task_id)
+            output_file = os.path.join(work_dir, 'output.mp4')
             
-            # FFmpeg command to concatenate segments
-            cmd = [
-                'ffmpeg',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', filelist_path,
-                '-c', 'copy',
-                '-y',  # Overwrite output file
-                output_file
-            ]
-            
-            logging.info(f"Running ffmpeg command: {' '.join(cmd)}")
-            
-            # Run ffmpeg
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout
-            )
+            if init_file:
+                # fMP4 fragments are only playable behind their init segment, so join bytes first
+                self.update_progress(task_id, 85, 'Joining fMP4 fragments...')
+                combined_path = os.path.join(work_dir, 'combined.mp4')
+                with open(combined_path, 'wb') as combined:
+                    for path in [init_file] + segment_files:
+                        with open(path, 'rb') as f:
+                            shutil.copyfileobj(f, combined)
+                input_args = ['-i', combined_path]
+            else:
+                self.update_progress(task_id, 85, 'Creating segment list for ffmpeg...')
+                
+                # Create file list for ffmpeg
+                filelist_path = os.path.join(work_dir, 'filelist.txt')
+                with open(filelist_path, 'w') as f:
+                    for segment_file in segment_files:
+                        f.write(f"file '{segment_file}'\n")
+                input_args = ['-f', 'concat', '-safe', '0', '-i', filelist_path]
             
-            if result.returncode != 0:
-                logging.error(f"FFmpeg error: {result.stderr}")
-                raise Exception(f"FFmpeg failed: {result.stderr}")
+            self.update_progress(task_id, 90, 'Running ffmpeg to merge segments...')
+            return self._run_ffmpeg(input_args, output_file, task_id)
             
-            if not os.path.exists(output_file):
-                raise Exception("Output file was not created by ffmpeg")
+        except subprocess.TimeoutExpired:
+            raise Exception(f"Video processing stalled: ffmpeg made no progress for {self.merge_stall_timeout}s")
+        except Exception as e:
+            logging.error(f"Failed to merge segments: {str(e)}")
+            raise Exception(f"Failed to merge video segments: {str(e)}")
+    
+    def remux_file(self, input_file, task_id):
+        """Remux a single assembled TS file into MP4 with one ffmpeg pass"""
+        try:
+            output_file = os.path.join(self.workspace(task_id), 'output.mp4')
             
-            # Verify output file has content
-            if os.path.getsize(output_file) == 0:
-                raise Exception("Output file is empty")
+            self.update_progress(task_id, 90, 'Running ffmpeg to remux video...')
+            self._run_ffmpeg(['-i', input_file], output_file, task_id)
             
-            logging.info(f"FFmpeg completed successfully. Output: {output_file}")
+            # The assembled copy is no longer needed once the MP4 exists
+            os.remove(input_file)
             return output_file
             
         except subprocess.TimeoutExpired:
-            raise Exception("Video processing timed out. File may be too large.")
+            raise Exception(f"Video processing stalled: ffmpeg made no progress for {self.merge_stall_timeout}s")
         except Exception as e:
-            logging.error(f"Failed to merge segments: {str(e)}")
-            raise Exception(f"Failed to merge video segments: {str(e)}")
+            logging.error(f"Failed to remux video: {str(e)}")
+            raise Exception(f"Failed to remux video: {str(e)}")
+    
+    def _run_ffmpeg(self, input_args, output_file, task_id):
+        """Run an ffmpeg stream copy into output_file, in a scheduler merge slot, and verify the result"""
+        cmd = [
+            'ffmpeg',
+            *input_args,
+            '-c', 'copy',
+            '-y',  # Overwrite output file
+            output_file
+        ]
+        
+        logging.info(f"Running ffmpeg command: {' '.join(cmd)}")
+        
+        # Run ffmpeg; a large file may take as long as it needs while the output keeps growing.
+        # Merge slots are granted interactive jobs first, then round-robin between jobs and batches
+        with tempfile.TemporaryFile(dir=self.workspace(task_id)) as stderr_file:
+            with self.scheduler.slot('merge', self.flow or task_id, self.priority) as waited:
+                merge_queue_seconds.observe(waited)
+                self.add_timing(task_id, 'merge_queue_wait', waited)
+                with ffmpeg_seconds.time():
+                    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                               stderr=stderr_file)
+                    watchdog = _FFmpegWatchdog(process, output_file, self.merge_stall_timeout)
+                    returncode = watchdog.wait()
+            self._record_cpu(task_id, watchdog.cpu_seconds)
+            
+            if watchdog.stalled:
+                raise subprocess.TimeoutExpired(cmd, self.merge_stall_timeout)
+            if returncode != 0:
+                stderr_file.seek(0)
+                error = stderr_file.read().decode(errors='replace')
+                logging.error(f"FFmpeg error: {error}")
+                raise Exception(f"FFmpeg failed: {error}")
+        
+        if not os.path.exists(output_file):
+            raise Exception("Output file was not created by ffmpeg")
+        
+        # Verify output file has content
+        if os.path.getsize(output_file) == 0:
+            raise Exception("Output file is empty")
+        
+        logging.info(f"FFmpeg completed successfully. Output: {output_file}")
+        return output_file
+    
+    def _record_cpu(self, task_id, cpu_seconds):
+        """Account the CPU time of one ffmpeg run, when the platform could measure it"""
+        if cpu_seconds is not None:
+            ffmpeg_cpu_seconds.observe(cpu_seconds)
+            self.add_timing(task_id, 'ffmpeg_cpu', cpu_seconds)
     
     def update_progress(self, task_id, percent, status):
-        """Update progress for a specific task"""
-        self.progress_data[task_id] = {
+        """Update progress for a specific task, and for any tasks waiting on its result"""
+        progress = {
             'percent': percent,
-            'status': status
+            'status': status,
+            'timings': self.get_timings(task_id)
         }
-        logging.info(f"Progress {percent}%: {status}")
+        self._publish_progress(task_id, progress)
+        with self._task_lock:
+            followers = list(self._followers.get(task_id, ()))
+        for follower_id in followers:
+            self._publish_progress(follower_id, progress)
+        # Called for every segment; lazy formatting keeps it cheap when DEBUG is off
+        logging.debug("Progress %s%%: %s", percent, status)
+    
+    def _publish_progress(self, task_id, progress):
+        self.progress_data[task_id] = progress
+        if self.job_store:
+            self.job_store.save('progress', task_id, progress)
+        progress_broker.publish(f'task:{task_id}', 'job', {'percent': progress['percent'], 'message': progress['status']})
+    
+    @contextmanager
+    def follow_progress(self, leader_id, task_id):
+        """Mirror the progress of leader_id onto task_id for the duration of the block
+        
+        For jobs coalesced onto another job's download: they run nothing themselves but
+        report what the job they wait on is doing.
+        """
+        with self._task_lock:
+            self._followers.setdefault(leader_id, set()).add(task_id)
+        progress = self.progress_data.get(leader_id)
+        if progress is not None:
+            self._publish_progress(task_id, progress)
+        try:
+            yield
+        finally:
+            with self._task_lock:
+                followers = self._followers.get(leader_id)
+                followers.discard(task_id)
+                if not followers:
+                    del self._followers[leader_id]
     
     def get_progress(self, task_id):
-        """Get progress for a specific task"""
-        return self.progress_data.get(task_id, {'percent': 0, 'status': 'Unknown task'})
+        """Get progress for a specific task, from the job store if another process runs it"""
+        progress = self.progress_data.get(task_id)
+        if progress is None and self.job_store:
+            progress = self.job_store.load('progress', task_id)
+        return progress or {'percent': 0, 'status': 'Unknown task'}
     
     def cleanup(self):
         """Clean up temporary files"""
+        if not getattr(self, 'owns_temp_dir', False):
+            return
         try:
-            import shutil
             shutil.rmtree(self.temp_dir, ignore_errors=True)
             logging.info(f"Cleaned up temporary directory: {self.temp_dir}")
         except Exception as e:
@@ -204,10 +1379,15 @@ class M3U8Downloader:
 
 
 class BatchDownloader:
-    def __init__(self, max_concurrent=3):
+    def __init__(self, max_concurrent=3, segment_workers=8, job_store=None):
         self.max_concurrent = max_concurrent
+        self.segment_workers = segment_workers
         self.batch_data = {}
+        # Batch records are saved here so any process can serve status and the ZIP
+        self.job_store = get_job_store() if job_store is None else job_store
         self.active_downloads = {}
+        # Item workspaces (and outputs) live here until the janitor releases their batch
+        self.temp_dir = tempfile.mkdtemp(prefix='m3u8_batch_')
         
     def start_batch_download(self, urls):
         """Start batch download for multiple M3U8 URLs"""
@@ -222,6 +1402,7 @@ class BatchDownloader:
             'downloads': {},
             'status': 'processing',
             'created_at': time.time(),
+            'finished_at': None,
             'output_files': []
         }
         
@@ -237,6 +1418,8 @@ class BatchDownloader:
                 'error': None
             }
         
+        self._save_batch(batch_id, flush=True)
+        
         # Start downloads in background thread
         thread = threading.Thread(target=self._process_batch, args=(batch_id,))
         thread.daemon = True
@@ -279,6 +1462,9 @@ class BatchDownloader:
                         batch['downloads'][download_id]['error'] = str(e)
                         batch['downloads'][download_id]['message'] = f'Error: {str(e)}'
                         batch['failed_count'] += 1
+                    
+                    self._publish_download(batch_id, download_id)
+                    self._publish_batch(batch_id)
             
             # Update batch status
             if batch['completed_count'] > 0:
@@ -288,12 +1474,16 @@ class BatchDownloader:
                     batch['status'] = 'completed_with_errors'
             else:
                 batch['status'] = 'failed'
-                
+            batch['finished_at'] = time.time()
+            
+            self._publish_batch(batch_id)
             logging.info(f"Batch {batch_id} completed: {batch['completed_count']}/{batch['total_count']} successful")
             
         except Exception as e:
             logging.error(f"Batch processing failed: {str(e)}")
             self.batch_data[batch_id]['status'] = 'failed'
+            self.batch_data[batch_id]['finished_at'] = time.time()
+            self._publish_batch(batch_id)
     
     def _download_single(self, batch_id, download_id, url):
         """Download a single M3U8 file with progress tracking"""
@@ -301,18 +1491,27 @@ class BatchDownloader:
             # Update status
             self.batch_data[batch_id]['downloads'][download_id]['status'] = 'downloading'
             self.batch_data[batch_id]['downloads'][download_id]['message'] = 'Starting download...'
+            self._publish_download(batch_id, download_id)
             
             # Create a custom downloader for this specific download
             downloader = M3U8DownloaderWithCallback(
                 progress_callback=lambda percent, status: self._update_download_progress(
                     batch_id, download_id, percent, status
-                )
+                ),
+                max_workers=self.segment_workers,
+                # The whole batch shares one fair share of the scheduler, behind interactive jobs
+                priority=PRIORITY_BATCH,
+                flow=f'batch:{batch_id}',
+                temp_dir=self.temp_dir,
+                # Item progress is part of the batch record
+                job_store=False
             )
             
             # Download the video
-            output_file = downloader.download_and_merge(url)
-            
-            return output_file
+            try:
+                return downloader.download_and_merge(url, task_id=download_id)
+            finally:
+                self.batch_data[batch_id]['downloads'][download_id]['timings'] = downloader.get_timings(download_id)
             
         except Exception as e:
             logging.error(f"Single download failed for {url}: {str(e)}")
@@ -324,38 +1523,409 @@ class BatchDownloader:
         if batch_id in self.batch_data and download_id in self.batch_data[batch_id]['downloads']:
             self.batch_data[batch_id]['downloads'][download_id]['progress'] = percent
             self.batch_data[batch_id]['downloads'][download_id]['message'] = status
+            progress_broker.publish(f'batch:{batch_id}', download_id, {'progress': percent, 'message': status})
+            self._save_batch(batch_id)
     
-    def get_batch_status(self, batch_id):
-        """Get complete batch status"""
-        return self.batch_data.get(batch_id, None)
+    def _publish_download(self, batch_id, download_id):
+        """Push the current state of one download to event stream subscribers"""
+        download = self.batch_data[batch_id]['downloads'][download_id]
+        progress_broker.publish(f'batch:{batch_id}', download_id, {
+            'status': download['status'],
+            'progress': download['progress'],
+            'message': download['message'],
+            'error': download['error']
+        })
+        self._save_batch(batch_id)
+    
+    def _publish_batch(self, batch_id):
+        """Push the batch-level counters to event stream subscribers"""
+        batch = self.batch_data[batch_id]
+        progress_broker.publish(f'batch:{batch_id}', 'batch', {
+            'status': batch['status'],
+            'completed_count': batch['completed_count'],
+            'failed_count': batch['failed_count'],
+            'total_count': batch['total_count']
+        })
+        # Counter and status changes are rare, write them through
+        self._save_batch(batch_id, flush=True)
     
-    def create_batch_zip(self, batch_id):
-        """Create a ZIP file containing all downloaded videos"""
+    def _save_batch(self, batch_id, flush=False):
+        """Save the batch record to the job store; progress writes are batched by the store"""
+        if self.job_store:
+            self.job_store.save('batch', batch_id, self.batch_data[batch_id], flush=flush)
+    
+    def is_local(self, batch_id):
+        """Whether this process runs the batch (and so publishes its progress events)"""
+        return batch_id in self.batch_data
+    
+    def get_batch_status(self, batch_id):
+        """Get complete batch status, from the job store if another process runs the batch"""
         batch = self.batch_data.get(batch_id)
+        if batch is None and self.job_store:
+            batch = self.job_store.load('batch', batch_id)
+        return batch
+    
+    def reclaimable(self):
+        """(finished_at, batch_id, workspace bytes) for every finished batch, for the janitor"""
+        for batch_id, batch in list(self.batch_data.items()):
+            if batch['finished_at'] is None:
+                continue
+            size = sum(dir_size(os.path.join(self.temp_dir, download_id)) for download_id in batch['downloads'])
+            yield batch['finished_at'], batch_id, size
+    
+    def release(self, batch_id):
+        """Forget a finished batch and delete its downloads"""
+        batch = self.batch_data.pop(batch_id, None)
+        if batch is None:
+            return
+        if self.job_store:
+            self.job_store.delete('batch', batch_id)
+        for download_id in batch['downloads']:
+            shutil.rmtree(os.path.join(self.temp_dir, download_id), ignore_errors=True)
+    
+    def iter_batch_zip(self, batch_id, chunk_size=1024 * 1024):
+        """Yield a ZIP archive of all downloaded videos as it is built
+        
+        Entries are stored uncompressed (MP4 does not deflate) and written with data
+        descriptors, so nothing is buffered on disk; ZIP64 records are used when needed.
+        """
+        batch = self.get_batch_status(batch_id)
         if not batch or not batch['output_files']:
-            return None
+            return
         
-        try:
-            zip_filename = f"batch_download_{batch_id[:8]}.zip"
-            zip_path = os.path.join(tempfile.gettempdir(), zip_filename)
-            
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for i, output_file in enumerate(batch['output_files']):
-                    if os.path.exists(output_file):
-                        # Use a clean filename for the ZIP entry
-                        zip_entry_name = f"video_{i+1:03d}.mp4"
-                        zipf.write(output_file, zip_entry_name)
-            
-            return zip_path
+        started = time.monotonic()
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zipf:
+            for i, output_file in enumerate(batch['output_files']):
+                if not os.path.exists(output_file):
+                    continue
+                # Use a clean filename for the ZIP entry
+                info = zipfile.ZipInfo.from_file(output_file, f"video_{i+1:03d}.mp4")
+                info.compress_type = zipfile.ZIP_STORED
+                with open(output_file, 'rb') as src, zipf.open(info, 'w') as dst:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        yield from sink.drain()
+                yield from sink.drain()
+        # Central directory
+        yield from sink.drain()
+        zip_build_seconds.observe(time.monotonic() - started)
+
+
+class _OrderedWriter:
+    """Writes fetch groups to an output in playlist order as their requests complete
+    
+    The fetch of the group at the write position streams its body through its tap
+    straight into the output; groups that complete ahead of it wait in their files and
+    are copied out by whichever thread completes the group before them. The bytes of
+    the current group already written are counted, so a retried request or a winning
+    hedge only supplies the rest. The first error raised by write() stops the output,
+    and is raised by wait_for().
+    """
+    
+    def __init__(self, write, groups, retain, chunk_size, advanced):
+        self.retain = retain
+        self.groups_written = 0
+        self.error = None
+        self._write = write
+        self._groups = groups
+        self._chunk_size = chunk_size
+        self._advanced = advanced  # called with each group once the position moves past it
+        self._position = 0
+        self._written = 0  # bytes of the group at the position already written
+        self._ready = {}  # index -> FetchedFile (None if it failed) of groups ahead of the position
+        self._closed = False
+        self._condition = threading.Condition()
+    
+    def tap(self, index):
+        return _OrderedTap(self, index)
+    
+    def at_position(self, index):
+        with self._condition:
+            return self._position == index and not self._closed
+    
+    def write(self, offset, data):
+        """Write data, found at offset in the current group, past what was already written"""
+        end = offset + len(data)
+        if end > self._written:
+            self._send(data[max(0, self._written - offset):])
+            self._written = end
+    
+    def catch_up(self, path, size):
+        """Write the first size bytes of the current group from a partly spooled file"""
+        if size > self._written:
+            with open(path, 'rb') as f:
+                self._send_file(f, size)
+    
+    def finish(self, index, fetched):
+        """Hand over the file of a completed group, or None for one that failed"""
+        with self._condition:
+            if self._closed:
+                self._remove(fetched)
+                return
+            self._ready[index] = fetched
+            if index != self._position:
+                return
+        
+        # This group is at the position: write it and every completed group after it
+        while True:
+            with self._condition:
+                if self._closed or index not in self._ready:
+                    return
+                fetched = self._ready.pop(index)
+            group = self._groups[index]
+            try:
+                if fetched is not None:
+                    with open(fetched.path, 'rb') as f:
+                        self._send_file(f)
+                    self.groups_written += 1
+                elif self._written:
+                    logging.warning(f"Output has a truncated copy of segment {group.first + 1}")
+            finally:
+                self._remove(fetched)
+            self._advanced(group)
             
+            with self._condition:
+                self._position = index = index + 1
+                self._written = 0
+                self._condition.notify_all()
+    
+    def wait_for(self, position):
+        """Block until the write position reaches position; raise the error that stopped the output"""
+        with self._condition:
+            while self._position < position and not self._closed:
+                self._condition.wait()
+            if self.error is not None:
+                raise self.error
+    
+    def abort(self, error):
+        with self._condition:
+            if self.error is None:
+                self.error = error
+        self.close()
+    
+    def close(self):
+        """Stop writing; files of completed groups, now or later, are removed"""
+        with self._condition:
+            self._closed = True
+            ready, self._ready = self._ready, {}
+            self._condition.notify_all()
+        for fetched in ready.values():
+            self._remove(fetched)
+    
+    def _send(self, data):
+        if self._closed:
+            return
+        try:
+            self._write(data)
         except Exception as e:
-            logging.error(f"Failed to create batch ZIP: {str(e)}")
-            return None
+            self.abort(e)
+    
+    def _send_file(self, f, size=None):
+        f.seek(self._written)
+        while size is None or self._written < size:
+            chunk = f.read(self._chunk_size if size is None else min(self._chunk_size, size - self._written))
+            if not chunk:
+                break
+            self._send(chunk)
+            self._written += len(chunk)
+    
+    @staticmethod
+    def _remove(fetched):
+        if fetched is not None:
+            try:
+                os.remove(fetched.path)
+            except OSError:
+                pass
+
+
+class _OrderedTap:
+    """The part of an _OrderedWriter that the fetch of one group writes through"""
+    
+    def __init__(self, writer, index):
+        self.retain = writer.retain
+        self._writer = writer
+        self._index = index
+    
+    def at_position(self):
+        return self._writer.at_position(self._index)
+    
+    def catch_up(self, path, size):
+        self._writer.catch_up(path, size)
+    
+    def write(self, offset, data):
+        self._writer.write(offset, data)
+
+
+class _HedgeLost(Exception):
+    """Raised by the losing side of a hedged request"""
+
+
+class _HedgeRace:
+    """Shared state of a primary request and its hedge; the first file to land wins"""
+
+    def __init__(self):
+        self.winner = None
+        self.hedge = None
+        self.connections = ConnectionWatch()
+        self._settled = False
+        self._lock = threading.Lock()
+
+    def start(self, submit):
+        """Launch the hedge through submit() unless the primary has already finished"""
+        with self._lock:
+            if self._settled or self.winner is not None:
+                return False
+            self.hedge = submit()
+            return True
+
+    def settle(self):
+        """Called once the primary is done; no hedge starts after this. Returns the hedge future, if any"""
+        with self._lock:
+            self._settled = True
+            return self.hedge
+
+    def decided(self):
+        return self.winner is not None
+
+    def claim(self, fetched):
+        """Make fetched the result unless the other side already won, cutting off the loser's request"""
+        with self._lock:
+            if self.winner is not None:
+                return False
+            self.winner = fetched
+        self.connections.abort()
+        return True
+
+
+_shared_hedge_executor = None
+_shared_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor(scheduler):
+    """Process-wide pool that runs only hedge duplicates, sized from the scheduler's fetch limit"""
+    global _shared_hedge_executor
+    with _shared_hedge_executor_lock:
+        if _shared_hedge_executor is None:
+            _shared_hedge_executor = ThreadPoolExecutor(
+                max_workers=scheduler.pools['fetch'].limit, thread_name_prefix='hedge'
+            )
+        return _shared_hedge_executor
+
+
+class _FFmpegWatchdog:
+    """Kill an ffmpeg process that makes no progress while something waits on it
+    
+    Progress is the output file growing or a busy() block (such as a write to
+    ffmpeg's stdin) finishing. Idle time only counts while a caller is busy() or in
+    wait(), so a pipelined merge waiting on slow downloads is not a stall.
+    wait() also measures the CPU time the process used.
+    """
+    
+    def __init__(self, process, output_file, stall_timeout, poll_interval=1.0):
+        self.process = process
+        self.output_file = output_file
+        self.stall_timeout = stall_timeout
+        self.poll_interval = min(poll_interval, stall_timeout / 4)
+        self.stalled = False
+        self.cpu_seconds = None
+        self._waiting = 0
+        self._progress_at = time.monotonic()
+        self._output_size = 0
+        self._lock = threading.Lock()
+        # Set once the process is reaped, after which its PID must not be signalled
+        self._done = threading.Event()
+        threading.Thread(target=self._monitor, name='ffmpeg-watchdog', daemon=True).start()
+    
+    @contextmanager
+    def busy(self):
+        """Count the block as waiting on ffmpeg, and its completion as progress"""
+        with self._lock:
+            if not self._waiting:
+                self._progress_at = time.monotonic()
+            self._waiting += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._waiting -= 1
+                self._progress_at = time.monotonic()
+    
+    def wait(self):
+        """Wait for ffmpeg to exit (or be killed as stalled) and return its exit status"""
+        with self.busy():
+            try:
+                # Wait for the exit without reaping, so the zombie's CPU counters can still be read
+                os.waitid(os.P_PID, self.process.pid, os.WEXITED | os.WNOWAIT)
+                measurable = True
+            except (AttributeError, ChildProcessError):
+                self.process.wait()
+                measurable = False
+            with self._lock:
+                if measurable:
+                    self.cpu_seconds = _process_cpu_seconds(self.process.pid)
+                returncode = self.process.wait()
+                self._done.set()
+        return returncode
+    
+    def stop(self):
+        with self._lock:
+            self._done.set()
+    
+    def _monitor(self):
+        while not self._done.wait(self.poll_interval):
+            try:
+                size = os.path.getsize(self.output_file)
+            except OSError:
+                size = 0
+            now = time.monotonic()
+            with self._lock:
+                if size != self._output_size:
+                    self._output_size = size
+                    self._progress_at = now
+                if self._done.is_set() or not self._waiting or now - self._progress_at < self.stall_timeout:
+                    continue
+                logging.error(f"Killing ffmpeg after {self.stall_timeout}s without progress")
+                self.stalled = True
+                self.process.kill()
+                return
+
+
+def _process_cpu_seconds(pid):
+    """User plus system CPU seconds of a process from /proc, or None where that is unavailable"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the parenthesised command name; utime and stime are the 12th and 13th
+            fields = f.read().rpartition(')')[2].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _ChunkSink:
+    """Write-only, unseekable file object that hands written bytes back to a generator"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
 
 
 class M3U8DownloaderWithCallback(M3U8Downloader):
-    def __init__(self, progress_callback=None):
-        super().__init__()
+    def __init__(self, progress_callback=None, **kwargs):
+        super().__init__(**kwargs)
         self.progress_callback = progress_callback
     
     def update_progress(self, task_id, percent, status):
@@ -366,117 +1936,148 @@ class M3U8DownloaderWithCallback(M3U8Downloader):
 
 
 class VideoStreamExtractor:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+    def __init__(self, page_ttl=DEFAULT_PAGE_TTL, max_pages=DEFAULT_PAGE_ENTRIES, link_ttl=DEFAULT_LINK_TTL,
+                 dead_link_ttl=DEFAULT_DEAD_LINK_TTL, crawl_depth=2, max_page_requests=20, extract_deadline=15,
+                 crawl_workers=8):
+        # Watched connections, so an extraction can cut off the requests still running at its deadline
+        self.session = watched_session()
+        self.scanner = LinkScanner()
+        # Pages are shared by /extract, get_webpage_info and auto-mode downloads, and revalidated once stale
+        self.pages = TTLCache(max_entries=max_pages, ttl=page_ttl)
+        self._page_flight = SingleFlight()
+        # Link checks are cached both ways; dead links expire sooner
+        self.link_status = TTLCache(max_entries=max_pages * 4, ttl=link_ttl)
+        self.dead_link_ttl = dead_link_ttl
+        # Bounds for the iframe crawl: nesting depth, pages fetched, and seconds for the whole extraction
+        self.crawl_depth = crawl_depth
+        self.max_page_requests = max_page_requests
+        self.extract_deadline = extract_deadline
+        self.crawl_workers = crawl_workers
+    
+    def fetch_page(self, url):
+        """Fetch a webpage through the page cache
+        
+        Fresh entries are returned without a request; stale ones are revalidated with
+        If-None-Match/If-Modified-Since. Concurrent fetches of the same URL share one request.
+        """
+        page, fresh = self.pages.get(url)
+        if fresh:
+            return page
+        return self._page_flight.do(url, lambda: self._fetch_page(url, page))
+    
+    def _fetch_page(self, url, cached):
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        
+        response = self.session.get(url, timeout=30, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            self.pages.put(url, cached, revalidated=True)
+            return cached
+        response.raise_for_status()
+        
+        page = CachedPage(
+            text=response.text,
+            url=response.url or url,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified')
+        )
+        self.pages.put(url, page)
+        return page
+    
+    @staticmethod
+    def _watched(watch, fn, *args):
+        with watch.watching():
+            return fn(*args)
+    
+    def _scan_page(self, url):
+        page = self.fetch_page(url)
+        # One pass over the page finds manifest links and iframes, already normalized and deduplicated
+        return self.scanner.scan(page.text, page.url)
+    
+    def cache_stats(self):
+        return {
+            'pages': self.pages.stats(),
+            'links': self.link_status.stats(),
+            'coalesced': self._page_flight.coalesced
+        }
     
     def extract_m3u8_from_webpage(self, url):
-        """Extract M3U8 links from a webpage"""
+        """Extract M3U8 links from a webpage and the iframes it embeds
+        
+        Pages are crawled concurrently, up to crawl_depth levels of iframes and
+        max_page_requests fetches, and candidate links are validated in parallel as
+        they are found. Whatever has been validated when extract_deadline passes is
+        returned. Links are ordered as a depth-first walk of the page would find them.
+        """
         try:
             logging.info(f"Extracting M3U8 links from webpage: {url}")
+            started = time.monotonic()
+            deadline = started + self.extract_deadline
             
-            # Fetch the webpage content
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            html_content = response.text
-            
-            # Multiple strategies to find M3U8 links
-            m3u8_links = []
-            
-            # Strategy 1: Direct regex search for .m3u8 URLs
-            m3u8_patterns = [
-                r'https?://[^"\s<>]+\.m3u8[^"\s<>]*',
-                r'"(https?://[^"]+\.m3u8[^"]*)"',
-                r"'(https?://[^']+\.m3u8[^']*)'",
-                r'src\s*=\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-                r'data-src\s*=\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-            ]
-            
-            for pattern in m3u8_patterns:
-                matches = re.findall(pattern, html_content, re.IGNORECASE)
-                for match in matches:
-                    # Handle tuple results from group captures
-                    link = match if isinstance(match, str) else match[0] if match else None
-                    if link and link not in m3u8_links:
-                        # Convert relative URLs to absolute
-                        if link.startswith('//'):
-                            link = urlparse(url).scheme + ':' + link
-                        elif link.startswith('/'):
-                            link = urljoin(url, link)
-                        elif not link.startswith('http'):
-                            link = urljoin(url, link)
-                        m3u8_links.append(link)
-            
-            # Strategy 2: Look for common video streaming patterns
-            streaming_patterns = [
-                r'manifest["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-                r'playlist["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-                r'source["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-                r'hls["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-            ]
-            
-            for pattern in streaming_patterns:
-                matches = re.findall(pattern, html_content, re.IGNORECASE)
-                for match in matches:
-                    link = match if isinstance(match, str) else match[0] if match else None
-                    if link and link not in m3u8_links:
-                        if link.startswith('//'):
-                            link = urlparse(url).scheme + ':' + link
-                        elif link.startswith('/'):
-                            link = urljoin(url, link)
-                        elif not link.startswith('http'):
-                            link = urljoin(url, link)
-                        m3u8_links.append(link)
-            
-            # Strategy 3: Look in JavaScript variables and JSON data
-            js_patterns = [
-                r'["\']url["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-                r'["\']source["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-                r'["\']file["\']?\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']',
-            ]
-            
-            for pattern in js_patterns:
-                matches = re.findall(pattern, html_content, re.IGNORECASE)
-                for match in matches:
-                    link = match if isinstance(match, str) else match[0] if match else None
-                    if link and link not in m3u8_links:
-                        if link.startswith('//'):
-                            link = urlparse(url).scheme + ':' + link
-                        elif link.startswith('/'):
-                            link = urljoin(url, link)
-                        elif not link.startswith('http'):
-                            link = urljoin(url, link)
-                        m3u8_links.append(link)
-            
-            # Strategy 4: Check for iframe sources that might contain video
-            iframe_pattern = r'<iframe[^>]+src=["\']([^"\']+)["\'][^>]*>'
-            iframe_matches = re.findall(iframe_pattern, html_content, re.IGNORECASE)
-            
-            for iframe_url in iframe_matches[:3]:  # Limit to first 3 iframes
-                try:
-                    if iframe_url.startswith('//'):
-                        iframe_url = urlparse(url).scheme + ':' + iframe_url
-                    elif iframe_url.startswith('/'):
-                        iframe_url = urljoin(url, iframe_url)
-                    elif not iframe_url.startswith('http'):
-                        iframe_url = urljoin(url, iframe_url)
+            visited = {url}
+            page_requests = 1
+            candidates = {}  # link -> (page path, position), the earliest place it was seen
+            valid = {}
+            executor = ThreadPoolExecutor(max_workers=self.crawl_workers)
+            watch = ConnectionWatch()
+            
+            def submit(fn, *args):
+                return executor.submit(self._watched, watch, fn, *args)
+            
+            try:
+                # A page's path is the iframe indexes leading to it, () for the page itself
+                pending = {submit(self._scan_page, url): ('page', url, ())}
+                while pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logging.warning(f"Extraction deadline reached for {url}, returning partial results")
+                        break
+                    done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
                     
-                    # Recursively check iframe content
-                    iframe_links = self.extract_m3u8_from_webpage(iframe_url)
-                    m3u8_links.extend(iframe_links)
-                except Exception as e:
-                    logging.warning(f"Failed to check iframe {iframe_url}: {str(e)}")
-                    continue
+                    for future in done:
+                        kind, target, path = pending.pop(future)
+                        if kind == 'link':
+                            valid[target] = future.result()
+                            continue
+                        
+                        try:
+                            scan = future.result()
+                        except Exception as e:
+                            if not path:
+                                raise
+                            logging.warning(f"Failed to check iframe {target}: {str(e)}")
+                            continue
+                        
+                        hls_links = [link for link, link_kind in scan.links if link_kind == 'hls']
+                        for position, link in enumerate(hls_links):
+                            if link not in candidates:
+                                pending[submit(self.validate_m3u8_link, link)] = ('link', link, None)
+                            candidates[link] = min(candidates.get(link, (path, position)), (path, position))
+                        
+                        if len(path) >= self.crawl_depth:
+                            continue
+                        for index, iframe_url in enumerate(scan.iframes):
+                            if iframe_url in visited:
+                                continue
+                            if page_requests >= self.max_page_requests:
+                                break
+                            visited.add(iframe_url)
+                            page_requests += 1
+                            pending[submit(self._scan_page, iframe_url)] = ('page', iframe_url, path + (index,))
+            finally:
+                # Cut off the requests still running after the deadline and wait for their threads,
+                # so no worker outlives the extraction
+                watch.abort()
+                executor.shutdown(wait=True, cancel_futures=True)
             
-            # Remove duplicates and validate links
-            unique_links = []
-            for link in m3u8_links:
-                if link not in unique_links and self.validate_m3u8_link(link):
-                    unique_links.append(link)
+            unique_links = [link for link in sorted(candidates, key=candidates.get) if valid.get(link)]
             
-            logging.info(f"Found {len(unique_links)} valid M3U8 links")
+            extract_seconds.observe(time.monotonic() - started)
+            logging.info(f"Found {len(unique_links)} valid M3U8 links on {page_requests} pages")
             return unique_links
             
         except requests.exceptions.RequestException as e:
@@ -488,6 +2089,18 @@ class VideoStreamExtractor:
     
     def validate_m3u8_link(self, url):
         """Validate if an M3U8 link is accessible"""
+        valid, fresh = self.link_status.get(url)
+        if fresh:
+            return valid
+        
+        valid = self._check_link(url)
+        if not valid and request_aborted():
+            # Cut off by the extraction deadline, which says nothing about the link
+            return valid
+        self.link_status.put(url, valid, ttl=None if valid else self.dead_link_ttl)
+        return valid
+    
+    def _check_link(self, url):
         try:
             # Quick HEAD request to check if the link is accessible
             response = self.session.head(url, timeout=10, allow_redirects=True)
@@ -503,18 +2116,13 @@ class VideoStreamExtractor:
     def get_webpage_info(self, url):
         """Get basic information about a webpage"""
         try:
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            
-            # Use trafilatura to extract clean text and title
-            downloaded = trafilatura.fetch_url(url)
+            page = self.fetch_page(url)
             title = None
             
-            if downloaded:
-                # Try to extract title from HTML
-                title_match = re.search(r'<title[^>]*>([^<]+)</title>', response.text, re.IGNORECASE)
-                if title_match:
-                    title = title_match.group(1).strip()
+            # Try to extract title from HTML
+            title_match = re.search(r'<title[^>]*>([^<]+)</title>', page.text, re.IGNORECASE)
+            if title_match:
+                title = title_match.group(1).strip()
             
             return {
                 'title': title or 'Unknown',
@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+
+DEFAULT_MIN_INTERVAL = 0.25  # seconds between flushes to one subscriber
+KEEPALIVE_INTERVAL = 15
+# A stream holds a server worker for as long as it is open, so it ends after this long and the client reconnects
+DEFAULT_MAX_STREAM_SECONDS = 30
+
+
+class Subscription:
+    """Per-subscriber mailbox that coalesces pending updates by key
+
+    Repeated updates for the same key between two flushes are merged, so a slow
+    client only ever receives the latest fields rather than every intermediate step.
+    """
+
+    def __init__(self, channel, min_interval=DEFAULT_MIN_INTERVAL):
+        self.channel = channel
+        self.min_interval = min_interval
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._last_flush = 0.0
+
+    def push(self, key, fields):
+        with self._condition:
+            self._pending.setdefault(key, {}).update(fields)
+            self._condition.notify()
+
+    def next_delta(self, timeout=KEEPALIVE_INTERVAL):
+        """Block until updates are pending, rate limited to one flush per min_interval
+
+        Returns {key: fields} or None if nothing arrived within timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+            # Hold back until the rate limit allows a flush, collecting more updates meanwhile
+            wait = self._last_flush + self.min_interval - time.monotonic()
+            while wait > 0:
+                self._condition.wait(wait)
+                wait = self._last_flush + self.min_interval - time.monotonic()
+
+            delta, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            return delta
+
+
+class ProgressBroker:
+    """Fans out progress deltas to Server-Sent Events subscribers by channel"""
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, key, fields):
+        """Send changed fields for key to every subscriber of channel"""
+        # Cheap unlocked check: most updates have nobody listening
+        if channel not in self._subscribers:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.push(key, fields)
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, self.min_interval)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def stream(self, channel, snapshot, is_finished, poll_interval=None, max_seconds=DEFAULT_MAX_STREAM_SECONDS):
+        """Generate an SSE response body: a full snapshot, coalesced deltas, then a final snapshot
+
+        snapshot() returns the current state; is_finished() ends the stream once true.
+        Work running in another process publishes no local deltas, so with poll_interval
+        set a fresh snapshot is sent whenever that long passes without one. After
+        max_seconds the stream ends with a 'reconnect' event instead, so one long job
+        does not pin a worker; the client opens a new stream, which starts with a snapshot.
+        """
+        # Subscribe before taking the snapshot so no update falls in between
+        subscription = self.subscribe(channel)
+        expires_at = time.monotonic() + max_seconds if max_seconds else None
+        try:
+            yield format_sse('snapshot', snapshot())
+            while not is_finished():
+                timeout = poll_interval or KEEPALIVE_INTERVAL
+                if expires_at is not None:
+                    remaining = expires_at - time.monotonic()
+                    if remaining <= 0:
+                        yield format_sse('reconnect', {})
+                        return
+                    timeout = min(timeout, remaining)
+                delta = subscription.next_delta(timeout)
+                if delta is None:
+                    if expires_at is not None and time.monotonic() >= expires_at:
+                        continue
+                    yield format_sse('snapshot', snapshot()) if poll_interval else ': keepalive\n\n'
+                    continue
+                yield format_sse('progress', delta)
+
+            # The final state may change just before its delta is published, so close with a full snapshot
+            yield format_sse('done', snapshot())
+        finally:
+            self.unsubscribe(subscription)
+
+
+def format_sse(event, data):
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+# Shared by downloaders, batch downloader and job manager
+progress_broker = ProgressBroker()
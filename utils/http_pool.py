@@ -0,0 +1,306 @@
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ProtocolError
+
+from utils.retry import LatencyTracker
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+DEFAULT_POOL_MAXSIZE = 64
+
+# Statuses that mean the origin wants us to slow down
+THROTTLE_STATUS = {429, 503}
+
+
+def origin_of(url):
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+_local = threading.local()
+
+
+class ConnectionWatch:
+    """Connections checked out by the threads inside watching(), so another thread can cut them off
+
+    A connection is tracked from the moment it leaves its pool until it is returned,
+    so abort() can stop a request that is still waiting for headers as well as one
+    reading its body, without touching a connection that is back in the pool.
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def watching(self):
+        previous = getattr(_local, 'watch', None)
+        _local.watch = self
+        try:
+            yield self
+        finally:
+            _local.watch = previous
+
+    def _checked_out(self, conn):
+        """Track conn; False if the watch was already aborted and conn must not be used"""
+        with self._lock:
+            if self.aborted:
+                return False
+            conn.watch = self
+            self._connections.add(conn)
+            return True
+
+    def _returned(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+
+    def abort(self):
+        """Shut down every watched connection still in use; their requests fail at once"""
+        with self._lock:
+            self.aborted = True
+            for conn in self._connections:
+                _shutdown(conn)
+
+
+def _shutdown(conn):
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def request_aborted():
+    """Whether the calling thread's requests were cut off on purpose rather than by the origin"""
+    watch = getattr(_local, 'watch', None)
+    return watch is not None and watch.aborted
+
+
+class _WatchedPoolMixin:
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        watch = getattr(_local, 'watch', None)
+        if watch is not None and not watch._checked_out(conn):
+            # A request started after abort(), e.g. a fallback after the aborted one, fails at once;
+            # urlopen() returns the pool slot when it sees the error
+            conn.close()
+            raise ProtocolError('Connection aborted', ConnectionAbortedError())
+        return conn
+
+    def _put_conn(self, conn):
+        watch = getattr(conn, 'watch', None)
+        if watch is not None:
+            conn.watch = None
+            watch._returned(conn)
+        super()._put_conn(conn)
+
+
+class _WatchedHTTPConnectionPool(_WatchedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _WatchedHTTPSConnectionPool(_WatchedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+def watched_session(pool_connections=10, pool_maxsize=10):
+    """requests.Session whose connections a ConnectionWatch can cut off"""
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': _WatchedHTTPConnectionPool, 'https': _WatchedHTTPSConnectionPool
+    }
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for requests to one origin
+
+    Each successful request adds 1/limit (about +1 per round of requests); a throttling
+    status, a connection failure or latency rising well above the baseline halves the
+    limit, at most once per cooldown so a burst of in-flight failures counts once.
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_limit=DEFAULT_POOL_MAXSIZE, latency_factor=3.0, cooldown=1.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.latency = LatencyTracker(window=100, min_samples=10)
+        self.latency_ewma = None
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Block until a request slot is free under the current limit"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def has_capacity(self):
+        with self._condition:
+            return self.in_flight < int(self.limit)
+
+    def release(self, latency=None, overloaded=False):
+        """Return a slot and adjust the limit from the request outcome"""
+        with self._condition:
+            self.in_flight -= 1
+
+            congested = overloaded
+            if latency is not None and not overloaded:
+                self.latency.record(latency)
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                baseline = self.latency.percentile(10)
+                congested = baseline is not None and self.latency_ewma > baseline * self.latency_factor
+
+            now = time.monotonic()
+            if congested:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                    self.decreases += 1
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+    def request(self, session, url, **kwargs):
+        """Perform session.get(url) inside a slot, feeding the outcome back into the limit"""
+        self.acquire()
+        started = time.monotonic()
+        latency, overloaded = None, False
+        try:
+            response = session.get(url, **kwargs)
+            if response.status_code in THROTTLE_STATUS:
+                overloaded = True
+            else:
+                latency = time.monotonic() - started
+            return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            overloaded = not request_aborted()
+            raise
+        finally:
+            self.release(latency, overloaded)
+
+    @contextmanager
+    def stream(self, session, url, within=None, **kwargs):
+        """Like request() with stream=True, holding the slot until the body has been read
+
+        within is an optional context manager entered once this origin has admitted the
+        request and held until the response is closed, so a caller's global slot is
+        never tied up while the request queues behind the origin's limit.
+        """
+        self.acquire()
+        latency, overloaded = None, False
+        response = None
+        try:
+            with within if within is not None else nullcontext():
+                started = time.monotonic()
+                try:
+                    response = session.get(url, stream=True, **kwargs)
+                    if response.status_code in THROTTLE_STATUS:
+                        overloaded = True
+                    else:
+                        # Time to headers; body time depends on size rather than origin load
+                        latency = time.monotonic() - started
+                    yield response
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    overloaded = not request_aborted()
+                    raise
+                finally:
+                    if response is not None:
+                        response.close()
+        finally:
+            self.release(latency, overloaded)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'latency_ewma': round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+                'decreases': self.decreases
+            }
+
+
+class ConnectionPools:
+    """Shared requests sessions and adaptive limiters, one per origin
+
+    Reusing one session per origin keeps DNS, TCP and TLS setup off the per-job path;
+    pool_maxsize bounds the keep-alive connections held open to each origin.
+    """
+
+    def __init__(self, pool_maxsize=DEFAULT_POOL_MAXSIZE, initial_limit=8):
+        self.pool_maxsize = pool_maxsize
+        self.initial_limit = initial_limit
+        self._sessions = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, url):
+        origin = origin_of(url)
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session is None:
+                session = watched_session(pool_connections=4, pool_maxsize=self.pool_maxsize)
+                self._sessions[origin] = session
+            return session
+
+    def limiter_for(self, url):
+        origin = origin_of(url)
+        with self._lock:
+            limiter = self._limiters.get(origin)
+            if limiter is None:
+                limiter = AdaptiveLimiter(
+                    initial=min(self.initial_limit, self.pool_maxsize), max_limit=self.pool_maxsize
+                )
+                self._limiters[origin] = limiter
+            return limiter
+
+    def get(self, url, **kwargs):
+        """GET through the origin's shared session, throttled by its adaptive limiter"""
+        return self.limiter_for(url).request(self.session_for(url), url, **kwargs)
+
+    def stream(self, url, within=None, **kwargs):
+        """Streamed GET for use as a context manager; the response is closed on exit"""
+        return self.limiter_for(url).stream(self.session_for(url), url, within=within, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {origin: limiter.stats() for origin, limiter in limiters.items()}
+
+
+_shared_pools = None
+_shared_pools_lock = threading.Lock()
+
+
+def get_connection_pools():
+    """Process-wide connection pools shared by every downloader instance"""
+    global _shared_pools
+    with _shared_pools_lock:
+        if _shared_pools is None:
+            _shared_pools = ConnectionPools(
+                pool_maxsize=int(os.environ.get('HTTP_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE)),
+                initial_limit=int(os.environ.get('HTTP_INITIAL_CONCURRENCY', 8))
+            )
+        return _shared_pools
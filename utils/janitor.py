@@ -0,0 +1,103 @@
+import os
+import logging
+import threading
+import time
+
+DEFAULT_RECORD_TTL = 60 * 60  # 1 hour
+DEFAULT_INTERVAL = 60
+
+
+def dir_size(path):
+    """Total size in bytes of the files under path (0 if it does not exist)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Janitor:
+    """Background expiry of finished job state and a disk budget for workspaces and outputs
+
+    Each source exposes reclaimable(), yielding (finished_at, key, size_bytes) for
+    records that are no longer in use, and release(key), which drops the record and
+    its files. Records older than ttl are released; while the directories hold more
+    than max_bytes, the oldest-completed remaining records are released as well.
+    """
+
+    def __init__(self, sources, directories, ttl=DEFAULT_RECORD_TTL, max_bytes=None, interval=DEFAULT_INTERVAL):
+        self.sources = sources
+        self.directories = directories
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.expired = 0
+        self.evicted = 0
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='janitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Janitor pass failed: {str(e)}")
+
+    def run_once(self):
+        """Release expired records, then enforce the disk budget"""
+        with self._lock:
+            cutoff = time.time() - self.ttl
+            candidates = []
+            expired = 0
+            for source in self.sources:
+                for finished_at, key, size in list(source.reclaimable()):
+                    if finished_at < cutoff:
+                        source.release(key)
+                        expired += 1
+                    else:
+                        candidates.append((finished_at, size, key, source))
+
+            evicted = 0
+            if self.max_bytes is not None:
+                usage = sum(dir_size(path) for path in self.directories)
+                # Oldest-completed first
+                for _, size, key, source in sorted(candidates, key=lambda item: item[0]):
+                    if usage <= self.max_bytes:
+                        break
+                    source.release(key)
+                    usage -= size
+                    evicted += 1
+
+            self.expired += expired
+            self.evicted += evicted
+            self.last_run = time.time()
+
+        if expired or evicted:
+            logging.info(f"Janitor expired {expired} and evicted {evicted} finished records")
+        return {'expired': expired, 'evicted': evicted}
+
+    def usage(self):
+        """Disk usage per directory and janitor counters"""
+        directories = {path: dir_size(path) for path in self.directories}
+        return {
+            'directories': directories,
+            'total_bytes': sum(directories.values()),
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'last_run': self.last_run
+        }
@@ -0,0 +1,179 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+import time
+
+from sqlalchemy import Column, Float, MetaData, String, Table, Text, create_engine, delete, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+DEFAULT_FLUSH_INTERVAL = 0.5  # seconds between batched writes
+DEFAULT_STALE_AFTER = 24 * 60 * 60  # records nobody has touched for a day are purged
+
+metadata = MetaData()
+
+job_records = Table(
+    'job_records', metadata,
+    Column('kind', String(16), primary_key=True),
+    Column('record_id', String(64), primary_key=True),
+    Column('data', Text, nullable=False),
+    Column('updated_at', Float, nullable=False, index=True)
+)
+
+
+class JobStore:
+    """Job, batch and progress records shared between processes through a SQL database
+
+    The process running a job keeps working on its in-memory dicts and saves them here;
+    any other process (another gunicorn worker, or a separate downloader pool) can then
+    load them to serve status and results. Saves are coalesced per record and written
+    in one transaction every flush_interval; flush=True writes through immediately,
+    which is used for state changes such as a job finishing.
+    """
+
+    def __init__(self, url, flush_interval=DEFAULT_FLUSH_INTERVAL, stale_after=DEFAULT_STALE_AFTER):
+        self.engine = create_engine(url)
+        self.flush_interval = flush_interval
+        self.stale_after = stale_after
+        self._pending = {}  # (kind, record_id) -> record dict, serialized at flush time
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_purge = 0.0
+        self.writes = 0
+        self.flushes = 0
+        metadata.create_all(self.engine)
+
+        self._thread = threading.Thread(target=self._flush_loop, name='job-store-flush', daemon=True)
+        self._thread.start()
+
+    def save(self, kind, record_id, record, flush=False):
+        """Queue the current state of a record; flush=True writes it (and everything pending) now"""
+        with self._lock:
+            self._pending[(kind, record_id)] = record
+        if flush:
+            self.flush()
+
+    def load(self, kind, record_id):
+        """Stored record, or None"""
+        with self._lock:
+            pending = self._pending.get((kind, record_id))
+        if pending is not None:
+            return pending
+
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(job_records.c.data).where(job_records.c.kind == kind, job_records.c.record_id == record_id)
+            ).first()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, kind, record_id):
+        with self._lock:
+            self._pending.pop((kind, record_id), None)
+        with self.engine.begin() as conn:
+            conn.execute(delete(job_records).where(job_records.c.kind == kind, job_records.c.record_id == record_id))
+
+    def flush(self):
+        """Write every pending record in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            now = time.time()
+            rows = [
+                {'kind': kind, 'record_id': record_id, 'data': self._serialize(record), 'updated_at': now}
+                for (kind, record_id), record in pending.items()
+            ]
+            try:
+                with self.engine.begin() as conn:
+                    self._upsert(conn, rows)
+            except Exception:
+                # Keep the records for the next attempt unless newer state was saved meanwhile
+                with self._lock:
+                    for key, record in pending.items():
+                        self._pending.setdefault(key, record)
+                raise
+            self.writes += len(rows)
+            self.flushes += 1
+
+    @staticmethod
+    def _serialize(record):
+        # Records are live dicts the owning job may be updating; retry if one changes size mid-dump
+        for attempt in range(3):
+            try:
+                return json.dumps(record)
+            except RuntimeError:
+                if attempt == 2:
+                    raise
+
+    def _upsert(self, conn, rows):
+        dialect = self.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+            statement = dialect_insert(job_records)
+            statement = statement.on_conflict_do_update(
+                index_elements=['kind', 'record_id'],
+                set_={'data': statement.excluded.data, 'updated_at': statement.excluded.updated_at}
+            )
+            conn.execute(statement, rows)
+            return
+
+        for row in rows:
+            conn.execute(delete(job_records).where(
+                job_records.c.kind == row['kind'], job_records.c.record_id == row['record_id']
+            ))
+        conn.execute(insert(job_records), rows)
+
+    def purge_stale(self, cutoff):
+        """Delete records last written before cutoff, e.g. left behind by a process that died"""
+        with self.engine.begin() as conn:
+            result = conn.execute(delete(job_records).where(job_records.c.updated_at < cutoff))
+        return result.rowcount
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.time() - self._last_purge > self.stale_after / 24:
+                    self._last_purge = time.time()
+                    self.purge_stale(time.time() - self.stale_after)
+            except Exception as e:
+                logging.error(f"Job store flush failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'backend': self.engine.dialect.name,
+            'pending': pending,
+            'writes': self.writes,
+            'flushes': self.flushes
+        }
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """Process-wide job store, or None when JOB_STORE_URL is 'memory'
+
+    JOB_STORE_URL (falling back to DATABASE_URL) selects the database; without either,
+    a SQLite file in the temp directory is shared by all workers on this host.
+    """
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            url = os.environ.get('JOB_STORE_URL') or os.environ.get('DATABASE_URL')
+            if url == 'memory':
+                return None
+            if url and url.startswith('postgres://'):
+                # SQLAlchemy only accepts the postgresql:// scheme
+                url = 'postgresql://' + url[len('postgres://'):]
+            if not url:
+                url = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'm3u8_jobs.sqlite3')
+            _shared_store = JobStore(url)
+        return _shared_store
@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.events import progress_broker
+from utils.metrics import jobs_finished_total
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobManager:
+    """Runs single download jobs on a bounded background executor
+
+    submit() returns a task ID immediately; the job function receives that task ID so
+    its progress lands in the downloader's progress_data under the same key.
+    """
+
+    def __init__(self, downloader, max_workers=4, max_pending=100):
+        self.downloader = downloader
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download-job')
+        self.jobs = {}
+        self._lock = threading.Lock()
+        # Job records are saved alongside the downloader's progress so any process can serve them
+        self.job_store = downloader.job_store
+
+    def submit(self, run, url, kind='download', task_id=None):
+        """Queue run(task_id) -> output_file and return the new task ID
+
+        kind is 'download' or 'recording' (a live stream that can be cancelled). Passing
+        the task_id of a failed or interrupted job runs it again under the same ID, so a
+        checkpointed download resumes where it stopped.
+        """
+        with self._lock:
+            pending = sum(1 for job in self.jobs.values() if job['status'] in ('queued', 'running'))
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs ({pending}), try again later")
+
+            task_id = task_id or self.downloader.new_task_id()
+            self.jobs[task_id] = {
+                'task_id': task_id,
+                'url': url,
+                'kind': kind,
+                'status': 'queued',
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'output_file': None,
+                'error': None
+            }
+
+        if kind == 'recording':
+            # Cancelling a recording that is still queued must not depend on the job store
+            self.downloader.expect_cancel(task_id)
+        self.downloader.update_progress(task_id, 0, 'Queued...')
+        self._save(self.jobs[task_id])
+        self.executor.submit(self._run, task_id, run)
+        logging.info(f"Queued job {task_id} for {url}")
+        return task_id
+
+    def _run(self, task_id, run):
+        job = self.jobs[task_id]
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        self._publish(job)
+
+        self.downloader.begin_task(task_id)
+        try:
+            output_file = run(task_id)
+            if not output_file:
+                raise Exception("Failed to process video")
+            job['output_file'] = output_file
+            self.downloader.update_progress(task_id, 100, 'Download complete!')
+            status = 'completed'
+        except Exception as e:
+            logging.error(f"Job {task_id} failed: {str(e)}")
+            job['error'] = str(e)
+            self.downloader.update_progress(task_id, 0, f'Error: {str(e)}')
+            status = 'failed'
+        finally:
+            self.downloader.end_task(task_id)
+
+        # Status changes last so anything watching for it sees the final progress too
+        job['finished_at'] = time.time()
+        job['status'] = status
+        jobs_finished_total.inc(status=status)
+        self._publish(job)
+
+    def _save(self, job):
+        if self.job_store:
+            self.job_store.save('job', job['task_id'], job, flush=True)
+
+    def _publish(self, job):
+        """Push job state changes to event stream subscribers and the job store"""
+        self._save(job)
+        progress_broker.publish(f"task:{job['task_id']}", 'job', {
+            'status': job['status'],
+            'error': job['error'],
+            'ready': job['status'] == 'completed'
+        })
+
+    def _find(self, task_id):
+        """Local job record, or the stored one when another process runs the job"""
+        job = self.jobs.get(task_id)
+        if job is None and self.job_store:
+            job = self.job_store.load('job', task_id)
+        return job
+
+    def is_local(self, task_id):
+        """Whether this process runs the job (and so publishes its progress events)"""
+        return task_id in self.jobs
+
+    def is_finished(self, task_id):
+        """Whether a job has completed or failed (unknown IDs count as finished)"""
+        job = self._find(task_id)
+        return job is None or job['status'] in ('completed', 'failed')
+
+    def get_job(self, task_id):
+        """Job record merged with its latest progress, or None for unknown IDs"""
+        job = self._find(task_id)
+        if job is None:
+            return None
+
+        progress = self.downloader.get_progress(task_id)
+        status = {key: value for key, value in job.items() if key != 'output_file'}
+        status['percent'] = progress['percent']
+        status['message'] = progress['status']
+        status['ready'] = job['status'] == 'completed'
+        # Seconds per stage, to tell queueing, network, disk and ffmpeg time apart
+        status['timings'] = dict(progress.get('timings') or {})
+        if job['started_at'] is not None:
+            status['timings']['queued'] = round(job['started_at'] - job['created_at'], 3)
+        return status
+
+    def counts(self):
+        """Number of local jobs per status"""
+        counts = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0}
+        for job in list(self.jobs.values()):
+            counts[job['status']] += 1
+        return counts
+
+    def reclaimable(self):
+        """(finished_at, task_id, 0) for every finished job; its files belong to the downloader"""
+        for task_id, job in list(self.jobs.items()):
+            if job['finished_at'] is not None:
+                yield job['finished_at'], task_id, 0
+
+    def release(self, task_id):
+        """Forget a finished job record"""
+        self.jobs.pop(task_id, None)
+        if self.job_store:
+            self.job_store.delete('job', task_id)
+
+    def get_output_file(self, task_id):
+        """Output path of a completed job, or None"""
+        job = self._find(task_id)
+        if job is None or job['status'] != 'completed':
+            return None
+        return job['output_file']
@@ -0,0 +1,188 @@
+import re
+import json
+from collections import namedtuple
+from urllib.parse import urljoin
+
+# Longest URL considered when growing a token around an extension match
+MAX_LINK_LENGTH = 2048
+
+# Characters that end an unquoted or quoted link token
+TOKEN_DELIMITERS = ' \t\r\n\f\v"\'`<>'
+QUOTES = '"\'`'
+# Punctuation that ends a sentence or closes a bracket around a link in prose, not part of the URL
+TRAILING_PUNCTUATION = ',.;:)]\'"'
+
+HLS_TYPES = ('application/x-mpegurl', 'application/vnd.apple.mpegurl', 'audio/mpegurl')
+DASH_TYPES = ('application/dash+xml',)
+
+ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))')
+EXTENSION_PATTERN = re.compile(r'\.(?:m3u8|mpd)\b', re.IGNORECASE)
+TOKEN_END_PATTERN = re.compile(r'[^\s"\'`<>]*')
+# Start of a URL inside a longer token: a scheme, or // opening an attribute value, parameter or url(...)
+EMBEDDED_LINK_PATTERN = re.compile(r'https?:(?:\\?/){2}|(?<=[=(,])(?:\\?/){2}', re.IGNORECASE)
+
+ScanResult = namedtuple('ScanResult', ['links', 'iframes'])
+
+
+def link_kind(url, content_type=None):
+    """'hls', 'dash' or None, from a MIME type or the URL's extension"""
+    if content_type:
+        content_type = content_type.lower()
+        if content_type in HLS_TYPES:
+            return 'hls'
+        if content_type in DASH_TYPES:
+            return 'dash'
+    path = url.split('?', 1)[0].split('#', 1)[0].lower()
+    if path.endswith('.m3u8'):
+        return 'hls'
+    if path.endswith('.mpd'):
+        return 'dash'
+    return None
+
+
+def normalize_link(raw, base_url):
+    """Undo JSON/HTML escaping and resolve a link against the page URL"""
+    link = raw.strip().replace('\\/', '/').replace('\\u002F', '/').replace('\\u002f', '/').replace('&amp;', '&')
+    return urljoin(base_url, link)
+
+
+class LinkScanner:
+    """Finds streaming manifest links and iframes in one pass over a page
+
+    Every strategy contributes an anchor pattern; the anchors are combined into a
+    single compiled alternation so the page is scanned once, and each match is handed
+    to the strategy that owns its named group. Strategies only look at the text around
+    their match (bounded by MAX_LINK_LENGTH or the tag), keeping the cost linear in
+    page size. Add a strategy with add_strategy(name, pattern, handler), where
+    handler(scanner, match, html, base_url, found) calls found.add_link / found.add_iframe.
+    """
+
+    def __init__(self):
+        self._strategies = []
+        self._pattern = None
+        self.add_strategy('extension', EXTENSION_PATTERN.pattern, _scan_extension)
+        self.add_strategy('media_tag', r'<(?:video|source|iframe)\b[^>]*>', _scan_media_tag)
+        self.add_strategy('json_ld', r'<script\b[^>]*application/ld\+json[^>]*>', _scan_json_ld)
+
+    def add_strategy(self, name, pattern, handler):
+        self._strategies.append((name, pattern, handler))
+        self._handlers = {name: handler for name, _, handler in self._strategies}
+        self._pattern = re.compile(
+            '|'.join(f'(?P<{name}>{pattern})' for name, pattern, _ in self._strategies), re.IGNORECASE
+        )
+
+    def scan(self, html, base_url):
+        """Return ScanResult(links=[(url, kind), ...], iframes=[url, ...]), deduplicated in page order"""
+        found = _Found(base_url)
+        for match in self._pattern.finditer(html):
+            self._handlers[match.lastgroup](self, match, html, base_url, found)
+        return ScanResult(list(found.links.items()), list(found.iframes))
+
+    def scan_fragment(self, text, base_url, found):
+        """Run the extension strategy over a small piece of text (e.g. one tag)"""
+        token_end, found.token_end = found.token_end, 0
+        for match in EXTENSION_PATTERN.finditer(text):
+            _scan_extension(self, match, text, base_url, found)
+        found.token_end = token_end
+
+
+class _Found:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.links = {}  # url -> kind, insertion ordered
+        self.iframes = {}
+        self.seen = set()  # raw tokens already handled, so repeats skip normalization
+        self.token_end = 0  # end of the last token grown by the extension strategy
+
+    def add_link(self, raw, kind=None):
+        if (raw, kind) in self.seen:
+            return
+        self.seen.add((raw, kind))
+        url = normalize_link(raw, self.base_url)
+        kind = kind or link_kind(url)
+        if kind and url.startswith(('http://', 'https://')) and url not in self.links:
+            self.links[url] = kind
+
+    def add_iframe(self, raw):
+        url = normalize_link(raw, self.base_url)
+        if url.startswith(('http://', 'https://')):
+            self.iframes.setdefault(url, None)
+
+
+def _scan_extension(scanner, match, html, base_url, found):
+    """Grow the token containing a .m3u8/.mpd match out to its delimiters"""
+    if match.start() < found.token_end:
+        # Part of the token grown for an earlier match
+        return
+    # Never look back past the previous token, so every character is examined a bounded number of times
+    window_start = max(found.token_end, match.start() - MAX_LINK_LENGTH)
+    start = max(html.rfind(char, window_start, match.start()) for char in TOKEN_DELIMITERS) + 1
+    start = max(start, window_start)
+    end = TOKEN_END_PATTERN.match(html, match.end(), match.end() + MAX_LINK_LENGTH).end()
+    token = html[start:end]
+    found.token_end = end
+
+    # The manifest can sit inside a longer token: an unquoted attribute (href=https://...),
+    # a query parameter (player?src=https://...) or CSS url(https://...)
+    embedded = None
+    for embedded in EMBEDDED_LINK_PATTERN.finditer(token, 1, match.start() - start):
+        pass
+    if embedded is not None:
+        if token[embedded.start() - 1] == '=':
+            # An unencoded parameter value ends at the next parameter
+            next_parameter = token.find('&', match.end() - start)
+            if next_parameter >= 0:
+                token = token[:next_parameter]
+        token = token[embedded.start():]
+    token = token.rstrip(TRAILING_PUNCTUATION)
+
+    # Relative links only count inside quotes (attribute values, JS/JSON strings)
+    quoted = start > 0 and html[start - 1] in QUOTES
+    if token.startswith(('http://', 'https://', '//', 'http:\\/\\/', 'https:\\/\\/', '\\/\\/')) or quoted:
+        found.add_link(token)
+
+
+def _scan_media_tag(scanner, match, html, base_url, found):
+    """<video>/<source> src with an HLS/DASH type or extension, and <iframe> sources"""
+    tag = match.group(0)
+    attributes = {}
+    for attr in ATTRIBUTE_PATTERN.finditer(tag):
+        attributes[attr.group(1).lower()] = next(value for value in attr.groups()[1:] if value is not None)
+
+    src = attributes.get('src') or attributes.get('data-src')
+    if tag[1:7].lower() == 'iframe':
+        if src:
+            found.add_iframe(src)
+    elif src:
+        url = normalize_link(src, base_url)
+        kind = link_kind(url, attributes.get('type'))
+        if kind:
+            found.add_link(src, kind)
+
+    # Links inside other attributes, e.g. a player URL carrying the manifest as a parameter
+    scanner.scan_fragment(tag, base_url, found)
+
+
+def _scan_json_ld(scanner, match, html, base_url, found):
+    """contentUrl/embedUrl/url values of VideoObject-style JSON-LD blocks"""
+    end = html.find('</script>', match.end())
+    if end < 0:
+        return
+    try:
+        data = json.loads(html[match.end():end])
+    except ValueError:
+        return
+
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            for key in ('contentUrl', 'embedUrl', 'url'):
+                value = node.get(key)
+                if isinstance(value, str):
+                    kind = link_kind(value, node.get('encodingFormat'))
+                    if kind:
+                        found.add_link(value, kind)
+            stack.extend(value for value in node.values() if isinstance(value, (dict, list)))
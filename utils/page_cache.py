@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+DEFAULT_PAGE_TTL = 60  # seconds a fetched page is served without revalidation
+DEFAULT_PAGE_ENTRIES = 256
+DEFAULT_LINK_TTL = 5 * 60  # reachable manifest links
+DEFAULT_DEAD_LINK_TTL = 30  # unreachable ones are retried sooner
+
+# url is the final URL after redirects, used to resolve relative links
+CachedPage = namedtuple('CachedPage', ['text', 'url', 'etag', 'last_modified'])
+
+
+class TTLCache:
+    """Bounded LRU map whose entries go stale after a per-entry TTL
+
+    Stale entries are kept until evicted so callers can revalidate them (e.g. with
+    an ETag) instead of starting over.
+    """
+
+    def __init__(self, max_entries=DEFAULT_PAGE_ENTRIES, ttl=DEFAULT_PAGE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def get(self, key):
+        """(value, fresh) for a cached key, or (None, False)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            value, expires_at = entry
+            fresh = time.time() < expires_at
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value, fresh
+
+    def put(self, key, value, ttl=None, revalidated=False):
+        with self._lock:
+            self._entries[key] = (value, time.time() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            if revalidated:
+                self.revalidated += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated
+            }
@@ -0,0 +1,322 @@
+import re
+from array import array
+from collections import namedtuple
+from urllib.parse import urljoin
+
+# KEY=VALUE pairs in tag attribute lists, values may be quoted and contain commas
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+VARIANT_POLICIES = ('max_bandwidth', 'max_resolution', 'byte_budget')
+
+# Segment flag bits stored in SegmentTable.flags
+FLAG_DISCONTINUITY = 0x01
+
+# Upper bound for one coalesced EXT-X-BYTERANGE request
+DEFAULT_MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+Segment = namedtuple('Segment', ['index', 'uri', 'duration', 'offset', 'length', 'discontinuity'])
+InitSegment = namedtuple('InitSegment', ['uri', 'offset', 'length'])
+# One HTTP request covering segments first..last (offset/length are None for whole-file fetches)
+FetchGroup = namedtuple('FetchGroup', ['uri', 'offset', 'length', 'first', 'last'])
+
+
+def parse_attributes(attribute_list):
+    """Parse an HLS attribute list such as BANDWIDTH=800000,RESOLUTION=640x360"""
+    attributes = {}
+    for key, value in ATTRIBUTE_PATTERN.findall(attribute_list):
+        attributes[key] = value[1:-1] if value.startswith('"') else value
+    return attributes
+
+
+def resolve_uri(uri, base_url):
+    """Resolve a playlist URI against the playlist's own URL"""
+    if uri.startswith('http'):
+        return uri
+    return urljoin(base_url, uri)
+
+
+class Variant:
+    def __init__(self, uri, bandwidth, average_bandwidth=None, resolution=None, codecs=None):
+        self.uri = uri
+        self.bandwidth = bandwidth
+        self.average_bandwidth = average_bandwidth
+        self.resolution = resolution
+        self.codecs = codecs
+
+    @property
+    def width(self):
+        return self.resolution[0] if self.resolution else None
+
+    @property
+    def height(self):
+        return self.resolution[1] if self.resolution else None
+
+    def estimated_bytes(self, duration):
+        """Estimate the download size of this variant for a given duration in seconds"""
+        bits_per_second = self.average_bandwidth or self.bandwidth
+        return int(bits_per_second * duration / 8)
+
+    def __repr__(self):
+        resolution = f"{self.width}x{self.height}" if self.resolution else 'unknown'
+        return f"Variant(bandwidth={self.bandwidth}, resolution={resolution}, uri={self.uri!r})"
+
+
+def parse_byte_range(value, default_offset=0):
+    """Parse an EXT-X-BYTERANGE value of the form <length>[@<offset>]"""
+    length, _, offset = value.strip().partition('@')
+    return int(offset) if offset else default_offset, int(length)
+
+
+class SegmentTable:
+    """Compact, array-backed table of media segments
+
+    Each segment is a row across parallel typed arrays; URIs are stored once and
+    referenced by index, so byte-range playlists pointing into a single file cost
+    a few dozen bytes per segment instead of a Python string each.
+    """
+
+    def __init__(self):
+        self.uris = []
+        self._uri_lookup = {}
+        self.uri_index = array('I')
+        self.durations = array('d')
+        self.offsets = array('q')  # -1 when the segment is a whole resource
+        self.lengths = array('q')  # -1 when the segment is a whole resource
+        self.flags = bytearray()
+
+    def append(self, uri, duration, offset=-1, length=-1, discontinuity=False):
+        """Add a segment row"""
+        uri_index = self._uri_lookup.get(uri)
+        if uri_index is None:
+            uri_index = len(self.uris)
+            self._uri_lookup[uri] = uri_index
+            self.uris.append(uri)
+
+        self.uri_index.append(uri_index)
+        self.durations.append(duration)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.flags.append(FLAG_DISCONTINUITY if discontinuity else 0)
+
+    def __len__(self):
+        return len(self.durations)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        offset = self.offsets[index]
+        return Segment(
+            index=index,
+            uri=self.uris[self.uri_index[index]],
+            duration=self.durations[index],
+            offset=offset if offset >= 0 else None,
+            length=self.lengths[index] if offset >= 0 else None,
+            discontinuity=bool(self.flags[index] & FLAG_DISCONTINUITY)
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def uri(self, index):
+        return self.uris[self.uri_index[index]]
+
+    @property
+    def total_duration(self):
+        return sum(self.durations)
+
+    def tail(self, start):
+        """New table holding the rows from start onwards, e.g. the segments added by a live reload"""
+        table = SegmentTable()
+        for index in range(start, len(self)):
+            table.append(self.uri(index), self.durations[index], self.offsets[index], self.lengths[index],
+                         bool(self.flags[index] & FLAG_DISCONTINUITY))
+        return table
+
+    def fetch_groups(self, max_request_bytes=DEFAULT_MAX_REQUEST_BYTES):
+        """Group segments into HTTP requests
+
+        Byte-range segments that are adjacent in the same resource are merged into
+        one ranged GET of at most max_request_bytes; other segments get one request each.
+        """
+        groups = []
+        total = len(self)
+        first = 0
+
+        while first < total:
+            last = first
+            offset = self.offsets[first]
+
+            if offset < 0:
+                groups.append(FetchGroup(self.uri(first), None, None, first, first))
+                first += 1
+                continue
+
+            range_end = offset + self.lengths[first]
+            while (last + 1 < total
+                   and self.uri_index[last + 1] == self.uri_index[first]
+                   and self.offsets[last + 1] == range_end
+                   and range_end + self.lengths[last + 1] - offset <= max_request_bytes):
+                last += 1
+                range_end += self.lengths[last]
+
+            groups.append(FetchGroup(self.uri(first), offset, range_end - offset, first, last))
+            first = last + 1
+
+        return groups
+
+
+class MediaPlaylist:
+    def __init__(self, url):
+        self.url = url
+        self.segments = SegmentTable()
+        self.init_segment = None
+        self.target_duration = None
+        self.media_sequence = 0
+        self.endlist = False
+
+    @property
+    def duration(self):
+        return self.segments.total_duration
+
+    @property
+    def segment_urls(self):
+        """Per-segment URL list, for callers that only need plain URLs"""
+        return [self.segments.uri(i) for i in range(len(self.segments))]
+
+    def __len__(self):
+        return len(self.segments)
+
+
+def parse_media_playlist(playlist_content, base_url):
+    """Parse a media playlist into a MediaPlaylist with a compact segment table"""
+    playlist = MediaPlaylist(base_url)
+    duration = 0.0
+    byte_range = None
+    discontinuity = False
+    # EXT-X-BYTERANGE without @offset continues from the end of the previous range of the same URI
+    range_ends = {}
+
+    for line in playlist_content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('#'):
+            tag, _, value = line.partition(':')
+            if tag == '#EXTINF':
+                try:
+                    duration = float(value.split(',', 1)[0])
+                except ValueError:
+                    duration = 0.0
+            elif tag == '#EXT-X-BYTERANGE':
+                byte_range = value
+            elif tag == '#EXT-X-DISCONTINUITY':
+                discontinuity = True
+            elif tag == '#EXT-X-TARGETDURATION':
+                playlist.target_duration = float(value)
+            elif tag == '#EXT-X-MEDIA-SEQUENCE':
+                playlist.media_sequence = int(value)
+            elif tag == '#EXT-X-ENDLIST':
+                playlist.endlist = True
+            elif tag == '#EXT-X-MAP':
+                attributes = parse_attributes(value)
+                if 'URI' in attributes:
+                    offset, length = None, None
+                    if 'BYTERANGE' in attributes:
+                        offset, length = parse_byte_range(attributes['BYTERANGE'])
+                    playlist.init_segment = InitSegment(resolve_uri(attributes['URI'], base_url), offset, length)
+            continue
+
+        uri = resolve_uri(line, base_url)
+        offset, length = -1, -1
+        if byte_range is not None:
+            offset, length = parse_byte_range(byte_range, range_ends.get(uri, 0))
+            range_ends[uri] = offset + length
+
+        playlist.segments.append(uri, duration, offset, length, discontinuity)
+        duration = 0.0
+        byte_range = None
+        discontinuity = False
+
+    return playlist
+
+
+def is_master_playlist(playlist_content):
+    """Check whether a playlist lists variant streams rather than media segments"""
+    return '#EXT-X-STREAM-INF' in playlist_content
+
+
+def parse_master_playlist(playlist_content, base_url):
+    """Parse the variant streams of a master playlist"""
+    variants = []
+    pending_attributes = None
+
+    for line in playlist_content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            pending_attributes = parse_attributes(line.split(':', 1)[1])
+        elif not line.startswith('#') and pending_attributes is not None:
+            resolution = None
+            match = re.match(r'(\d+)x(\d+)', pending_attributes.get('RESOLUTION', ''))
+            if match:
+                resolution = (int(match.group(1)), int(match.group(2)))
+
+            variants.append(Variant(
+                uri=resolve_uri(line, base_url),
+                bandwidth=int(pending_attributes.get('BANDWIDTH', 0) or 0),
+                average_bandwidth=int(pending_attributes['AVERAGE-BANDWIDTH']) if pending_attributes.get('AVERAGE-BANDWIDTH') else None,
+                resolution=resolution,
+                codecs=pending_attributes.get('CODECS')
+            ))
+            pending_attributes = None
+
+    return variants
+
+
+def playlist_duration(playlist_content):
+    """Sum the #EXTINF durations of a media playlist"""
+    duration = 0.0
+    for line in playlist_content.splitlines():
+        if line.startswith('#EXTINF:'):
+            try:
+                duration += float(line[len('#EXTINF:'):].split(',', 1)[0])
+            except ValueError:
+                continue
+    return duration
+
+
+def select_variant(variants, policy='max_bandwidth', max_height=None, byte_budget=None, duration=None):
+    """Pick one variant from a master playlist
+
+    Policies:
+        max_bandwidth  - highest BANDWIDTH, optionally capped by max_height
+        max_resolution - highest resolution with height <= max_height
+        byte_budget    - highest BANDWIDTH whose estimated size for duration fits byte_budget
+    Falls back to the lowest-bandwidth variant when nothing satisfies the constraints.
+    """
+    if not variants:
+        raise Exception("Master playlist contains no variant streams")
+    if policy not in VARIANT_POLICIES:
+        raise Exception(f"Unknown variant policy: {policy}")
+
+    candidates = list(variants)
+
+    if max_height is not None:
+        # Variants without a RESOLUTION attribute (e.g. audio-only) cannot be checked, keep them
+        candidates = [v for v in candidates if v.height is None or v.height <= max_height]
+
+    if policy == 'byte_budget':
+        if byte_budget is None or duration is None:
+            raise Exception("byte_budget policy requires byte_budget and duration")
+        candidates = [v for v in candidates if v.estimated_bytes(duration) <= byte_budget]
+
+    if not candidates:
+        return min(variants, key=lambda v: v.bandwidth)
+
+    if policy == 'max_resolution':
+        return max(candidates, key=lambda v: ((v.height or 0) * (v.width or 0), v.bandwidth))
+    return max(candidates, key=lambda v: v.bandwidth)
@@ -0,0 +1,201 @@
+import os
+import hashlib
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+
+DEFAULT_OUTPUT_TTL = 60 * 60  # 1 hour
+DEFAULT_OUTPUT_BYTES = 10 * 1024 * 1024 * 1024  # 10 GiB
+
+
+class _Call:
+    def __init__(self, owner=None):
+        self.owner = owner
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution
+
+    The first caller for a key runs the function; callers arriving while it is in
+    flight block and receive the same result (or exception). The leader can name
+    itself with owner; a follower's follow(owner) context manager is held while it
+    waits, e.g. to mirror the leader's progress.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, owner=None, follow=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call(owner)
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            logging.info(f"Waiting on in-flight job for {key}")
+            with follow(call.owner) if follow is not None and call.owner is not None else nullcontext():
+                call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class OutputCache:
+    """Finished output files kept on disk with TTL and size-based eviction
+
+    Identical concurrent requests are coalesced through SingleFlight, and the finished
+    file is moved into the cache directory so later requests are served from disk.
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_OUTPUT_TTL, max_bytes=DEFAULT_OUTPUT_BYTES):
+        self.cache_dir = cache_dir or tempfile.mkdtemp(prefix='m3u8_output_cache_')
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (path, size, created_at), oldest first
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Return the cached output path for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[2] > self.ttl:
+                self._remove(key)
+                self.evictions += 1
+                entry = None
+
+            if entry is None or not os.path.exists(entry[0]):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, output_file):
+        """Move a finished output into the cache and return its new path"""
+        digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+        cached_path = os.path.join(self.cache_dir, digest + os.path.splitext(output_file)[1])
+        shutil.move(output_file, cached_path)
+        size = os.path.getsize(cached_path)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, delete_file=False)
+            self._entries[key] = (cached_path, size, time.time())
+            self.current_bytes += size
+            self._evict(keep=key)
+
+        return cached_path
+
+    def get_or_create(self, key, producer, owner=None, follow=None):
+        """Return the cached output for key, or run producer once for all concurrent callers
+
+        owner and follow are passed to SingleFlight.do, so callers that wait on another
+        caller's producer can track it (e.g. by task ID).
+        """
+        cached_path = self.get(key)
+        if cached_path:
+            logging.info(f"Serving cached output for {key}")
+            return cached_path
+        return self._flight.do(key, lambda: self._produce(key, producer), owner=owner, follow=follow)
+
+    def _produce(self, key, producer):
+        # A previous leader may have finished between our lookup and taking the lead
+        cached_path = self.get(key)
+        if cached_path:
+            return cached_path
+
+        output_file = producer()
+        if not output_file or not os.path.exists(output_file):
+            return output_file
+        return self.put(key, output_file)
+
+    def _remove(self, key, delete_file=True):
+        """Drop an entry (lock held)"""
+        path, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+        if delete_file:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self, keep=None):
+        """Drop expired entries, then oldest ones until within the byte budget (lock held)"""
+        now = time.time()
+        for key, (_, _, created_at) in list(self._entries.items()):
+            if key != keep and now - created_at > self.ttl:
+                self._remove(key)
+                self.evictions += 1
+
+        for key in list(self._entries):
+            if self.current_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            self.evictions += 1
+
+    def reclaimable(self):
+        """(created_at, key, bytes) for every cached output, for the janitor"""
+        with self._lock:
+            entries = list(self._entries.items())
+        for key, (_, size, created_at) in entries:
+            yield created_at, key, size
+
+    def release(self, key):
+        """Drop one cached output"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.evictions += 1
+
+    def stats(self):
+        """Cache counters and usage"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'in_flight': self._flight.in_flight(),
+                'coalesced': self._flight.coalesced
+            }
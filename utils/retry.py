@@ -0,0 +1,74 @@
+import random
+import threading
+from collections import deque
+
+import requests
+
+# HTTP statuses worth retrying; other 4xx responses will not change on a second attempt
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    """Whether a failed fetch may succeed if tried again"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRYABLE_STATUS
+    # Connection errors, timeouts and short reads
+    return True
+
+
+def backoff_delay(attempt, base=0.5, cap=10.0, error=None):
+    """Exponential backoff with full jitter, honouring a numeric Retry-After header"""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(cap, float(retry_after)))
+
+    return delay
+
+
+class LatencyTracker:
+    """Sliding window of recent request latencies"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent):
+        """Latency at the given percentile, or None until enough samples exist"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+class OriginLatencyTracker:
+    """One latency window per origin, so a slow CDN does not set the pace for a fast one"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._trackers = {}
+        self._lock = threading.Lock()
+
+    def _tracker(self, origin):
+        with self._lock:
+            tracker = self._trackers.get(origin)
+            if tracker is None:
+                tracker = self._trackers[origin] = LatencyTracker(self.window, self.min_samples)
+            return tracker
+
+    def record(self, origin, seconds):
+        self._tracker(origin).record(seconds)
+
+    def percentile(self, origin, percent):
+        """Latency of origin at the given percentile, or None until it has enough samples"""
+        return self._tracker(origin).percentile(percent)
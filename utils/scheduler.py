@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Lower value is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+DEFAULT_MAX_FETCHES = 32
+
+
+def available_cpus():
+    """Cores this process may run on, which can be fewer than the machine has (affinity, cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def default_max_merges():
+    """One ffmpeg per available core, less one kept free for the web process and downloads"""
+    return max(1, available_cpus() - 1)
+
+
+class SlotPool:
+    """Counting semaphore that grants waiters by priority, round-robin between flows
+
+    A flow is one job or one batch. Within a priority level the flow that was served
+    longest ago goes next, so a flow with many queued requests cannot starve the others.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self.active = 0
+        self.granted = 0
+        # Total seconds callers spent queued for a slot
+        self.wait_seconds = 0.0
+        self._waiting = {}  # priority -> OrderedDict(flow -> deque of events)
+        self._lock = threading.Lock()
+
+    def acquire(self, flow, priority=PRIORITY_INTERACTIVE):
+        """Take a slot, queueing if none is free, and return the seconds spent queued"""
+        with self._lock:
+            if self.active < self.limit and not self._waiting:
+                self.active += 1
+                self.granted += 1
+                return 0.0
+            ticket = threading.Event()
+            flows = self._waiting.setdefault(priority, OrderedDict())
+            flows.setdefault(flow, deque()).append(ticket)
+        queued = time.monotonic()
+        ticket.wait()
+        waited = time.monotonic() - queued
+        with self._lock:
+            self.wait_seconds += waited
+        return waited
+
+    def try_acquire(self, priority=PRIORITY_INTERACTIVE):
+        """Take a slot only if one is free and no caller of the same or higher priority is queued"""
+        with self._lock:
+            if self.active < self.limit and not any(level <= priority for level in self._waiting):
+                self.active += 1
+                self.granted += 1
+                return True
+            return False
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            while self.active < self.limit and self._waiting:
+                priority = min(self._waiting)
+                flows = self._waiting[priority]
+                flow, tickets = next(iter(flows.items()))
+                ticket = tickets.popleft()
+                # Rotate the served flow to the back of its level
+                if tickets:
+                    flows.move_to_end(flow)
+                else:
+                    del flows[flow]
+                if not flows:
+                    del self._waiting[priority]
+                self.active += 1
+                self.granted += 1
+                ticket.set()
+
+    def has_capacity(self):
+        with self._lock:
+            return self.active < self.limit and not self._waiting
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'waiting': sum(len(tickets) for flows in self._waiting.values() for tickets in flows.values()),
+                'waiting_flows': sum(len(flows) for flows in self._waiting.values()),
+                'granted': self.granted,
+                'wait_seconds': round(self.wait_seconds, 3)
+            }
+
+
+class TokenBucket:
+    """Global byte-rate budget; callers that overdraw sleep off their share of the debt"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.throttled_seconds = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.throttled_seconds += delay
+        if delay:
+            time.sleep(delay)
+
+
+class FairScheduler:
+    """Process-wide budget for segment fetches and ffmpeg merges
+
+    Every network request for segment data and every ffmpeg merge runs inside a slot,
+    so the number of concurrent fetches and merges on the box stays bounded however
+    many jobs and batches are active. An optional byte rate caps total download bandwidth.
+
+    Pipelined remuxes, whose ffmpeg lives as long as the download and mostly waits on
+    the network, count against their own 'pipe' budget so they never hold up merges.
+    """
+
+    def __init__(self, max_fetches=DEFAULT_MAX_FETCHES, max_merges=None, bytes_per_second=None, max_pipes=None):
+        self.pools = {
+            'fetch': SlotPool(max_fetches),
+            'merge': SlotPool(max_merges or default_max_merges()),
+            'pipe': SlotPool(max_pipes or default_max_merges())
+        }
+        self.bandwidth = TokenBucket(bytes_per_second) if bytes_per_second else None
+
+    @contextmanager
+    def slot(self, kind, flow, priority=PRIORITY_INTERACTIVE, block=True):
+        """Hold one 'fetch', 'merge' or 'pipe' slot for the duration of the block
+
+        The block receives the seconds spent queued for the slot. With block=False
+        nothing is queued: the block receives None and runs without a slot unless
+        one was free.
+        """
+        pool = self.pools[kind]
+        if block:
+            waited = pool.acquire(flow, priority)
+        else:
+            waited = 0.0 if pool.try_acquire(priority) else None
+        try:
+            yield waited
+        finally:
+            if waited is not None:
+                pool.release()
+
+    def has_capacity(self, kind):
+        return self.pools[kind].has_capacity()
+
+    def throttle(self, nbytes):
+        """Charge downloaded bytes against the bandwidth budget, sleeping if it is exhausted"""
+        if self.bandwidth is not None:
+            self.bandwidth.consume(nbytes)
+
+    def stats(self):
+        stats = {kind: pool.stats() for kind, pool in self.pools.items()}
+        stats['bytes_per_second'] = self.bandwidth.rate if self.bandwidth else None
+        stats['throttled_seconds'] = round(self.bandwidth.throttled_seconds, 3) if self.bandwidth else 0
+        return stats
+
+
+_shared_scheduler = None
+_shared_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Process-wide scheduler shared by every downloader instance"""
+    global _shared_scheduler
+    with _shared_scheduler_lock:
+        if _shared_scheduler is None:
+            max_merges = os.environ.get('SCHEDULER_MAX_MERGES')
+            max_pipes = os.environ.get('SCHEDULER_MAX_PIPES')
+            bytes_per_second = os.environ.get('SCHEDULER_BYTES_PER_SECOND')
+            _shared_scheduler = FairScheduler(
+                max_fetches=int(os.environ.get('SCHEDULER_MAX_FETCHES', DEFAULT_MAX_FETCHES)),
+                max_merges=int(max_merges) if max_merges else None,
+                bytes_per_second=int(bytes_per_second) if bytes_per_second else None,
+                max_pipes=int(max_pipes) if max_pipes else None
+            )
+        return _shared_scheduler
@@ -0,0 +1,296 @@
+import os
+import hashlib
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from utils.transfer import link_or_copy
+
+DEFAULT_CACHE_BYTES = 2 * 1024 * 1024 * 1024  # 2 GiB
+
+# Default cache directories are per process: <temp dir>/m3u8_segment_cache_<pid>
+CACHE_DIR_PREFIX = 'm3u8_segment_cache_'
+
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        # os.kill would terminate the process rather than probe it
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists, owned by another user
+    return True
+
+
+def remove_orphaned_caches(parent=None):
+    """Delete default cache directories whose process is no longer running"""
+    parent = parent or tempfile.gettempdir()
+    try:
+        names = os.listdir(parent)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(CACHE_DIR_PREFIX):
+            continue
+        try:
+            pid = int(name[len(CACHE_DIR_PREFIX):])
+        except ValueError:
+            continue
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+        logging.info(f"Removed segment cache of exited process {pid}")
+
+
+class SegmentCache:
+    """Content-addressed on-disk cache of segment bytes with LRU eviction
+
+    Entries are keyed by segment URL plus byte range; the bytes are stored once per
+    SHA-256 digest, so the same segment served under different (e.g. tokenized) URLs
+    only takes disk space once. The byte budget counts unique blobs.
+
+    The cache is also a janitor source: entries are reclaimable in least recently
+    used order, so the disk budget and record TTL apply to cached segments as well.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_CACHE_BYTES, revalidate=False):
+        owned = cache_dir is None
+        if owned:
+            # Workers that died without cleaning up leave their whole cache behind
+            remove_orphaned_caches()
+            cache_dir = os.path.join(tempfile.gettempdir(), f'{CACHE_DIR_PREFIX}{os.getpid()}')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Send If-None-Match for cached entries with an ETag instead of trusting them blindly
+        self.revalidate = revalidate
+        self._entries = OrderedDict()  # key -> (digest, etag, last used), least recently used first
+        self._blobs = {}  # digest -> [size, refcount]
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+        if owned:
+            # The index lives in memory, so blobs left by an earlier process with this PID are unreachable.
+            # A directory passed in by the caller is never wiped, whatever else it holds
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        logging.info(f"Segment cache directory created: {self.cache_dir}")
+
+    @staticmethod
+    def make_key(url, offset=None, length=None):
+        """Cache key for a whole resource or a byte range of it"""
+        if offset is None:
+            return url
+        return f"{url}#bytes={offset}-{offset + length - 1}"
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _touch(self, key):
+        """Entry for key marked most recently used, or None (lock held)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        entry = self._entries[key] = (entry[0], entry[1], time.time())
+        return entry
+
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss"""
+        with self._lock:
+            entry = self._touch(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            path = self._blob_path(entry[0])
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.discard(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def link_to(self, key, dest_path):
+        """Place the cached bytes for key at dest_path (hard link, or copy)
+
+        Returns (size, digest) of the placed bytes, or None on a miss.
+        """
+        with self._lock:
+            entry = self._touch(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            digest = entry[0]
+            size = self._blobs[digest][0]
+            path = self._blob_path(digest)
+
+        try:
+            link_or_copy(path, dest_path)
+        except OSError:
+            self.discard(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return size, digest
+
+    def etag(self, key):
+        """ETag stored with a cached entry, if any"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry else None
+
+    def mark_revalidated(self, key):
+        """Record that the origin confirmed a cached entry with 304 Not Modified"""
+        with self._lock:
+            self.revalidations += 1
+
+    def put(self, key, data, etag=None):
+        """Store bytes for key, evicting least recently used entries over the byte budget"""
+        size = len(data)
+        if size > self.max_bytes:
+            return
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+
+        if not self._has_blob(digest, path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial_path = f"{path}.{threading.get_ident()}.part"
+            with open(partial_path, 'wb') as f:
+                f.write(data)
+            os.replace(partial_path, path)
+
+        self._add_entry(key, digest, size, etag)
+
+    def put_file(self, key, file_path, size, digest, etag=None):
+        """Store a finished file for key, given the size and SHA-256 computed while it was written
+
+        The blob is hard-linked to the file where possible, so caching costs no extra copy.
+        """
+        if size > self.max_bytes:
+            return
+
+        path = self._blob_path(digest)
+        if not self._has_blob(digest, path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial_path = f"{path}.{threading.get_ident()}.part"
+            link_or_copy(file_path, partial_path)
+            os.replace(partial_path, path)
+
+        self._add_entry(key, digest, size, etag)
+
+    def _has_blob(self, digest, path):
+        with self._lock:
+            if digest in self._blobs:
+                return True
+        return os.path.exists(path)
+
+    def _add_entry(self, key, digest, size, etag):
+        with self._lock:
+            if key in self._entries:
+                self._release(self._entries.pop(key)[0])
+
+            blob = self._blobs.get(digest)
+            if blob is None:
+                self._blobs[digest] = [size, 1]
+                self.current_bytes += size
+            else:
+                blob[1] += 1
+
+            self._entries[key] = (digest, etag, time.time())
+            self._evict()
+
+    def discard(self, key):
+        """Drop a single entry"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self._release(entry[0])
+
+    def _release(self, digest):
+        """Drop one reference to a blob, deleting it when unused (lock held)"""
+        blob = self._blobs.get(digest)
+        if blob is None:
+            return
+        blob[1] -= 1
+        if blob[1] <= 0:
+            del self._blobs[digest]
+            self.current_bytes -= blob[0]
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+
+    def _evict(self):
+        """Evict least recently used entries until within the byte budget (lock held)"""
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (digest, _, _) = self._entries.popitem(last=False)
+            self._release(digest)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove every cached entry"""
+        with self._lock:
+            for digest, _, _ in list(self._entries.values()):
+                self._release(digest)
+            self._entries.clear()
+
+    def reclaimable(self):
+        """(last used, key, bytes freed by dropping it) for every entry, for the janitor"""
+        with self._lock:
+            return [
+                (used_at, key, self._blobs[digest][0] if self._blobs[digest][1] == 1 else 0)
+                for key, (digest, _, used_at) in self._entries.items()
+            ]
+
+    def release(self, key):
+        """Drop an entry on behalf of the janitor"""
+        self.discard(key)
+
+    def stats(self):
+        """Cache counters and usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'blobs': len(self._blobs),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions
+            }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_segment_cache():
+    """Process-wide segment cache shared by every downloader instance"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            max_bytes = int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', DEFAULT_CACHE_BYTES))
+            _shared_cache = SegmentCache(max_bytes=max_bytes)
+        return _shared_cache
@@ -0,0 +1,126 @@
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+DEFAULT_TRANSFER_MEMORY = 64 * 1024 * 1024  # 64 MiB
+
+
+class BufferPool:
+    """Reusable fixed-size transfer buffers with a per-process memory ceiling
+
+    Every streamed download or file copy borrows one buffer for its duration, so the
+    memory held by in-flight transfers never exceeds max_bytes however many run at once;
+    extra transfers wait for a buffer to be returned.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=DEFAULT_TRANSFER_MEMORY):
+        self.chunk_size = chunk_size
+        self.max_buffers = max(1, max_bytes // chunk_size)
+        self._free = []
+        self._created = 0
+        self._condition = threading.Condition()
+        self.waits = 0
+
+    @contextmanager
+    def borrow(self):
+        with self._condition:
+            if not self._free and self._created >= self.max_buffers:
+                self.waits += 1
+                while not self._free:
+                    self._condition.wait()
+            if self._free:
+                buffer = self._free.pop()
+            else:
+                buffer = bytearray(self.chunk_size)
+                self._created += 1
+        try:
+            yield buffer
+        finally:
+            with self._condition:
+                self._free.append(buffer)
+                self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'chunk_size': self.chunk_size,
+                'max_bytes': self.max_buffers * self.chunk_size,
+                'allocated_bytes': self._created * self.chunk_size,
+                'in_use': self._created - len(self._free),
+                'waits': self.waits
+            }
+
+
+def iter_body(response, buffer):
+    """Yield memoryviews of a streamed (stream=True) response body read through buffer
+
+    Each view is only valid until the next one is requested.
+    """
+    if response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        # Compressed bodies go through requests' decoder; chunks are still bounded by the buffer size
+        for chunk in response.iter_content(len(buffer)):
+            yield memoryview(chunk)
+        return
+
+    view = memoryview(buffer)
+    while True:
+        count = response.raw.readinto(view)
+        if not count:
+            break
+        yield view[:count]
+
+
+def copy_range(src_fd, dst_fd, length, src_offset, dst_offset, buffers):
+    """Copy length bytes between two file descriptors at explicit offsets
+
+    Uses copy_file_range so the data stays in the kernel, falling back to a borrowed
+    buffer with pread/pwrite. Returns the number of bytes copied (short at end of file).
+    """
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < length:
+                count = os.copy_file_range(src_fd, dst_fd, length - copied, src_offset + copied, dst_offset + copied)
+                if not count:
+                    return copied
+                copied += count
+            return copied
+        except OSError:
+            # Not supported for this pair of files; continue from where the kernel stopped
+            pass
+
+    with buffers.borrow() as buffer:
+        view = memoryview(buffer)
+        while copied < length:
+            count = os.preadv(src_fd, [view[:min(len(view), length - copied)]], src_offset + copied)
+            if not count:
+                break
+            os.pwrite(dst_fd, view[:count], dst_offset + copied)
+            copied += count
+    return copied
+
+
+def link_or_copy(src_path, dst_path):
+    """Hard-link src_path at dst_path, copying instead when linking is not possible"""
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+
+
+_shared_buffers = None
+_shared_buffers_lock = threading.Lock()
+
+
+def get_buffer_pool():
+    """Process-wide transfer buffer pool shared by every downloader instance"""
+    global _shared_buffers
+    with _shared_buffers_lock:
+        if _shared_buffers is None:
+            _shared_buffers = BufferPool(
+                chunk_size=int(os.environ.get('TRANSFER_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)),
+                max_bytes=int(os.environ.get('TRANSFER_MEMORY_LIMIT', DEFAULT_TRANSFER_MEMORY))
+            )
+        return _shared_buffers